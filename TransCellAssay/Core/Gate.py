@@ -0,0 +1,95 @@
+# coding=utf-8
+"""
+Gates select cells by a condition on one channel (Ch1 > 1000), each gate is stored as a bit packed mask (numpy
+packbits, 1 bit per cell) and compound gates are expressions of gate names with boolean operators evaluated directly
+on packed masks :
+
+    "gfp & ~dead"           # & and, | or, ^ xor, ~ not, parenthesis (and, or, not also work)
+
+Masks of gates are computed once for a replica and reused by all expressions.
+"""
+
+import ast
+import numpy as np
+import logging
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+GATE_OPERATORS = {'>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal}
+
+
+def gate_mask(values, threshold, op='>'):
+    """
+    Compute bit packed mask of cells in gate, NaN are never in gate
+    :param values: numpy array of channel values
+    :param threshold: threshold value
+    :param op: comparison operator, >, >=, < or <=
+    :return: numpy array of uint8 (see numpy.packbits)
+    """
+    if op not in GATE_OPERATORS:
+        raise ValueError('Operator must be {}'.format(list(GATE_OPERATORS.keys())))
+    with np.errstate(invalid='ignore'):
+        return np.packbits(GATE_OPERATORS[op](values, threshold))
+
+
+def get_gate_names(expression):
+    """
+    Get names of gates used in an expression
+    :param expression: gate name or expression of gates
+    :return: list of gate name
+    """
+    names = []
+    for node in ast.walk(__parse(expression)):
+        if isinstance(node, ast.Name) and node.id not in names:
+            names.append(node.id)
+    return names
+
+
+def evaluate_gates(expression, masks):
+    """
+    Evaluate an expression of gates on bit packed masks, bits after last cell are undefined (see numpy.unpackbits
+    count)
+    :param expression: gate name or expression of gates with &, |, ^, ~ and parenthesis
+    :param masks: dict with gate name as key and bit packed mask as value
+    :return: bit packed mask
+    """
+    return __evaluate(__parse(expression).body, masks)
+
+
+def __parse(expression):
+    try:
+        return ast.parse(expression, mode='eval')
+    except SyntaxError:
+        raise ValueError('Wrong gate expression : {}'.format(expression))
+
+
+def __evaluate(node, masks):
+    if isinstance(node, ast.Name):
+        if node.id not in masks:
+            raise KeyError('Unknown gate : {}'.format(node.id))
+        return masks[node.id]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Invert, ast.Not)):
+        return np.invert(__evaluate(node.operand, masks))
+    if isinstance(node, ast.BinOp):
+        left = __evaluate(node.left, masks)
+        right = __evaluate(node.right, masks)
+        if isinstance(node.op, ast.BitAnd):
+            return np.bitwise_and(left, right)
+        if isinstance(node.op, ast.BitOr):
+            return np.bitwise_or(left, right)
+        if isinstance(node.op, ast.BitXor):
+            return np.bitwise_xor(left, right)
+    if isinstance(node, ast.BoolOp):
+        func = np.bitwise_and if isinstance(node.op, ast.And) else np.bitwise_or
+        result = __evaluate(node.values[0], masks)
+        for value in node.values[1:]:
+            result = func(result, __evaluate(value, masks))
+        return result
+    raise ValueError('Unsupported gate expression : {}'.format(ast.dump(node)))
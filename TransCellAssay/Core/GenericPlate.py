@@ -129,7 +129,6 @@ class GenericPlate(object):
         :param low_max_iter: lowess max iteration
         :param f: lowess smotting span
         """
-        global corrected_data_array
         __valid_sec_algo = ['Bscore', 'BZscore', 'PMP', 'MEA', 'DiffusionModel', 'Lowess', 'Polynomial']
 
         if algorithm not in __valid_sec_algo:
@@ -146,35 +145,10 @@ class GenericPlate(object):
 
             log.debug('Systematic Error Correction processing : {} -> replica {}'.format(algorithm, self.name))
 
-            if algorithm == 'Bscore':
-                ge, ce, re, corrected_data_array, tbl_org = TCA.bscore(self.array.copy(), max_iterations=max_iterations,
-                                                                       eps=epsilon, verbose=verbose)
-
-            if algorithm == 'BZscore':
-                ge, ce, re, corrected_data_array, tbl_org = TCA.bzscore(self.array.copy(),
-                                                                        max_iterations=max_iterations, eps=epsilon,
-                                                                        verbose=verbose)
-
-            if algorithm == 'PMP':
-                corrected_data_array = TCA.partial_mean_polish(self.array.copy(), max_iteration=max_iterations,
-                                                               verbose=verbose, alpha=alpha, epsilon=epsilon,
-                                                               skip_col=skip_col, skip_row=skip_row)
-
-            if algorithm == 'MEA':
-                corrected_data_array = TCA.matrix_error_amendmend(self.array.copy(), verbose=verbose, alpha=alpha,
-                                                                  skip_col=skip_col, skip_row=skip_row)
-
-            if algorithm == 'DiffusionModel':
-                corrected_data_array = TCA.diffusion_model(self.array.copy(), max_iterations=max_iterations,
-                                                           verbose=verbose)
-
-            if algorithm == 'Lowess':
-                corrected_data_array = TCA.lowess_fitting(self.array.copy(), max_iteration=low_max_iter,
-                                                          skip_col=skip_col, skip_row=skip_row, f=f)
-
-            if algorithm == 'Polynomial':
-                corrected_data_array = TCA.polynomial_fitting(self.array.copy(), degree=poly_deg, skip_col=skip_row,
-                                                              skip_row=skip_col)
+            corrected_data_array = correct_array(self.array.copy(), algorithm=algorithm, verbose=verbose,
+                                                 max_iterations=max_iterations, alpha=alpha, epsilon=epsilon,
+                                                 skip_col=skip_col, skip_row=skip_row, poly_deg=poly_deg,
+                                                 low_max_iter=low_max_iter, f=f)
 
             if save:
                 self.array_c = np.nan_to_num(corrected_data_array)
@@ -182,3 +156,42 @@ class GenericPlate(object):
                 self.SECNormMethod = algorithm
             else:
                 return corrected_data_array
+
+
+def correct_array(array, algorithm='Bscore', verbose=False, max_iterations=100, alpha=0.05, epsilon=0.01, skip_col=[],
+                  skip_row=[], poly_deg=4, low_max_iter=3, f=2./3.):
+    """
+    Apply a spatial normalization on a data array, module function so that it can be run in another process
+    (see GenericPlate.systematic_error_correction for parameters)
+    :param array: data array, can be modified by algorithm
+    :return: corrected array
+    """
+    corrected_data_array = None
+    if algorithm == 'Bscore':
+        ge, ce, re, corrected_data_array, tbl_org = TCA.bscore(array, max_iterations=max_iterations, eps=epsilon,
+                                                               verbose=verbose)
+
+    if algorithm == 'BZscore':
+        ge, ce, re, corrected_data_array, tbl_org = TCA.bzscore(array, max_iterations=max_iterations, eps=epsilon,
+                                                                verbose=verbose)
+
+    if algorithm == 'PMP':
+        corrected_data_array = TCA.partial_mean_polish(array, max_iteration=max_iterations, verbose=verbose,
+                                                       alpha=alpha, epsilon=epsilon, skip_col=skip_col,
+                                                       skip_row=skip_row)
+
+    if algorithm == 'MEA':
+        corrected_data_array = TCA.matrix_error_amendmend(array, verbose=verbose, alpha=alpha, skip_col=skip_col,
+                                                          skip_row=skip_row)
+
+    if algorithm == 'DiffusionModel':
+        corrected_data_array = TCA.diffusion_model(array, max_iterations=max_iterations, verbose=verbose)
+
+    if algorithm == 'Lowess':
+        corrected_data_array = TCA.lowess_fitting(array, max_iteration=low_max_iter, skip_col=skip_col,
+                                                  skip_row=skip_row, f=f)
+
+    if algorithm == 'Polynomial':
+        corrected_data_array = TCA.polynomial_fitting(array, degree=poly_deg, skip_col=skip_row, skip_row=skip_col)
+
+    return corrected_data_array
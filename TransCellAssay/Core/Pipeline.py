@@ -0,0 +1,264 @@
+# coding=utf-8
+"""
+Pipeline is a lazy query plan on replica or plate : transforms (filter, normalize, aggregate) are only recorded, and
+when a result is asked they are fused into as few passes as possible over cells :
+
+- consecutive filters are combined in one mask, filters before any normalization are evaluated during the scan of
+  raw data, a percentile filter following another filter start a new mask so that its percentile is computed on
+  kept cells (like chained channel_filtering)
+- only columns used by the plan are taken from raw data, in one copy of kept cells
+- consecutive normalizations with same parameters are done on all their channels in one pass
+- consecutive aggregations are computed in one well reduction
+
+Raw data of replica are never modified, explain() show the fused plan.
+"""
+
+import numpy as np
+import TransCellAssay as TCA
+import logging
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+class Pipeline(object):
+    """
+    Lazy query plan on replica or plate
+
+    self.target = target                # Replica or Plate object
+    self.steps = []                     # recorded transforms, list of (kind, parameters)
+    """
+
+    def __init__(self, target):
+        """
+        Constructor
+        :param target: Replica or Plate object
+        """
+        if not isinstance(target, (TCA.Core.Replica, TCA.Core.Plate)):
+            raise AttributeError("Unsupported Type")
+        self.target = target
+        self.steps = []
+
+    def filter(self, channel, value, exclude="lower", include=True, percent=False):
+        """
+        Keep cells by condition on a channel (see channel_filtering)
+        :param channel: on which channel to apply filtering
+        :param value: cut value, or dict with key are rep name and items the cut_value for each replica
+        :param exclude: exclude lower or upper value
+        :param include: include or not limit value
+        :param percent: cut value is a percentile of channel
+        :return: self
+        """
+        __valid_exclude = ["lower", "upper"]
+        if exclude not in __valid_exclude:
+            raise ValueError("Exclude must be {}".format(__valid_exclude))
+        self.__check_not_aggregated()
+        self.steps.append(('filter', {'channel': channel, 'value': value, 'exclude': exclude, 'include': include,
+                                      'percent': percent}))
+        return self
+
+    def normalize(self, channels, method='Zscore', log_t=True, neg=None, pos=None, skipping_wells=False,
+                  threshold=None):
+        """
+        Normalize single cell data of channels (see Replica.normalization_channels)
+        :param channels: channel or list of channels
+        :param method: which method to perform
+        :param log_t: Performed log2 Transformation
+        :param neg: negative control
+        :param pos: positive control
+        :param skipping_wells: skip defined wells, use it with poc and npi
+        :param threshold: used in background subtraction
+        :return: self
+        """
+        if not isinstance(channels, list):
+            channels = [channels]
+        self.__check_not_aggregated()
+        self.steps.append(('normalize', {'channels': channels, 'method': method, 'log_t': log_t, 'neg': neg,
+                                         'pos': pos, 'skipping_wells': skipping_wells, 'threshold': threshold}))
+        return self
+
+    def aggregate(self, channels, datatype=None):
+        """
+        Compute mean or median of wells, must be the last transforms of pipeline
+        :param channels: channel or list of channels
+        :param datatype: mean or median, default to datatype of replica
+        :return: self
+        """
+        if not isinstance(channels, list):
+            channels = [channels]
+        if len(self.steps) > 0 and self.steps[-1][0] == 'aggregate' and self.steps[-1][1]['datatype'] != datatype:
+            raise ValueError('Only one datatype can be aggregated in a pipeline')
+        self.steps.append(('aggregate', {'channels': channels, 'datatype': datatype}))
+        return self
+
+    def __check_not_aggregated(self):
+        if len(self.steps) > 0 and self.steps[-1][0] == 'aggregate':
+            raise ValueError('Aggregation must be the last transforms of pipeline')
+
+    def plan(self):
+        """
+        Fuse recorded transforms into stages
+        :return: list of (kind, parameters) stages, kind is scan, filter, normalize or aggregate
+        """
+        columns = []
+        for kind, param in self.steps:
+            for chan in ([param['channel']] if kind == 'filter' else param['channels']):
+                if chan not in columns:
+                    columns.append(chan)
+
+        stages = [['scan', {'columns': columns, 'filters': []}]]
+        for kind, param in self.steps:
+            last_kind, last = stages[-1]
+            if kind == 'filter':
+                # # value filters commute, a percentile depends on cells kept by previous filters
+                if last_kind in ('scan', 'filter') and not (param['percent'] and len(last['filters']) > 0):
+                    last['filters'].append(param)
+                else:
+                    stages.append(['filter', {'filters': [param]}])
+            elif kind == 'normalize':
+                same = (last_kind == 'normalize' and
+                        all(last[key] == param[key] for key in param if key != 'channels') and
+                        not set(last['channels']) & set(param['channels']))
+                if same:
+                    last['channels'] = last['channels'] + param['channels']
+                else:
+                    stages.append(['normalize', dict(param)])
+            elif kind == 'aggregate':
+                if last_kind == 'aggregate' and last['datatype'] == param['datatype']:
+                    last['channels'] = last['channels'] + [chan for chan in param['channels']
+                                                           if chan not in last['channels']]
+                else:
+                    stages.append(['aggregate', dict(param)])
+        return [tuple(stage) for stage in stages]
+
+    def explain(self):
+        """
+        Show the fused plan
+        :return: str
+        """
+        stages = self.plan()
+        lines = ['Pipeline on {0} {1} : {2} transforms in {3} passes over cells'.format(
+            type(self.target).__name__, self.target.name, len(self.steps), len(stages))]
+        for i, (kind, param) in enumerate(stages):
+            if kind == 'scan':
+                line = 'scan {}'.format(['Well'] + param['columns'])
+                if len(param['filters']) > 0:
+                    line += ' where ' + _format_filters(param['filters'])
+            elif kind == 'filter':
+                line = 'filter where ' + _format_filters(param['filters'])
+            elif kind == 'normalize':
+                line = 'normalize {0} with {1}{2}'.format(param['channels'], param['method'],
+                                                           ' after log2' if param['log_t'] else '')
+            else:
+                line = 'aggregate {0} of {1}'.format(param['datatype'] if param['datatype'] is not None else
+                                                     self.__default_datatype(), param['channels'])
+            lines.append('  {0}. {1}'.format(i + 1, line))
+        return '\n'.join(lines)
+
+    def __default_datatype(self):
+        """
+        Datatype used when aggregation datatype is None, datatype of replica or 'default' if replica of plate differ
+        """
+        if isinstance(self.target, TCA.Core.Replica):
+            return self.target.datatype
+        datatypes = set(replica.datatype for replica in self.target.replica.values())
+        return datatypes.pop() if len(datatypes) == 1 else 'default'
+
+    def collect(self):
+        """
+        Run the plan
+        :return: for a replica, numpy array of shape (channel, row, col) if pipeline end with aggregation, else
+        dataframe of transformed cells, for a plate, numpy array of shape (replica, channel, row, col) or dict of
+        dataframes with replica name as key
+        """
+        stages = self.plan()
+        if isinstance(self.target, TCA.Core.Replica):
+            return _run_replica(self.target, stages)
+        results = self.target._map_replica(lambda replica: _run_replica(replica, stages))
+        if stages[-1][0] == 'aggregate':
+            return np.array(results)
+        return dict(zip(self.target.get_replica_listId(), results))
+
+    def __repr__(self):
+        """
+        Definition for the representation
+        """
+        return self.explain()
+
+    def __str__(self):
+        """
+        Definition for the print
+        """
+        return self.__repr__()
+
+
+def _format_filters(filters):
+    """
+    Filtering conditions in text
+    """
+    conditions = []
+    for flt in filters:
+        if flt['exclude'] == 'upper':
+            op = '<=' if flt['include'] else '<'
+        else:
+            op = '>=' if flt['include'] else '>'
+        value = 'percentile({})'.format(flt['value']) if flt['percent'] else flt['value']
+        conditions.append('{0} {1} {2}'.format(flt['channel'], op, value))
+    return ' and '.join(conditions)
+
+
+def _get_mask(df, filters, name):
+    """
+    Combined mask of filters on data, only first filter can be a percentile (see Pipeline.plan)
+    """
+    mask = None
+    for flt in filters:
+        value = flt['value'][name] if isinstance(flt['value'], dict) else flt['value']
+        flt_mask = TCA.filter_mask(df[flt['channel']].values, value, exclude=flt['exclude'], include=flt['include'],
+                                   percent=flt['percent'])
+        mask = flt_mask if mask is None else mask & flt_mask
+    return mask
+
+
+def _run_replica(replica, stages):
+    """
+    Run fused stages on a replica, raw data of replica are not modified
+    :param replica: Replica object
+    :param stages: stages from Pipeline.plan
+    :return: numpy array of shape (channel, row, col) or dataframe
+    """
+    kind, param = stages[0]
+    if replica.df is None:
+        raise IOError('Empty rawdata')
+    replica.load_channels(param['columns'])
+    df = replica.df
+    missing = [chan for chan in param['columns'] if chan not in df.columns]
+    if len(missing) > 0:
+        raise ValueError('Wrong Channel : {}'.format(missing))
+    columns = [replica.WellKey] + param['columns']
+    mask = _get_mask(df, param['filters'], replica.name)
+    if mask is not None:
+        data = df[columns].take(np.flatnonzero(mask))
+    else:
+        data = df.reindex(columns=columns)
+    log.debug('Pipeline on {0} : {1} cells over {2} scanned'.format(replica.name, len(data), len(df)))
+
+    # # working replica on kept cells and used columns
+    work = TCA.Core.Replica(replica.name, data, skip=replica.skip_well, datatype=replica.datatype,
+                            sort_by_well=replica._sort_by_well)
+    for kind, param in stages[1:]:
+        if kind == 'filter':
+            mask = _get_mask(work.df, param['filters'], replica.name)
+            work.df = work.df.take(np.flatnonzero(mask))
+        elif kind == 'normalize':
+            work.normalization_channels(param['channels'], method=param['method'], log_t=param['log_t'],
+                                        neg=param['neg'], pos=param['pos'], skipping_wells=param['skipping_wells'],
+                                        threshold=param['threshold'])
+        elif kind == 'aggregate':
+            return work.get_data_channels(param['channels'], datatype=param['datatype'])
+    return work.df
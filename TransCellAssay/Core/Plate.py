@@ -9,7 +9,10 @@ import pandas as pd
 import TransCellAssay as TCA
 from TransCellAssay.Core.GenericPlate import GenericPlate
 import os
+import copy
 import collections
+import functools
+import concurrent.futures
 import logging
 log = logging.getLogger(__name__)
 
@@ -30,7 +33,8 @@ class Plate(GenericPlate):
     self.platemap = TCA.Core.PlateMap()  # Plate Setup object
     """
 
-    def __init__(self, name, platemap=None, skip=(), replica=None, datatype='mean'):
+    def __init__(self, name, platemap=None, skip=(), replica=None, datatype='mean', compact=False, executor=None,
+                 n_jobs=None):
         """
         Constructor for init default value
         :param name: name of plate, very important to file this, it will be use for certain function
@@ -38,10 +42,17 @@ class Plate(GenericPlate):
         :param skip: Well to skip for all replica
         :param replica: add one or a list of replica
         :param datatype : mean or median for working array
+        :param compact: compact raw data of all added replica (float32 channels and categorical well)
+        :param executor: run replica operations in parallel (see set_executor), None, 'thread' or 'process'
+        :param n_jobs: number of workers, default to min(number of replica, number of cpu)
         """
         super(Plate, self).__init__(name=name, datatype=datatype, skip=skip)
         log.info('Plate created : {}'.format(name))
         self.replica = collections.OrderedDict()
+        self.compact = compact
+        self.executor = None
+        self.n_jobs = None
+        self.set_executor(executor, n_jobs)
         if platemap is not None:
             if isinstance(platemap, str):
                 self.platemap = TCA.Core.PlateMap(fpath=platemap)
@@ -59,6 +70,41 @@ class Plate(GenericPlate):
         if name is not None:
             self.name = name
 
+    def set_executor(self, executor=None, n_jobs=None):
+        """
+        Set how operations on replica (agg_data_from_replica_channel, normalization_channels,
+        apply_systematic_error_correction and clear_cache) are run
+        None -> serial
+        'thread' -> thread pool, numpy and pandas release the GIL in most of raw data operations
+        'process' -> process pool for systematic error correction (pure python algorithms), thread pool for others
+        :param executor: None, 'thread' or 'process'
+        :param n_jobs: number of workers, default to min(number of replica, number of cpu)
+        """
+        if executor not in (None, 'thread', 'process'):
+            raise ValueError("Executor must be None, 'thread' or 'process'")
+        self.executor = executor
+        self.n_jobs = n_jobs
+
+    def _map_replica(self, func, process=False):
+        """
+        Apply func on all replica with plate executor, results are returned in replica order
+        :param func: function that take a replica, or the replica array in process mode
+        :param process: use a process pool if plate executor is 'process'
+        :return: list of results
+        """
+        replica = list(self.replica.values())
+        if self.executor is None or len(replica) < 2:
+            if process and self.executor == 'process':
+                return [func(rep.array.copy()) for rep in replica]
+            return [func(rep) for rep in replica]
+        n_jobs = self.n_jobs if self.n_jobs is not None else min(len(replica), os.cpu_count() or 1)
+        if process and self.executor == 'process':
+            # # only arrays are sent to workers, replica objects stay in this process
+            with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                return list(pool.map(func, [rep.array.copy() for rep in replica]))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            return list(pool.map(func, replica))
+
     def add_platemap(self, platemap):
         """
         Add the platemap to the plate, equivalent to + operator
@@ -192,6 +238,7 @@ class Plate(GenericPlate):
         df = []
         for key, rep in self.replica.items():
             assert isinstance(rep, TCA.Replica)
+            rep.load_channels()
             tmp = rep.get_groupby_data()
             if by == 'Median':
                 df.append(tmp.median())
@@ -228,6 +275,18 @@ class Plate(GenericPlate):
         res.columns = namelst
         return res
 
+    def get_data_channels(self, channels, datatype=None):
+        """
+        Get for all replica the mean or median of wells for multiple channels, computed in one pass for each replica
+        and kept in replica cache
+        :param channels: list of channels
+        :param datatype: mean or median, default to plate datatype
+        :return: numpy array of shape (replica, channel, row, col)
+        """
+        if datatype is None:
+            datatype = self.datatype
+        return np.array([rep.get_data_channels(channels, datatype=datatype) for key, rep in self.replica.items()])
+
     def use_count_as_data(self):
         """
         Use cells count from raw data, and fill array member with this data
@@ -247,23 +306,11 @@ class Plate(GenericPlate):
         :param datatype : default to None -> take plate parameters, otherwise compute with given choice
         """
 
-        i = 0
         if datatype is None:
             datatype = self.datatype
         self.datatype = datatype
-        change = False
-        for key, replica in self.replica.items():
-            if forced_update:
-                replica.compute_data_channel(channel, datatype=datatype)
-                change = True
-            else:
-                if replica.array is None:
-                    replica.compute_data_channel(channel, datatype=datatype)
-                else:
-                    replica.compute_data_channel(channel, datatype=datatype)
-                    change = True
-
-            i += 1
+        change = forced_update or any(replica.array is not None for key, replica in self.replica.items())
+        self._map_replica(lambda replica: replica.compute_data_channel(channel, datatype=datatype))
 
         if change:
             if self._array_channel != channel:
@@ -331,16 +378,18 @@ class Plate(GenericPlate):
         call function like from replica object
         :param pos: positive control
         :param neg: negative control
-        :param channel: channel to normalize
+        :param channel: channel to normalize, or list of channels normalized at once
         :param method: which method to perform
         :param log_t:  Performed log2 Transformation
         :param skipping_wells: skip defined wells, use it with poc and npi
         :param threshold: used in background subtraction (median is 50) you can set as you want
         """
-        for key, value in self.replica.items():
+        def __replica_normalization(value):
             value.normalization_channels(channels=channel, method=method, log_t=log_t, neg=neg, pos=pos,
                                          skipping_wells=skipping_wells, threshold=threshold)
 
+        self._map_replica(__replica_normalization)
+
     def normalization_channels(self, channels, method='Zscore', log_t=True, neg=None, pos=None, skipping_wells=False,
                                threshold=None):
         """
@@ -354,15 +403,126 @@ class Plate(GenericPlate):
         :param threshold: used in background subtraction (median is 50) you can set as you want
         """
         log.info("{0} -> Rawdata normalization with {1} method".format(self.name, method))
-        if isinstance(channels, list):
-            for channel in channels:
-                self.__normalization(channel=channel, method=method, log_t=log_t, neg=neg, pos=pos,
-                                         skipping_wells=skipping_wells, threshold=threshold)
-        else:
-            self.__normalization(channels, method, log_t, neg, pos, skipping_wells, threshold=threshold)
+        # # each replica normalize all channels in one pass
+        self.__normalization(channels, method, log_t, neg, pos, skipping_wells, threshold=threshold)
         self.isNormalized = True
         self.RawDataNormMethod = method
-        self.clear_cache()
+
+    def add_layer(self, name, channels, method='Zscore', log_t=True, neg=None, pos=None, skipping_wells=False,
+                  threshold=None):
+        """
+        Declare a normalized layer on all replica, raw data are kept unchanged (see Replica.add_layer)
+        :param name: name of layer
+        :param channels: channel or list of channels in layer
+        :param method: which method to perform
+        :param log_t:  Performed log2 Transformation
+        :param neg: negative control
+        :param pos: positive control
+        :param skipping_wells: skip defined wells, use it with poc and npi
+        :param threshold: used in background subtraction (median is 50) you can set as you want
+        """
+        for key, value in self.replica.items():
+            value.add_layer(name, channels, method=method, log_t=log_t, neg=neg, pos=pos,
+                            skipping_wells=skipping_wells, threshold=threshold)
+
+    def set_layer(self, name=None):
+        """
+        Use a layer as data of all replica, layers are computed if needed, None go back to raw data
+        :param name: name of layer, None for raw data
+        """
+        log.info("{0} -> Use layer {1}".format(self.name, name))
+        self._map_replica(lambda replica: replica.set_layer(name))
+        self.__reset_array()
+
+    def add_filter(self, name, channel, value, exclude="lower", include=True, percent=False, active=True):
+        """
+        Declare a filter on cells of all replica, raw data are kept unchanged and shared (see Replica.add_filter)
+        :param name: name of filter
+        :param channel: on which channel to apply filtering
+        :param value: cut value, or dict with key are rep name and items the cut_value for each replica
+        :param exclude: exclude lower or upper value
+        :param include: include or not limit value
+        :param percent: cut value is a percentile of channel
+        :param active: apply filter now
+        """
+        log.info("{0} -> Add filter {1} on {2}".format(self.name, name, channel))
+
+        def __replica_filter(replica):
+            cut_value = value[replica.name] if isinstance(value, dict) else value
+            replica.add_filter(name, channel, cut_value, exclude=exclude, include=include, percent=percent,
+                               active=active)
+
+        self._map_replica(__replica_filter)
+        self.__reset_array()
+
+    def remove_filter(self, name):
+        """
+        Remove a filter from all replica
+        :param name: name of filter
+        """
+        self._map_replica(lambda replica: replica.remove_filter(name))
+        self.__reset_array()
+
+    def set_filter(self, name, active=True):
+        """
+        Activate or deactivate a filter on all replica
+        :param name: name of filter
+        :param active: apply or not filter
+        """
+        self._map_replica(lambda replica: replica.set_filter(name, active=active))
+        self.__reset_array()
+
+    def add_gate(self, name, channel, threshold, op='>'):
+        """
+        Declare a gate on cells of all replica (see Replica.add_gate)
+        :param name: name of gate, must be a valid python identifier
+        :param channel: channel of gate
+        :param threshold: threshold value, or dict with key are rep name and items the threshold for each replica
+        :param op: comparison operator, >, >=, < or <=
+        """
+        for key, value in self.replica.items():
+            value.add_gate(name, channel, threshold[key] if isinstance(threshold, dict) else threshold, op=op)
+
+    def remove_gate(self, name):
+        """
+        Remove a gate from all replica
+        :param name: name of gate
+        """
+        for key, value in self.replica.items():
+            value.remove_gate(name)
+
+    def get_gate_data(self, expression):
+        """
+        Get for all replica the percent of cells in a gate or in an expression of gates for each well
+        :param expression: gate name or expression of gates with &, |, ^, ~ and parenthesis
+        :return: numpy array of shape (replica, row, col)
+        """
+        return np.array(self._map_replica(lambda replica: replica.get_gate_data(expression)))
+
+    def lazy(self):
+        """
+        Get a lazy pipeline on plate : filter, normalize and aggregate are recorded and fused in as few passes as
+        possible over cells of each replica when collect is called (see Pipeline)
+        :return: Pipeline object
+        """
+        return TCA.Core.Pipeline(self)
+
+    def view(self):
+        """
+        Get a lightweight copy of plate, replica are copied with Replica.view so that raw data are shared until modified
+        :return: Plate object
+        """
+        plate = copy.copy(self)
+        plate.replica = collections.OrderedDict((key, value.view()) for key, value in self.replica.items())
+        return plate
+
+    def __reset_array(self):
+        """
+        Data of replica were changed, well data of plate must be computed again
+        """
+        self.array = None
+        self.array_c = None
+        self._array_channel = None
 
     def apply_systematic_error_correction(self, algorithm='Bscore', apply_down=True, verbose=False,
                                           save=True, max_iterations=100, alpha=0.05, epsilon=0.01, skip_col=[],
@@ -393,11 +553,25 @@ class Plate(GenericPlate):
         log.info('Systematic Error Correction processing {0} : {1}'.format(self.name, algorithm))
         # Apply only to replica array and get mean of these replica array_c
         if apply_down:
-            for key, value in self.replica.items():
-                value.systematic_error_correction(algorithm=algorithm, verbose=verbose, save=save,
-                                                  max_iterations=max_iterations, alpha=alpha, epsilon=epsilon,
-                                                  skip_col=skip_col, skip_row=skip_row, poly_deg=poly_deg,
-                                                  low_max_iter=low_max_iter, f=f)
+            if self.executor == 'process':
+                for key, value in self.replica.items():
+                    if value.array is None:
+                        log.error("Use first : compute_data_for_channel")
+                        raise AttributeError()
+                corrected = self._map_replica(functools.partial(
+                    TCA.Core.GenericPlate.correct_array, algorithm=algorithm, verbose=verbose,
+                    max_iterations=max_iterations, alpha=alpha, epsilon=epsilon, skip_col=skip_col, skip_row=skip_row,
+                    poly_deg=poly_deg, low_max_iter=low_max_iter, f=f), process=True)
+                for value, corrected_data_array in zip(self.replica.values(), corrected):
+                    if save:
+                        value.array_c = np.nan_to_num(corrected_data_array)
+                        value.isSpatialNormalized = True
+                        value.SECNormMethod = algorithm
+            else:
+                self._map_replica(lambda value: value.systematic_error_correction(
+                    algorithm=algorithm, verbose=verbose, save=save, max_iterations=max_iterations, alpha=alpha,
+                    epsilon=epsilon, skip_col=skip_col, skip_row=skip_row, poly_deg=poly_deg,
+                    low_max_iter=low_max_iter, f=f))
             self._mean_array_c()
         else:
             # apply sec only on plate.array to get array_c
@@ -449,8 +623,7 @@ class Plate(GenericPlate):
         """
         Save memory by deleting Raw Data
         """
-        for key, value in self.replica.items():
-            value.clear_cache()
+        self._map_replica(lambda value: value.clear_cache())
 
     def get_file_location(self):
         """
@@ -477,6 +650,8 @@ class Plate(GenericPlate):
         if isinstance(to_add, TCA.Core.Replica):
             name = to_add.name
             to_add.datatype = self.datatype
+            if self.compact and not to_add._compact:
+                to_add.compact()
             self.replica[name] = to_add
         elif isinstance(to_add, TCA.Core.PlateMap):
             self.platemap = to_add
@@ -484,6 +659,8 @@ class Plate(GenericPlate):
             for elem in to_add:
                 assert isinstance(elem, TCA.Core.Replica)
                 elem.datatype = self.datatype
+                if self.compact and not elem._compact:
+                    elem.compact()
                 self.replica[elem.name] = elem
         else:
             raise AttributeError("Unsupported Type")
@@ -0,0 +1,185 @@
+# coding=utf-8
+"""
+QuantileSketch is a mergeable quantile summary (KLL sketch, Karnin, Lang and Liberty 2016) for computing median and
+percentiles of data that don't fit in memory or that are read by chunk, process or node.
+
+Values are stored in levels, an item of level h weight 2**h. When a level is over its capacity, it is sorted and one
+item on two (random offset) is promoted to the next level. Capacity of top level is k and decrease by 2/3 for lower
+levels, so memory is O(k) whatever the number of values.
+
+Rank error (fraction of values) is lower than get_error_bound() with 99% confidence, as long as no compaction was
+done (n <= k) quantiles are exact and equal to numpy percentile.
+"""
+
+import numpy as np
+import logging
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+def get_sketch_size(eps):
+    """
+    Size k of sketch for a rank error lower than eps (99% confidence)
+    :param eps: rank error as fraction, 0.01 for 1%
+    :return: k
+    """
+    if not 0 < eps < 1:
+        raise ValueError('Rank error must be in ]0, 1[')
+    return max(8, int(np.ceil((2.296 / eps) ** (1. / 0.9723))))
+
+
+class QuantileSketch(object):
+    """
+    Class for storing a KLL quantile sketch of values
+    self.k = int                        # size of sketch
+    self.n = int                        # number of values added (NaN are skipped)
+    self.levels = []                    # numpy array of items for each level
+    """
+
+    def __init__(self, k=200, seed=None):
+        """
+        Constructor
+        :param k: size of sketch, rank error ~ 2.3 / k (see get_sketch_size)
+        :param seed: seed of random generator used in compaction, for reproducible sketches
+        """
+        self.k = int(k)
+        self.n = 0
+        self.levels = [np.zeros(0)]
+        self.__rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        """
+        Number of values added
+        """
+        return self.n
+
+    def get_error_bound(self):
+        """
+        Rank error (fraction of values) of quantiles with 99% confidence, 0 if sketch is exact
+        """
+        if self.is_exact():
+            return 0.
+        return 2.296 / self.k ** 0.9723
+
+    def is_exact(self):
+        """
+        Are all values still stored in sketch
+        """
+        return len(self.levels) == 1
+
+    def __capacity(self, h):
+        """
+        Capacity of level h
+        """
+        depth = len(self.levels) - 1 - h
+        return max(2, int(np.ceil(self.k * (2. / 3.) ** depth)))
+
+    def __compress(self):
+        """
+        Compact levels over their capacity
+        """
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if len(items) > self.__capacity(h):
+                items = np.sort(items)
+                if len(items) % 2 == 1:
+                    # # keep one item at this level for having an even number of items to compact
+                    keep, items = items[:1], items[1:]
+                else:
+                    keep = items[:0]
+                promoted = items[self.__rng.randint(2)::2]
+                if h + 1 == len(self.levels):
+                    self.levels.append(promoted)
+                else:
+                    self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.levels[h] = keep
+            h += 1
+
+    def update(self, values):
+        """
+        Add values to sketch, NaN are skipped
+        :param values: array of values
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self.__compress()
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one
+        :param other: QuantileSketch object
+        """
+        if other.n == 0:
+            return
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.k = min(self.k, other.k)
+        self.__compress()
+
+    def get_items(self):
+        """
+        Sorted items of sketch and their weight
+        :return: tuple of numpy array (items, weights)
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2. ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='mergesort')
+        return items[order], weights[order]
+
+    def quantile(self, q):
+        """
+        Get quantile(s) of values
+        :param q: quantile or array of quantiles in [0, 1]
+        :return: value(s), NaN if sketch is empty
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim > 0 else np.nan
+        if self.is_exact():
+            return np.percentile(self.levels[0], q * 100)
+        items, weights = self.get_items()
+        cum = np.cumsum(weights)
+        idx = np.searchsorted(cum, q * cum[-1], side='left')
+        return items[np.minimum(idx, len(items) - 1)]
+
+    def percentile(self, p):
+        """
+        Get percentile(s) of values (like numpy percentile)
+        :param p: percentile or array of percentiles in [0, 100]
+        """
+        return self.quantile(np.asarray(p, dtype=np.float64) / 100.)
+
+    def median(self):
+        """
+        Median of values
+        """
+        return self.quantile(0.5)
+
+    def mad(self):
+        """
+        Median absolute deviation of values (not scaled), computed on sketch items
+        """
+        if self.n == 0:
+            return np.nan
+        med = self.median()
+        if self.is_exact():
+            return np.median(np.abs(self.levels[0] - med))
+        items, weights = self.get_items()
+        dev = np.abs(items - med)
+        order = np.argsort(dev, kind='mergesort')
+        cum = np.cumsum(weights[order])
+        return dev[order][min(np.searchsorted(cum, 0.5 * cum[-1], side='left'), len(dev) - 1)]
@@ -6,8 +6,13 @@ Replica implement the notion of technical replica for plate, in real, it represe
 import pandas as pd
 import os
 import numpy as np
+import collections
+import copy
+import weakref
 import TransCellAssay as TCA
 from TransCellAssay.Core.GenericPlate import GenericPlate
+from TransCellAssay.Core.WellIndex import WellIndex
+from TransCellAssay.Core.Gate import GATE_OPERATORS, gate_mask, evaluate_gates, get_gate_names
 import logging
 log = logging.getLogger(__name__)
 
@@ -25,7 +30,8 @@ class Replica(GenericPlate):
     self.rawdata = rawdata              # rawdata object
     """
 
-    def __init__(self, name, fpath, FlatFile=True, skip=(), datatype='mean', **kwargs):
+    def __init__(self, name, fpath, FlatFile=True, skip=(), datatype='mean', sort_by_well=False, lazy=False,
+                 compact=False, cache=False, mmap=False, summary=False, chunksize=100000, sketch_eps=None, **kwargs):
         """
         Constructor
         :param name: name of replica
@@ -34,20 +40,80 @@ class Replica(GenericPlate):
         :param singleCells: Are data single cell type or not
         :param skip: Well to skip
         :param datatype: Median or Mean data
+        :param sort_by_well: sort cells by well at loading, each well is then a contiguous slice of raw data and
+        well reductions are done in one pass (see WellIndex)
+        :param lazy: only for csv file, read only Well column at creation and channels when they are used (see
+        load_channels), self.df contain only loaded channels
+        :param compact: store channels in float32 when possible and well as categorical (see compact)
+        :param cache: only for csv file, keep parsed file in a binary sidecar cache next to it (see BinaryCache) and
+        read the cache instead of parsing file when it is up to date
+        :param mmap: only for csv file, raw data are built without copy over copy on write memory maps of the binary
+        cache (written sorted by well if sort_by_well), data are read from disk on demand and modifications are
+        never written to cache, allow working on data larger than RAM
+        :param summary: only for csv file, file is read by chunk of chunksize lines into per well statistics (see
+        WellSummary) and cells are not kept, work for count and mean data but not for single cell methods
+        :param chunksize: number of lines read at once in summary mode
+        :param sketch_eps: in summary mode, keep per well quantile sketches with this rank error (0.01 for 1%), median
+        data and percentile thresholds are then available
         """
         super(Replica, self).__init__(name=name, datatype=datatype, skip=skip)
         log.debug('Replica created : {}'.format(name))
+        self._data_version = 0              # incremented each time raw data are modified
+        self._array_version = None          # data version used for self.array
+        self._df = None
+        self.__file = None
+        self._sort_by_well = sort_by_well
+        self._compact = False
+        self._lazy = False
+        self.__lazy_columns = None          # all columns of file in lazy mode
+        self.__lazy_kwargs = None           # pandas args for reading file in lazy mode
+        self.__cache = None                 # binary cache of file in lazy mode
+        self._summary = None                # per well statistics in summary mode
+        # # all cached data are tagged with the data version they were computed from
+        self.__CACHING_gbdata = None
+        self.__CACHING_gbdata_version = None
+        self.__CACHING_wellidx = None
+        self.__CACHING_wellidx_version = None
+        self.__CACHING_wellpos = None
+        self.__CACHING_arrays = collections.OrderedDict()   # (datatype, channel) -> well data matrix, LRU order
+        self.__CACHING_arrays_version = None
+        self.__CACHING_derived = {}                         # key -> counts, thresholds ...
+        self.__CACHING_derived_version = None
+        self.__CACHING_ctrlidx = {}                         # control wells -> row position of their cells
+        self.__CACHING_ctrlidx_version = None
+        # # normalized layers computed from raw data, see add_layer
+        self._layer = None                  # name of layer in self.df, None for raw data
+        self.__layers = collections.OrderedDict()
+        self.__raw_df = None                # raw data when a layer is used
+        self.__raw_version = 0              # incremented each time raw data (not a layer) are modified
+        # # cell filters, see add_filter
+        self.__filters = collections.OrderedDict()
+        self.__unfiltered_df = None         # data without filtering when filters are applied
+        self.__filter_mask = None           # bit packed mask of kept cells in unfiltered data
+        self.__gates = collections.OrderedDict()    # gates on cells, see add_gate
+        self.__shared = []                  # weak references to frames sharing columns with a view, see view
+        self.cache_size = 32                # max number of channel matrix kept in cache
 
         if not FlatFile:
             self.set_data(fpath)
-            self.__file = None
 
         else:
             if isinstance(fpath, str):
                 if os.path.isfile(fpath):
-                    log.info('Reading FlatFile : %s' % fpath)
-                    self.df = pd.read_csv(fpath, engine='c', **kwargs)
                     self.__file = fpath
+                    if summary:
+                        self._summary = TCA.WellSummary.read_csv(fpath, well_key=self.WellKey, chunksize=chunksize,
+                                                                 eps=sketch_eps, **kwargs)
+                    elif mmap:
+                        sort_by = self.WellKey if self._sort_by_well else None
+                        self.df = TCA.BinaryCache(fpath).read_csv(mmap='c', copy=False, sort_by=sort_by, **kwargs)
+                    elif lazy:
+                        self.__init_lazy(fpath, cache=cache, **kwargs)
+                    elif cache:
+                        self.df = TCA.BinaryCache(fpath).read_csv(**kwargs)
+                    else:
+                        log.info('Reading FlatFile : %s' % fpath)
+                        self.df = pd.read_csv(fpath, engine='c', **kwargs)
                 else:
                     raise IOError('File don\'t exist')
 
@@ -62,8 +128,117 @@ class Replica(GenericPlate):
             else:
                 raise NotImplementedError('Input types not handled')
 
+        if compact and self.df is not None:
+            self.compact()
+        if self._sort_by_well and self.df is not None:
+            self.get_well_index()
+
+    @property
+    def df(self):
+        """
+        Raw data in pandas dataframe
+        """
+        return self._df
+
+    @df.setter
+    def df(self, df):
+        """
+        Set raw data, data version is incremented and active filters are applied on new data
+        """
+        self._df = df
+        self.__unfiltered_df = None
+        self.__filter_mask = None
+        self._data_changed()
+        if self.__get_active_filters():
+            self.__apply_filters()
+
+    def __init_lazy(self, fpath, cache=False, **kwargs):
+        """
+        Read only header and Well column of file, channels are read when needed, with cache channels are read from
+        binary cache (written once from whole file if not up to date)
+        """
+        if 'usecols' in kwargs or 'index_col' in kwargs:
+            raise ValueError('usecols and index_col are not supported in lazy mode')
+        self.__lazy_kwargs = kwargs
+        if cache:
+            self.__cache = TCA.BinaryCache(fpath)
+            if not self.__cache.is_valid(**kwargs):
+                self.__cache.read_csv(**kwargs)
+            if not self.__cache.is_valid(**kwargs):
+                self.__cache = None
+        if self.__cache is not None:
+            self.__lazy_columns = self.__cache.get_columns()
+        else:
+            log.info('Reading FlatFile header : %s' % fpath)
+            self.__lazy_columns = pd.read_csv(fpath, engine='c', nrows=0, **kwargs).columns.tolist()
+        if self.WellKey not in self.__lazy_columns:
+            raise ValueError('No {} column in file'.format(self.WellKey))
+        self._lazy = True
+        self.df = self.__read_columns([self.WellKey])
+
+    def __read_columns(self, columns):
+        """
+        Read some columns from file, well as str and channels as float if possible
+        """
+        if self.__cache is not None:
+            df = self.__cache.load(columns)
+            if self._compact:
+                df = TCA.compact_dataframe(df, well_key=self.WellKey)
+            return df
+        dtypes = dict((col, np.float64) for col in columns if col != self.WellKey)
+        dtypes[self.WellKey] = str
+        try:
+            df = pd.read_csv(self.__file, engine='c', usecols=columns, dtype=dtypes, **self.__lazy_kwargs)
+        except ValueError:
+            # # some columns are not numeric
+            df = pd.read_csv(self.__file, engine='c', usecols=columns, dtype={self.WellKey: str},
+                             **self.__lazy_kwargs)
+        if self._compact:
+            df = TCA.compact_dataframe(df, well_key=self.WellKey)
+        return df
+
+    def compact(self):
+        """
+        Reduce memory used by raw data, channels are stored in float32 when they fit in float32 range and well as
+        categorical, channels loaded later (lazy mode) are also compacted
+        """
+        self._compact = True
+        if self.df is not None:
+            self.df = TCA.compact_dataframe(self.__get_unfiltered_df(), well_key=self.WellKey)
+            log.debug('Compact rawdata of {0} : {1:.1f} MB'.format(
+                self.name, self.df.memory_usage(deep=True).sum() / 1024. ** 2))
+
+    def load_channels(self, channels=None):
+        """
+        In lazy mode, read channels that are not already loaded from file, do nothing otherwise
+        :param channels: channel or list of channels, all channels if None
+        """
+        if not self._lazy or self._layer is not None:
+            return
+        if channels is None:
+            channels = self.__lazy_columns
+        elif not isinstance(channels, list):
+            channels = [channels]
+        missing = [chan for chan in channels if chan in self.__lazy_columns and chan not in self._df.columns]
+        if len(missing) == 0:
+            return
+        log.info('Reading {0} from FlatFile : {1}'.format(missing, self.__file))
+        new = self.__read_columns(missing)
+
+        def __add_columns(df):
+            # # index of loaded data is still the line number in file (cells can be sorted or removed)
+            data = new.take(df.index.values)
+            data.index = df.index
+            loaded = pd.concat([df, data], axis=1)
+            return loaded[[col for col in self.__lazy_columns if col in loaded.columns]]
+
+        self._df = __add_columns(self._df)
+        if self.__unfiltered_df is not None:
+            self.__unfiltered_df = __add_columns(self.__unfiltered_df)
+        # # same data with more columns, data version is kept but groupby was done on previous dataframe
         self.__CACHING_gbdata = None
-        self.__CACHING_gbdata_key = None
+        if len(self._df.columns) == len(self.__lazy_columns):
+            self._lazy = False
 
     def set_name(self, name):
         """
@@ -77,6 +252,10 @@ class Replica(GenericPlate):
         Get all channels/component in list
         :return: list of channel/component
         """
+        if self._lazy and self._layer is None:
+            return list(self.__lazy_columns)
+        if self._summary is not None:
+            return list(self._summary.channels)
         if self.df is not None:
             return self.df.columns.tolist()
         else:
@@ -88,6 +267,7 @@ class Replica(GenericPlate):
         :param df: csv file
         """
         assert isinstance(df, pd.DataFrame)
+        self._lazy = False
         self.df = df
 
     def get_valid_well(self, to_check):
@@ -134,9 +314,11 @@ class Replica(GenericPlate):
         return all unique wells
         :return:
         """
+        if self._summary is not None:
+            return np.array(self._summary.wells, dtype=object)
         if self.df is None:
             raise IOError('Empty rawdata')
-        return self.df[self.WellKey].unique()
+        return np.asarray(self.df[self.WellKey].unique())
 
     def get_rawdata(self, channel=None, well=None, well_idx=False):
         """
@@ -152,6 +334,7 @@ class Replica(GenericPlate):
         # # check valid channel
         if channel is not None and channel not in self.get_channels_list():
             raise ValueError('Wrong Channel')
+        self.load_channels(channel)
         if well_idx:
             if not isinstance(channel, list):
                 channel = [channel]
@@ -192,40 +375,106 @@ class Replica(GenericPlate):
         if self._array_channel != channel:
             log.debug('Overwriting previous channel data from {0} to {1}'.format(
                     self._array_channel, channel))
-        self.array = self.__compute_data_channel(channel=channel, type_mean=datatype)
+        self.array = self.get_data_channels([channel], datatype=datatype)[0]
         self.datatype = datatype
         self._array_channel = channel
+        self._array_version = self._data_version
+
+    def get_data_channels(self, channels, datatype=None):
+        """
+        Get mean or median for each well of multiple channels in one 3d array (channel, row, col). Matrix are kept in
+        cache (LRU with self.cache_size matrix) until raw data are modified, missing channels are computed in one pass
+        :param channels: list of channels
+        :param datatype: mean or median, default to replica datatype
+        :return: numpy array of shape (len(channels), row, col)
+        """
+        if datatype is None:
+            datatype = self.datatype
+        if not isinstance(channels, list):
+            channels = [channels]
+        self.load_channels(channels)
+        if self.__CACHING_arrays_version != self._data_version:
+            self.__CACHING_arrays.clear()
+            self.__CACHING_arrays_version = self._data_version
+
+        missing = [chan for chan in channels if (datatype, chan) not in self.__CACHING_arrays]
+        if len(missing) > 0:
+            log.debug('Compute {0} data for {1} on channels {2}'.format(datatype, self.name, missing))
+            data = self.__compute_data_channels(missing, type_mean=datatype)
+            for i, chan in enumerate(missing):
+                self.__CACHING_arrays[(datatype, chan)] = data[i]
+
+        for chan in channels:
+            self.__CACHING_arrays.move_to_end((datatype, chan))
+        data = np.array([self.__CACHING_arrays[(datatype, chan)] for chan in channels])
+        while len(self.__CACHING_arrays) > self.cache_size:
+            self.__CACHING_arrays.popitem(last=False)
+        return data
 
-    def __compute_data_channel(self, channel, type_mean='mean', defsize=None):
+    def __compute_data_channels(self, channels, type_mean='mean', defsize=None):
         """
-        Compute mean or median for each well in matrix format
-        :param channel: Which channel to get
+        Compute mean or median for each well in matrix format for multiple channels
+        :param channels: list of channels to get
         :param type_mean: Mean or median
         :param defsize: you can set the size of plate if you want
-        :return:
+        :return: numpy array of shape (len(channels), row, col)
         """
-        if self.df is None:
+        if self._summary is not None:
+            if type_mean == 'median' and self._summary.eps is None:
+                raise ValueError('Median is not available in summary mode without sketch_eps')
+            wells, order = self._summary.get_sorted_wells()
+            values = np.array([self._summary.get_stat(chan, type_mean)[order] for chan in channels])
+        elif self.df is None:
             raise IOError('Empty rawdata')
-        gbdata = self.get_groupby_data()
-        if type_mean is 'median':
-            tmp = gbdata.median()
-        elif type_mean is 'mean':
-            tmp = gbdata.mean()
-        channel_val = tmp[channel]
-        position_value_dict = channel_val.to_dict()  # # dict : key = pos and item are mean
-        size = len(position_value_dict)
+        elif self._sort_by_well:
+            wellidx = self.get_well_index()
+            wells = wellidx.wells
+            values = np.array([wellidx.reduce(self.df[chan].values, how=type_mean) for chan in channels])
+        else:
+            gbdata = self.get_groupby_data()[channels]
+            if type_mean == 'median':
+                tmp = gbdata.median()
+            else:
+                tmp = gbdata.mean()
+            wells = tmp.index.values
+            values = tmp.values.T
+        return self.__wells_to_array(wells, values, defsize=defsize)
+
+    def __wells_to_array(self, wells, values, defsize=None):
+        """
+        Put values of wells in matrix form
+        :param wells: array of wells name
+        :param values: numpy array of shape (n, len(wells))
+        :param defsize: you can set the size of plate if you want
+        :return: numpy array of shape (n, row, col)
+        """
+        rows, cols = self.__get_wells_position(wells)
+        valid = rows >= 0
+        if not np.all(valid):
+            log.warning('Wells not in plate format are skipped : {}'.format(list(wells[~valid])))
+            rows, cols, values = rows[valid], cols[valid], values[:, valid]
         if defsize is None:
-            data = self.__init_array(size)
+            data = self.__init_array(len(rows))
         else:
             data = self.__init_array(defsize)
-        for key, elem in position_value_dict.items():
-            try:
-                pos = TCA.get_opposite_well_format(key)
-                data[pos[0]][pos[1]] = elem
-            except IndexError:
-                return self.get_data_channel(channel)
+        if len(rows) > 0 and (rows.max() >= data.shape[0] or cols.max() >= data.shape[1]):
+            # # some wells are outside guessed format (missing wells in rawdata), take the format that fit all wells
+            data = self.__fit_array(rows.max() + 1, cols.max() + 1)
+        data = np.repeat(data[np.newaxis], len(values), axis=0)
+        data[:, rows, cols] = values
         return data
 
+    def __get_wells_position(self, wells):
+        """
+        Get rows and cols position of wells, conversion is done only once for a replica
+        :param wells: array of wells name
+        :return: tuple of numpy array (rows, cols)
+        """
+        if self.__CACHING_wellpos is None or not np.array_equal(self.__CACHING_wellpos[0], wells):
+            rows, cols = TCA.get_wells_coord(wells)
+            self.__CACHING_wellpos = (np.asarray(wells), rows, cols)
+        return self.__CACHING_wellpos[1], self.__CACHING_wellpos[2]
+
     @staticmethod
     def __init_array(size):
         if size <= 96:
@@ -233,13 +482,22 @@ class Replica(GenericPlate):
         elif size <= 384:
             return np.zeros((16, 24))
         else:
-            return np.zeros((32, 42))
+            return np.zeros((32, 48))
+
+    @staticmethod
+    def __fit_array(nrows, ncols):
+        for shape in [(8, 12), (16, 24), (32, 48)]:
+            if nrows <= shape[0] and ncols <= shape[1]:
+                return np.zeros(shape)
+        log.warning('Wells outside 1536 plate format')
+        return np.zeros((nrows, ncols))
 
     def get_mean_channels(self):
         """
         Compute for all channels the mean for each wells
         :return: mean for each wells for all channels
         """
+        self.load_channels()
         tmp = self.get_groupby_data()
         return tmp.mean().reset_index()
 
@@ -248,6 +506,7 @@ class Replica(GenericPlate):
         Compute for all channels the median for each wells
         :return: median for each wells for all channels
         """
+        self.load_channels()
         tmp = self.get_groupby_data()
         return tmp.median().reset_index()
 
@@ -263,30 +522,35 @@ class Replica(GenericPlate):
                 raise ValueError('Process Systematic Error Correction method before')
             else:
                 return self.array_c
-        if self.array is None:
+        if self.array is None or channel != self._array_channel or self._array_version != self._data_version:
             self.compute_data_channel(channel)
-        if channel is self._array_channel:
-            return self.array
-        else:
-            self.compute_data_channel(channel)
-            return self.array
+        return self.array
 
     def get_count(self):
         """
         Get the count for all well
         :return:
         """
-        gb_data = self.get_groupby_data()
-        cnt = gb_data[self.WellKey].count().to_frame()
+        def __count():
+            if self._summary is not None:
+                cnt = self._summary.get_count().to_frame()
+            elif self._sort_by_well:
+                wellidx = self.get_well_index()
+                cnt = pd.Series(wellidx.get_counts(), index=pd.Index(wellidx.wells, name=self.WellKey)).to_frame()
+            else:
+                gb_data = self.get_groupby_data()
+                cnt = gb_data[self.WellKey].count().to_frame()
+            return cnt.fillna(0)
+
+        cnt = self._get_derived('count', __count).copy()
         cnt.columns = ['Count_'+str(self.name)]
-        cnt = cnt.fillna(0)
         return cnt
 
     def __normalization(self, channel, method='Zscore', log_t=True, neg=None, pos=None, skipping_wells=False,
                         threshold=None):
         """
-        Performed normalization on data
-        :param channel; which channel to normalize
+        Performed normalization on data, well data are only computed again for a single channel
+        :param channel; which channel (or list of channels normalized at once) to normalize
         :param method: Performed X Transformation
         :param log_t:  Performed log2 Transformation
         :param pos: positive control
@@ -296,14 +560,12 @@ class Replica(GenericPlate):
         """
         if not self.isNormalized:
             log.warning("RawData are already normalized on some channel")
+        if self._summary is not None:
+            raise ValueError('Single cell data normalization is not available in summary mode')
+        self.load_channels(channel)
 
         log.debug('Replica {} : RawData normalization on channel {}'.format(self.name, channel))
-        if skipping_wells:
-            negative = [x for x in neg if (TCA.get_opposite_well_format(x) not in self.skip_well)]
-            positive = [x for x in pos if (TCA.get_opposite_well_format(x) not in self.skip_well)]
-        else:
-            negative = neg
-            positive = pos
+        negative, positive = self.__get_controls(neg, pos, skipping_wells)
         TCA.rawdata_variability_normalization(self,
                                               channel=channel,
                                               method=method,
@@ -311,7 +573,20 @@ class Replica(GenericPlate):
                                               neg_control=negative,
                                               pos_control=positive,
                                               threshold=threshold)
-        self.compute_data_channel(channel)
+        if not isinstance(channel, list):
+            self.compute_data_channel(channel)
+
+    def __get_controls(self, neg, pos, skipping_wells=False):
+        """
+        Get control wells used in normalization, without skipped wells if skipping_wells
+        """
+        if skipping_wells:
+            negative = [x for x in neg if (TCA.get_opposite_well_format(x) not in self.skip_well)]
+            positive = [x for x in pos if (TCA.get_opposite_well_format(x) not in self.skip_well)]
+        else:
+            negative = neg
+            positive = pos
+        return negative, positive
 
     def normalization_channels(self, channels, method='Zscore', log_t=True, neg=None, pos=None, skipping_wells=False,
                                threshold=None):
@@ -329,15 +604,389 @@ class Replica(GenericPlate):
             self.__normalization(channel=channels, method=method, log_t=log_t, neg=neg, pos=pos,
                                  skipping_wells=skipping_wells, threshold=threshold)
         elif isinstance(channels, list):
-            for chan in channels:
-                self.__normalization(channel=chan, method=method, log_t=log_t, neg=neg, pos=pos,
-                                     skipping_wells=skipping_wells, threshold=threshold)
+            # # all channels are normalized in one pass, well data are computed when asked
+            self.__normalization(channel=channels, method=method, log_t=log_t, neg=neg, pos=pos,
+                                 skipping_wells=skipping_wells, threshold=threshold)
 
             log.warning("Choose your channels that you want to work with plate.agg_data_from_replica_channel or "
                         "replica.data_for_channel")
         self.isNormalized = True
         self.RawDataNormMethod = method
 
+    def add_layer(self, name, channels, method='Zscore', log_t=True, neg=None, pos=None, skipping_wells=False,
+                  threshold=None):
+        """
+        Declare a normalized layer : channels normalized like normalization_channels but on a copy of raw data, raw
+        data are kept unchanged. Layer is computed at first use (get_layer or set_layer) and kept until raw data are
+        modified, so that several normalizations can be compared on one load of file
+        :param name: name of layer
+        :param channels: channel or list of channels in layer
+        :param method: which method to perform (see rawdata_variability_normalization)
+        :param log_t: Performed log2 Transformation
+        :param neg: negative control
+        :param pos: positive control
+        :param skipping_wells: skip defined wells, use it with poc and npi
+        :param threshold: used in background subtraction (median is 50) you can set as you want
+        """
+        if name is None:
+            raise ValueError('Layer must have a name')
+        if self._summary is not None:
+            raise ValueError('Single cell data normalization is not available in summary mode')
+        if not isinstance(channels, list):
+            channels = [channels]
+        if name == self._layer:
+            raise AttributeError('Layer {} is in use'.format(name))
+        self.__layers[name] = {'channels': channels, 'method': method, 'log_t': log_t, 'neg': neg, 'pos': pos,
+                               'skipping_wells': skipping_wells, 'threshold': threshold, 'df': None, 'version': None}
+
+    def remove_layer(self, name):
+        """
+        Remove a layer and its data
+        :param name: name of layer
+        """
+        if name == self._layer:
+            self.set_layer(None)
+        del self.__layers[name]
+
+    def get_layers(self):
+        """
+        Get name of declared layers
+        :return: list of layer name
+        """
+        return list(self.__layers.keys())
+
+    def get_layer(self, name):
+        """
+        Get data of a layer (well column and normalized channels), computed from raw data if needed
+        :param name: name of layer
+        :return: pandas dataframe
+        """
+        if name not in self.__layers:
+            raise KeyError('Unknown layer : {}'.format(name))
+        layer = self.__layers[name]
+        if layer['df'] is None or layer['version'] != self.__raw_version:
+            if self._layer is None:
+                self.load_channels(layer['channels'])
+            raw = self.__get_unfiltered_df() if self._layer is None else self.__raw_df
+            missing = [chan for chan in layer['channels'] if chan not in raw.columns]
+            if len(missing) > 0:
+                raise ValueError('Channels not loaded in raw data : {}'.format(missing))
+            log.debug('Replica {0} : compute layer {1}'.format(self.name, name))
+            # # normalization is done on a replica holding a copy of well column and channels of layer
+            replica = Replica(self.name, raw[[self.WellKey] + layer['channels']].copy(), skip=self.skip_well,
+                              datatype=self.datatype)
+            replica._sort_by_well = self._sort_by_well
+            negative, positive = self.__get_controls(layer['neg'], layer['pos'], layer['skipping_wells'])
+            TCA.rawdata_variability_normalization(replica, channel=layer['channels'], method=layer['method'],
+                                                  log2_transf=layer['log_t'], neg_control=negative,
+                                                  pos_control=positive, threshold=layer['threshold'])
+            layer['df'] = replica.df
+            layer['version'] = self.__raw_version
+        return layer['df']
+
+    def set_layer(self, name=None):
+        """
+        Use a layer as data of replica (self.df), all data computed after (well data, counts, thresholds ...) come
+        from layer, None go back to raw data
+        :param name: name of layer, None for raw data
+        """
+        if name == self._layer:
+            return
+        if name is not None:
+            df = self.get_layer(name)
+            if self._layer is None:
+                self.__raw_df = self.__get_unfiltered_df()
+        else:
+            df = self.__raw_df
+            self.__raw_df = None
+        self._layer = name
+        # # data are not modified, raw version is kept, filters are applied on layer
+        self._df = df
+        self.__unfiltered_df = None
+        self.__filter_mask = None
+        self._data_version += 1
+        if self.__get_active_filters():
+            self.__apply_filters()
+        log.debug('Replica {0} : use layer {1}'.format(self.name, name))
+
+    def get_layer_name(self):
+        """
+        Get name of layer in use, None for raw data
+        """
+        return self._layer
+
+    def add_filter(self, name, channel, value, exclude="lower", include=True, percent=False, active=True):
+        """
+        Declare a filter on cells : self.df only contain cells kept by all active filters, unfiltered data are kept
+        unchanged and shared, so that filters can be stacked and toggled without copy of raw data. Filters are
+        evaluated on unfiltered data in use (raw data or layer), modifications of data made while filters are
+        applied are lost when filters change
+        :param name: name of filter
+        :param channel: on which channel to apply filtering
+        :param value: cut value
+        :param exclude: exclude lower or upper value
+        :param include: include or not limit value
+        :param percent: cut value is a percentile of channel
+        :param active: apply filter now
+        """
+        if name is None:
+            raise ValueError('Filter must have a name')
+        if self._summary is not None:
+            raise ValueError('Single cell data filtering is not available in summary mode')
+        __valid_exclude = ["lower", "upper"]
+        if exclude not in __valid_exclude:
+            raise ValueError("Exclude must be {}".format(__valid_exclude))
+        self.__filters[name] = {'channel': channel, 'value': value, 'exclude': exclude, 'include': include,
+                                'percent': percent, 'active': active}
+        self.__apply_filters()
+
+    def remove_filter(self, name):
+        """
+        Remove a filter
+        :param name: name of filter
+        """
+        del self.__filters[name]
+        self.__apply_filters()
+
+    def set_filter(self, name, active=True):
+        """
+        Activate or deactivate a filter
+        :param name: name of filter
+        :param active: apply or not filter
+        """
+        if name not in self.__filters:
+            raise KeyError('Unknown filter : {}'.format(name))
+        if self.__filters[name]['active'] != active:
+            self.__filters[name]['active'] = active
+            self.__apply_filters()
+
+    def get_filters(self):
+        """
+        Get name of declared filters
+        :return: list of filter name
+        """
+        return list(self.__filters.keys())
+
+    def get_filter_mask(self, name=None, packed=False):
+        """
+        Get cells kept by a filter or by all active filters, in order of unfiltered data
+        :param name: name of filter, None for all active filters
+        :param packed: return mask packed in bits (see numpy.packbits)
+        :return: numpy array of bool (or uint8 if packed), None if there is no active filter
+        """
+        if name is not None:
+            if name not in self.__filters:
+                raise KeyError('Unknown filter : {}'.format(name))
+            mask = np.packbits(self.__compute_filter_mask(self.__filters[name]))
+        else:
+            mask = self.__filter_mask
+        if mask is None or packed:
+            return mask
+        return np.unpackbits(mask, count=len(self.__get_unfiltered_df())).astype(bool)
+
+    def __get_active_filters(self):
+        """
+        Get active filters
+        """
+        return [flt for flt in self.__filters.values() if flt['active']]
+
+    def __get_unfiltered_df(self):
+        """
+        Get data in use without filtering
+        """
+        return self.__unfiltered_df if self.__unfiltered_df is not None else self._df
+
+    def __compute_filter_mask(self, flt):
+        """
+        Compute cells kept by a filter on unfiltered data
+        """
+        self.load_channels(flt['channel'])
+        return TCA.filter_mask(self.__get_unfiltered_df()[flt['channel']].values, flt['value'],
+                               exclude=flt['exclude'], include=flt['include'], percent=flt['percent'])
+
+    def __apply_filters(self):
+        """
+        Set self.df with cells kept by all active filters, data version is incremented
+        """
+        active = self.__get_active_filters()
+        if len(active) == 0 and self.__unfiltered_df is None:
+            return
+        if self._df is None:
+            raise IOError('Empty rawdata')
+        unfiltered = None
+        if len(active) > 0:
+            mask = self.__compute_filter_mask(active[0])
+            for flt in active[1:]:
+                mask &= self.__compute_filter_mask(flt)
+            unfiltered = self.__get_unfiltered_df()
+            log.debug('Replica {0} : {1} cells kept by filters over {2}'.format(self.name, np.count_nonzero(mask),
+                                                                                len(mask)))
+            self._df = unfiltered.take(np.flatnonzero(mask))
+            self.__filter_mask = np.packbits(mask)
+        else:
+            self._df = self.__unfiltered_df
+            self.__filter_mask = None
+        self.__unfiltered_df = unfiltered
+        # # unfiltered data are not modified, raw version is kept
+        self._data_version += 1
+
+    def add_gate(self, name, channel, threshold, op='>'):
+        """
+        Declare a gate on cells : cells with channel value compared to threshold (Ch1 > 1000), mask of gate is
+        computed at first use and kept as a bit packed mask until data are modified, gates are combined in
+        expressions (see Gate)
+        :param name: name of gate, must be a valid python identifier
+        :param channel: channel of gate
+        :param threshold: threshold value
+        :param op: comparison operator, >, >=, < or <=
+        """
+        if self._summary is not None:
+            raise ValueError('Single cell gating is not available in summary mode')
+        if not isinstance(name, str) or not name.isidentifier():
+            raise ValueError('Gate name must be a valid identifier : {}'.format(name))
+        if op not in GATE_OPERATORS:
+            raise ValueError('Operator must be {}'.format(list(GATE_OPERATORS.keys())))
+        self.__gates[name] = {'channel': channel, 'threshold': threshold, 'op': op, 'mask': None, 'version': None}
+
+    def remove_gate(self, name):
+        """
+        Remove a gate
+        :param name: name of gate
+        """
+        del self.__gates[name]
+
+    def get_gates(self):
+        """
+        Get name of declared gates
+        :return: list of gate name
+        """
+        return list(self.__gates.keys())
+
+    def __get_gate(self, name):
+        """
+        Get bit packed mask of a gate, computed if data were modified
+        """
+        if name not in self.__gates:
+            raise KeyError('Unknown gate : {}'.format(name))
+        gate = self.__gates[name]
+        if gate['mask'] is None or gate['version'] != self._data_version:
+            self.load_channels(gate['channel'])
+            gate['mask'] = gate_mask(self.df[gate['channel']].values, gate['threshold'], op=gate['op'])
+            gate['version'] = self._data_version
+        return gate['mask']
+
+    def get_gate_mask(self, expression, packed=False):
+        """
+        Get cells in a gate or in an expression of gates (gfp & ~dead), in order of self.df
+        :param expression: gate name or expression of gates with &, |, ^, ~ and parenthesis
+        :param packed: return mask packed in bits (see numpy.packbits), bits after last cell are undefined
+        :return: numpy array of bool (or uint8 if packed)
+        """
+        if self.df is None:
+            raise IOError('Empty rawdata')
+        masks = dict((name, self.__get_gate(name)) for name in get_gate_names(expression))
+        mask = evaluate_gates(expression, masks)
+        if packed:
+            return mask
+        return np.unpackbits(mask, count=len(self.df)).astype(bool)
+
+    def get_gate_data(self, expression):
+        """
+        Get percent of cells in a gate or in an expression of gates for each well in matrix form, kept until data
+        are modified
+        :param expression: gate name or expression of gates with &, |, ^, ~ and parenthesis
+        :return: numpy array of shape (row, col)
+        """
+        names = get_gate_names(expression)
+        key = ('gate', expression) + tuple((name, self.__gates[name]['channel'], self.__gates[name]['threshold'],
+                                            self.__gates[name]['op']) for name in names if name in self.__gates)
+
+        def __percent():
+            # # layout first, raw data can be sorted by well
+            wellidx, cells = self.get_well_layout()
+            mask = self.get_gate_mask(expression)
+            counts = wellidx.get_counts()
+            if wellidx.offsets[-1] > 0:
+                ingate = np.add.reduceat(mask[cells], wellidx.offsets[:-1], dtype=np.int64)
+            else:
+                ingate = np.zeros(len(wellidx), dtype=np.int64)
+            return self.__wells_to_array(wellidx.wells, (ingate / counts * 100)[np.newaxis])[0]
+
+        return self._get_derived(key, __percent)
+
+    def lazy(self):
+        """
+        Get a lazy pipeline on replica : filter, normalize and aggregate are recorded and fused in as few passes
+        as possible over cells when collect is called (see Pipeline)
+        :return: Pipeline object
+        """
+        return TCA.Core.Pipeline(self)
+
+    def view(self):
+        """
+        Get a lightweight copy of replica : unfiltered data are shared (no copy of cells), filters, layers and caches
+        are not, so that filters can be added to the copy without changing this replica. Each replica has its own
+        dataframes over shared columns, columns are copied by the first inplace modification of data (see
+        _prepare_write), so that modifications of a replica are never seen by the other
+        :return: Replica object
+        """
+        replica = copy.copy(self)
+        replica.__CACHING_gbdata = None
+        replica.__CACHING_gbdata_version = None
+        replica.__CACHING_wellidx = None
+        replica.__CACHING_wellidx_version = None
+        replica.__CACHING_arrays = collections.OrderedDict()
+        replica.__CACHING_arrays_version = None
+        replica.__CACHING_derived = {}
+        replica.__CACHING_derived_version = None
+        replica.__CACHING_ctrlidx = {}
+        replica.__CACHING_ctrlidx_version = None
+        replica.__layers = collections.OrderedDict((key, dict(value)) for key, value in self.__layers.items())
+        replica.__filters = collections.OrderedDict((key, dict(value)) for key, value in self.__filters.items())
+        replica.__gates = collections.OrderedDict((key, dict(value)) for key, value in self.__gates.items())
+
+        # # new dataframes over same columns, a layer in use is the same dataframe as its cache
+        frames = {}
+
+        def __shallow(df):
+            if df is None:
+                return None
+            if id(df) not in frames:
+                frames[id(df)] = df.copy(deep=False)
+                self.__share(df)
+                replica.__share(frames[id(df)])
+            return frames[id(df)]
+
+        replica.__shared = []
+        replica._df = __shallow(self._df)
+        replica.__unfiltered_df = __shallow(self.__unfiltered_df)
+        replica.__raw_df = __shallow(self.__raw_df)
+        for layer in replica.__layers.values():
+            layer['df'] = __shallow(layer['df'])
+        return replica
+
+    def __share(self, df):
+        """
+        Mark a dataframe as sharing its columns with another replica
+        """
+        self.__shared = [ref for ref in self.__shared if ref() is not None and ref() is not df]
+        self.__shared.append(weakref.ref(df))
+
+    def _prepare_write(self):
+        """
+        Data are about to be modified inplace, columns of self.df shared with a view (see view) are copied at first
+        modification (copy on write), must be called before each inplace modification of self.df
+        """
+        if self._df is None or not any(ref() is self._df for ref in self.__shared):
+            return
+        log.debug('Replica {} : copy shared rawdata before modification'.format(self.name))
+        df = self._df.copy()
+        for layer in self.__layers.values():
+            if layer['df'] is self._df:
+                layer['df'] = df
+        self.__shared = [ref for ref in self.__shared if ref() is not None and ref() is not self._df]
+        self._df = df
+
     def write_rawdata(self, path, name=None, **kwargs):
         """
         Save normalized Raw data
@@ -348,6 +997,7 @@ class Replica(GenericPlate):
             os.mkdir(path)
         if name is None:
             name = self.name
+        self.load_channels()
         try:
             self.df.to_csv(os.path.join(path, name), **kwargs)
         except Exception as e:
@@ -381,6 +1031,10 @@ class Replica(GenericPlate):
         Remove some data for saving memory
         """
         self.__CACHING_gbdata = None
+        self.__CACHING_wellidx = None
+        self.__CACHING_arrays.clear()
+        self.__CACHING_derived.clear()
+        self.__CACHING_ctrlidx.clear()
         log.debug('Cache cleared')
 
     def get_groupby_data(self):
@@ -388,15 +1042,188 @@ class Replica(GenericPlate):
         Perform a groupby on raw data, a 'caching' is set up for avoid computations if groupby was already performed
         :return:
         """
-        if self.__CACHING_gbdata is not None:
-            return self.__CACHING_gbdata
-        else:
-            self._new_caching()
-            return self.__CACHING_gbdata
+        if self.__CACHING_gbdata is None or self.__CACHING_gbdata_version != self._data_version:
+            key = self.WellKey
+            if self.df[key].dtype.name == 'category':
+                # # group on used categories only, keep groups in sorted well order like non compact data
+                key = self.df[key].cat.remove_unused_categories()
+            self.__CACHING_gbdata = self.df.groupby(key)
+            self.__CACHING_gbdata_version = self._data_version
+            log.debug('Created {} cache'.format(self.name))
+        return self.__CACHING_gbdata
 
     def _new_caching(self):
-        self.__CACHING_gbdata = self.df.groupby(self.WellKey)
-        log.debug('Created {} cache'.format(self.name))
+        """
+        Rebuild cache after raw data were changed
+        """
+        self._data_changed()
+        if self._sort_by_well:
+            self.get_well_index()
+        self.get_groupby_data()
+
+    def _data_changed(self):
+        """
+        Raw data were modified, increment data version so that data computed from previous raw data are not used,
+        must be called after each inplace modification of self.df (setting self.df do it), see also _prepare_write
+        """
+        self._data_version += 1
+        if self._layer is None:
+            self.__raw_version += 1
+
+    def get_data_version(self):
+        """
+        Get the version of raw data, incremented each time raw data are modified
+        :return: int
+        """
+        return self._data_version
+
+    def get_well_summary(self, channels=None, eps=None):
+        """
+        Get per well statistics (count, sum, std, min, max ...) of channels, computed from raw data if replica is not
+        in summary mode
+        :param channels: list of channels, all numeric channels if None
+        :param eps: keep quantile sketches with this rank error (for comparing with exact statistics of raw data)
+        :return: WellSummary object
+        """
+        if self._summary is not None:
+            if channels is not None and [chan for chan in channels if chan not in self._summary.channels]:
+                raise ValueError('Channels not in summary : {}'.format(channels))
+            if eps is not None and self._summary.eps is None:
+                raise ValueError('Replica summary was built without quantile sketches')
+            return self._summary
+        if channels is None:
+            self.load_channels()
+            channels = [col for col in self.df.columns
+                        if col != self.WellKey and np.issubdtype(self.df[col].dtype, np.number)]
+        else:
+            self.load_channels(channels)
+
+        def __summary():
+            summary = TCA.WellSummary(channels, well_key=self.WellKey, eps=eps)
+            summary.update(self.df)
+            return summary
+
+        return self._get_derived(('summary', tuple(channels), eps), __summary)
+
+    def _get_derived(self, key, func):
+        """
+        Get data derived from raw data (counts, thresholds, ...), func is only called if raw data were modified since
+        last call with same key
+        :param key: hashable key of derived data
+        :param func: function without argument that compute derived data
+        :return: derived data
+        """
+        if self.__CACHING_derived_version != self._data_version:
+            self.__CACHING_derived.clear()
+            self.__CACHING_derived_version = self._data_version
+        if key not in self.__CACHING_derived:
+            self.__CACHING_derived[key] = func()
+        return self.__CACHING_derived[key]
+
+    def get_well_index(self):
+        """
+        Get the sorted by well layout of raw data, raw data are sorted by well at first call if needed
+        :return: WellIndex object
+        """
+        if self.__CACHING_wellidx is None or self.__CACHING_wellidx_version != self._data_version:
+            if self.df is None:
+                raise IOError('Empty rawdata')
+            wellidx = WellIndex(self.df[self.WellKey].values)
+            if not wellidx.is_sorted():
+                log.debug('Sort rawdata by well for {}'.format(self.name))
+                # # same data in another order, data version is kept
+                self._df = self.df.take(wellidx.order)
+                wellidx.set_sorted()
+                # # groupby, control positions and layout were done on the unsorted dataframe
+                self.__CACHING_gbdata = None
+                self.__CACHING_ctrlidx.clear()
+                self.__CACHING_derived.pop('layout', None)
+                for gate in self.__gates.values():
+                    gate['mask'] = None
+            self.__CACHING_wellidx = wellidx
+            self.__CACHING_wellidx_version = self._data_version
+        return self.__CACHING_wellidx
+
+    def get_well_layout(self):
+        """
+        Get the by well layout of raw data (see WellIndex) without sorting raw data, kept until raw data are modified
+        :return: tuple (WellIndex, cells), cells select rows of raw data in layout order (slice or array of position)
+        """
+        if self._sort_by_well:
+            wellidx = self.get_well_index()
+            return wellidx, slice(0, wellidx.offsets[-1])
+
+        def __layout():
+            wellidx = WellIndex(self.df[self.WellKey].values)
+            if wellidx.is_sorted():
+                return wellidx, slice(0, wellidx.offsets[-1])
+            return wellidx, wellidx.order[:wellidx.offsets[-1]]
+
+        return self._get_derived('layout', __layout)
+
+    def get_control_index(self, wells):
+        """
+        Get row position of cells of control wells in raw data, positions are kept until raw data are modified or
+        sorted, so that control data of all channels are taken without searching wells again
+        :param wells: well or list of wells (A1, B1 ...)
+        :return: numpy array of int
+        """
+        if not isinstance(wells, list):
+            wells = [wells]
+        if self.df is None:
+            raise IOError('Empty rawdata')
+        if self.__CACHING_ctrlidx_version != self._data_version:
+            self.__CACHING_ctrlidx.clear()
+            self.__CACHING_ctrlidx_version = self._data_version
+        key = tuple(sorted(set(wells)))
+        if key not in self.__CACHING_ctrlidx:
+            self.__CACHING_ctrlidx[key] = np.flatnonzero(self.df[self.WellKey].isin(key).values)
+        return self.__CACHING_ctrlidx[key]
+
+    def get_control_data(self, channel, wells):
+        """
+        Get values of a channel for cells of control wells
+        :param channel: channel name
+        :param wells: well or list of wells (A1, B1 ...)
+        :return: numpy array
+        """
+        self.load_channels(channel)
+        return self.df[channel].values.take(self.get_control_index(wells))
+
+    def get_control_stat(self, channel, wells, stat='mean'):
+        """
+        Get a statistic of a channel on cells of control wells (NaN are skipped), kept until raw data are modified
+        :param channel: channel name
+        :param wells: well or list of wells (A1, B1 ...)
+        :param stat: mean, median, std or a percentile (number in [0, 100])
+        :return: value
+        """
+        if not isinstance(wells, list):
+            wells = [wells]
+
+        def __stat():
+            data = np.asarray(self.get_control_data(channel, wells), dtype=np.float64)
+            if stat == 'mean':
+                return np.nanmean(data)
+            elif stat == 'median':
+                return np.nanmedian(data)
+            elif stat == 'std':
+                return np.nanstd(data)
+            elif isinstance(stat, str):
+                raise ValueError('Unknown statistic : {}'.format(stat))
+            return np.nanpercentile(data, stat)
+
+        return self._get_derived(('control', channel, tuple(sorted(set(wells))), stat), __stat)
+
+    def get_well_rawdata(self, well, channel=None):
+        """
+        Get raw data of one well, it's a slice of raw data (no copy) if cells are sorted by well
+        :param well: well name
+        :param channel: defined or not channel
+        :return: raw data in pandas dataframe or serie
+        """
+        self.load_channels(channel)
+        return self.__get_Well_group(well, channel)
 
     def __get_Well_group(self, Well, channel=None):
         """
@@ -405,27 +1232,31 @@ class Replica(GenericPlate):
         :param Well:
         :return:
         """
-        if self.__CACHING_gbdata is None:
-            self._new_caching()
+        if self._sort_by_well:
+            data = self.df.iloc[self.get_well_index().get_slice(Well)]
+        else:
+            data = self.get_groupby_data().get_group(Well)
         if channel is not None:
-            return self.__CACHING_gbdata.get_group(Well)[channel]
+            return data[channel]
         else:
-            return self.__CACHING_gbdata.get_group(Well)
+            return data
 
     def remove_wells_data(self, wells):
         """
         Remove wells from rawdata
         param wells: list of wells
         """
-        for well in wells:
-            self.df = self.df[self.df[self.WellKey] != well]
+        df = self.__get_unfiltered_df()
+        self.df = df[~df[self.WellKey].isin(wells)]
 
     def add_wells_data(self, data):
         """
         Add rawdata @ df
         """
+        # # added cells are not in file, lazy loading is not possible anymore
+        self.load_channels()
         try:
-            self.df = self.df.append(data)
+            self.df = self.__get_unfiltered_df().append(data)
         except Exception as e:
             print(e)
 
@@ -433,10 +1264,14 @@ class Replica(GenericPlate):
         """
         iterate on group with groups key
         """
-        if self.__CACHING_gbdata is None:
-            self._new_caching()
-        for key, value in self.__CACHING_gbdata.groups.items():
-            yield key, self.df.iloc[value, :]
+        self.load_channels()
+        if self._sort_by_well:
+            wellidx = self.get_well_index()
+            for well in wellidx.wells:
+                yield well, self.df.iloc[wellidx.get_slice(well)]
+        else:
+            for key, value in self.get_groupby_data():
+                yield key, value
 
     def __repr__(self):
         """
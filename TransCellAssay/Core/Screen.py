@@ -0,0 +1,404 @@
+# coding=utf-8
+"""
+Screen is designed for manipulating many plates at once, well data of all plates are stacked into one numpy array of
+shape (plate, replica, row, col) for each channel, with the platemap of each plate as an array of shape (plate, row,
+col). Normalization, systematic error correction, scoring and quality control of the whole screen are then computed
+with vectorized operations on the stack instead of a loop on plates.
+
+Plates with less replica than others are padded with NaN replica, all plates must have the same shape.
+"""
+
+import numpy as np
+import pandas as pd
+import TransCellAssay as TCA
+import collections
+import logging
+log = logging.getLogger(__name__)
+
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+class Screen(object):
+    """
+    Class for manipulating all plates of a screen as stacked arrays
+
+    self.plates = {}                    # Dict that contain all plates, key are name and value are plate object
+    self.array = {}                     # stacked well data for each channel, shape (plate, replica, row, col)
+    self.array_c = {}                   # stacked corrected well data for each channel
+    """
+
+    def __init__(self, name='Screen', plates=None, datatype='mean'):
+        """
+        Constructor
+        :param name: name of screen
+        :param plates: add one or a list of plate
+        :param datatype: mean or median for well data
+        """
+        self.name = name
+        self.datatype = datatype
+        self.plates = collections.OrderedDict()
+        self.array = {}
+        self.array_c = {}
+        self.isNormalized = {}
+        self.isSpatialNormalized = {}
+        if plates is not None:
+            self.__add__(plates)
+
+    def add_plate(self, plate):
+        """
+        Add plate object to screen, equivalent to + operator
+        :param plate: plate object or list of plate object
+        """
+        self.__add__(plate)
+
+    def get_plates(self):
+        """
+        Get all plates
+        :return: list of plate object
+        """
+        return list(self.plates.values())
+
+    def get_plate_names(self):
+        """
+        Get name of all plates, in stack order
+        :return: list of plate name
+        """
+        return list(self.plates.keys())
+
+    def get_replica_names(self):
+        """
+        Get name of replica for each plate, in stack order
+        :return: list of list of replica name
+        """
+        return [plate.get_replica_listId() for plate in self.plates.values()]
+
+    def shape(self):
+        """
+        Shape of stacked arrays
+        :return: tuple (plate, replica, row, col)
+        """
+        if len(self.plates) == 0:
+            return 0, 0, 0, 0
+        row, col = next(iter(self.plates.values())).platemap.shape()
+        return len(self.plates), max(len(plate) for plate in self.plates.values()), row, col
+
+    def get_wells(self):
+        """
+        Get well names of plates in row major order (A1, A2, ...)
+        :return: list of well
+        """
+        platemap = next(iter(self.plates.values())).platemap.platemap
+        return [str(r) + str(c) for r in platemap.index for c in platemap.columns]
+
+    def get_platemap_array(self):
+        """
+        Stacked platemaps of all plates
+        :return: numpy array of shape (plate, row, col)
+        """
+        return np.array([plate.platemap.platemap.values for plate in self.plates.values()], dtype=object)
+
+    def get_control_mask(self, control):
+        """
+        Get position of control in all plates
+        :param control: control name or list of control name
+        :return: boolean numpy array of shape (plate, row, col)
+        """
+        if not isinstance(control, list):
+            control = [control]
+        mask = np.isin(self.get_platemap_array().astype(str), [str(ctrl) for ctrl in control])
+        if not np.any(mask):
+            raise KeyError('Control not found in platemaps : {}'.format(control))
+        return mask
+
+    def get_replica_mask(self):
+        """
+        Get which replica exist for each plate (others are padded with NaN)
+        :return: boolean numpy array of shape (plate, replica)
+        """
+        nplate, nrep, row, col = self.shape()
+        mask = np.zeros((nplate, nrep), dtype=bool)
+        for i, plate in enumerate(self.plates.values()):
+            mask[i, :len(plate)] = True
+        return mask
+
+    def load_channels(self, channels, datatype=None):
+        """
+        Compute and stack well data of all plates for channels, each replica compute all channels in one pass
+        :param channels: channel or list of channels
+        :param datatype: mean or median, default to screen datatype
+        """
+        if not isinstance(channels, list):
+            channels = [channels]
+        if datatype is None:
+            datatype = self.datatype
+        nplate, nrep, row, col = self.shape()
+        stack = np.full((nplate, nrep, len(channels), row, col), np.nan)
+        for i, plate in enumerate(self.plates.values()):
+            data = plate.get_data_channels(channels, datatype=datatype)
+            if data.shape[2:] != (row, col):
+                raise ValueError('All plates must have same shape : {0} -> {1}'.format(plate.name, data.shape[2:]))
+            stack[i, :len(plate)] = data
+        for j, chan in enumerate(channels):
+            self.array[chan] = np.ascontiguousarray(stack[:, :, j])
+            self.array_c.pop(chan, None)
+            self.isNormalized[chan] = False
+            self.isSpatialNormalized[chan] = False
+        log.info('Screen {0} : {1} plates stacked for {2}'.format(self.name, nplate, channels))
+
+    def get_array(self, channel, sec_data=False):
+        """
+        Get stacked well data of channel, computed if needed
+        :param channel: channel name
+        :param sec_data: get systematic error corrected data
+        :return: numpy array of shape (plate, replica, row, col)
+        """
+        if sec_data:
+            if channel not in self.array_c:
+                raise AttributeError('Data not corrected for {}'.format(channel))
+            return self.array_c[channel]
+        if channel not in self.array:
+            self.load_channels([channel])
+        return self.array[channel]
+
+    def get_mean_array(self, channel, sec_data=False):
+        """
+        Mean of replica for each plate
+        :param channel: channel name
+        :param sec_data: use systematic error corrected data
+        :return: numpy array of shape (plate, row, col)
+        """
+        with np.errstate(invalid='ignore'):
+            return np.nanmean(self.get_array(channel, sec_data=sec_data), axis=1)
+
+    def __control_data(self, array, control):
+        """
+        Data of control wells for each plate and replica, others wells are NaN
+        """
+        return np.where(self.get_control_mask(control)[:, np.newaxis], array, np.nan)
+
+    def normalization(self, channel, method='Zscore', neg=None, pos=None):
+        """
+        Normalize well data of each plate and replica in one vectorized operation, stacked data are replaced
+        :param channel: channel to normalize
+        :param method: Zscore, RobustZscore, PercentOfSample, RobustPercentOfSample, PercentOfControl,
+        RobustPercentOfControl or NormalizedPercentInhibition
+        :param neg: negative control name
+        :param pos: positive control name
+        """
+        __valid_method = ['Zscore', 'RobustZscore', 'PercentOfSample', 'RobustPercentOfSample', 'PercentOfControl',
+                          'RobustPercentOfControl', 'NormalizedPercentInhibition']
+        if method not in __valid_method:
+            raise ValueError("Method don't exist, choose : {}".format(__valid_method))
+        if self.isNormalized.get(channel, False):
+            log.warning('Screen {0} : {1} already normalized'.format(self.name, channel))
+        x = self.get_array(channel)
+        axis = (2, 3)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if method == 'Zscore':
+                x = (x - np.nanmean(x, axis=axis, keepdims=True)) / np.nanstd(x, axis=axis, keepdims=True)
+            elif method == 'RobustZscore':
+                med = np.nanmedian(x, axis=axis, keepdims=True)
+                x = (x - med) / (1.4826 * np.nanmedian(np.absolute(x - med), axis=axis, keepdims=True))
+            elif method == 'PercentOfSample':
+                x = x / np.nanmean(x, axis=axis, keepdims=True) * 100
+            elif method == 'RobustPercentOfSample':
+                x = x / np.nanmedian(x, axis=axis, keepdims=True) * 100
+            elif method in ('PercentOfControl', 'RobustPercentOfControl'):
+                if neg is None and pos is None:
+                    raise AttributeError("Need Negative or Positive control")
+                ctrl = self.__control_data(x, neg if neg is not None else pos)
+                if method == 'PercentOfControl':
+                    x = x / np.nanmean(ctrl, axis=axis, keepdims=True) * 100
+                else:
+                    x = x / np.nanmedian(ctrl, axis=axis, keepdims=True) * 100
+            elif method == 'NormalizedPercentInhibition':
+                if neg is None or pos is None:
+                    raise AttributeError("Need Negative and Positive control")
+                neg_mean = np.nanmean(self.__control_data(x, neg), axis=axis, keepdims=True)
+                pos_mean = np.nanmean(self.__control_data(x, pos), axis=axis, keepdims=True)
+                x = (neg_mean - x) / (neg_mean - pos_mean) * 100
+        self.array[channel] = x
+        self.array_c.pop(channel, None)
+        self.isNormalized[channel] = True
+        log.info('Screen {0} : {1} normalized with {2}'.format(self.name, channel, method))
+
+    def systematic_error_correction(self, channel, algorithm='Bscore', max_iterations=100, epsilon=0.01, **kwargs):
+        """
+        Apply a systematic error correction on each plate and replica, result is saved in array_c
+        Bscore is computed for all plates in one vectorized median polish, other algorithms are applied plate by plate
+        with same function as Plate (see GenericPlate.correct_array)
+        :param channel: channel to correct
+        :param algorithm: Bscore, BZscore, PMP, MEA, DiffusionModel, Lowess or Polynomial
+        :param max_iterations: max iterations for all technics
+        :param epsilon: epsilon parameters
+        :param kwargs: other parameters of correct_array
+        """
+        __valid_sec_algo = ['Bscore', 'BZscore', 'PMP', 'MEA', 'DiffusionModel', 'Lowess', 'Polynomial']
+        if algorithm not in __valid_sec_algo:
+            raise ValueError('Algorithm is not available choose : {}'.format(__valid_sec_algo))
+        x = self.get_array(channel)
+        exist = self.get_replica_mask()
+        if algorithm == 'Bscore':
+            corrected = np.full(x.shape, np.nan)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                corrected[exist] = TCA.bscore_stack(x[exist], max_iterations=max_iterations, eps=epsilon)
+        else:
+            corrected = np.full(x.shape, np.nan)
+            for i, j in zip(*np.nonzero(exist)):
+                corrected[i, j] = TCA.Core.GenericPlate.correct_array(x[i, j].copy(), algorithm=algorithm,
+                                                                      max_iterations=max_iterations,
+                                                                      epsilon=epsilon, **kwargs)
+        corrected[exist] = np.nan_to_num(corrected[exist])
+        self.array_c[channel] = corrected
+        self.isSpatialNormalized[channel] = True
+        log.info('Screen {0} : systematic error correction of {1} with {2}'.format(self.name, channel, algorithm))
+
+    def quality_control(self, channel, cneg, cpos, sec_data=False):
+        """
+        Compute quality control of each plate and replica, same columns as plates_quality_control
+        :param channel: channel on which we performed quality control
+        :param cneg: negative control Name
+        :param cpos: positive control Name
+        :param sec_data: use sec data
+        :return: dataframe with qc, one line for each replica
+        """
+        x = self.get_array(channel, sec_data=sec_data)
+        exist = self.get_replica_mask()
+        axis = (2, 3)
+        with np.errstate(invalid='ignore'):
+            negdata = self.__control_data(x, cneg)
+            posdata = self.__control_data(x, cpos)
+            X = pd.DataFrame({'Replicat ID': ["{0}--{1}".format(plate, rep) for plate, reps in
+                                              zip(self.get_plate_names(), self.get_replica_names()) for rep in reps],
+                              'Neg Mean': np.nanmean(negdata, axis=axis)[exist],
+                              'Neg SD': np.nanstd(negdata, axis=axis)[exist],
+                              'Pos Mean': np.nanmean(posdata, axis=axis)[exist],
+                              'Pos SD': np.nanstd(posdata, axis=axis)[exist],
+                              'Plate Mean': np.mean(x, axis=axis)[exist],
+                              'Plate SD': np.std(x, axis=axis)[exist]},
+                             columns=['Replicat ID', 'Neg Mean', 'Neg SD', 'Pos Mean', 'Pos SD', 'Plate Mean',
+                                      'Plate SD'])
+
+        return TCA.quality_control_metrics(X)
+
+    def zscore(self, channel, neg, sec_data=False):
+        """
+        Compute zscore of all wells against negative control of their plate, like plate_zscore
+        :param channel: channel to score
+        :param neg: negative control name
+        :param sec_data: use sec data
+        :return: numpy array (plate, row, col) of zscore and robust zscore
+        """
+        x = self.get_array(channel, sec_data=sec_data)
+        axis = (1, 2, 3)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            negdata = self.__control_data(x, neg)
+            neg_med = np.nanmedian(negdata, axis=axis)[:, np.newaxis, np.newaxis]
+            neg_mad = 1.4826 * np.nanmedian(np.absolute(negdata - neg_med[:, np.newaxis]), axis=axis)
+            zscore = (np.nanmean(x, axis=1) - np.nanmean(negdata, axis=axis)[:, np.newaxis, np.newaxis]) / \
+                np.nanstd(negdata, axis=axis)[:, np.newaxis, np.newaxis]
+            zscore_r = (np.nanmedian(x, axis=1) - neg_med) / neg_mad[:, np.newaxis, np.newaxis]
+        return zscore, zscore_r
+
+    def score(self, channel, neg, sec_data=False):
+        """
+        Score of all wells of screen in one dataframe
+        :param channel: channel to score
+        :param neg: negative control name
+        :param sec_data: use sec data
+        :return: dataframe with one line for each well of each plate
+        """
+        x = self.get_array(channel, sec_data=sec_data)
+        nplate, nrep, row, col = x.shape
+        zscore, zscore_r = self.zscore(channel, neg, sec_data=sec_data)
+        with np.errstate(invalid='ignore'):
+            DF = pd.DataFrame({'PlateMap': self.get_platemap_array().reshape(-1),
+                               'Well': np.tile(self.get_wells(), nplate),
+                               'PlateName': np.repeat(self.get_plate_names(), row * col),
+                               'Well Mean': np.nanmean(x, axis=1).reshape(-1),
+                               'Well Std': np.nanstd(x, axis=1, ddof=1).reshape(-1),
+                               'ZScore': zscore.reshape(-1),
+                               'ZScore R': zscore_r.reshape(-1)},
+                              columns=['PlateMap', 'Well', 'PlateName', 'Well Mean', 'Well Std', 'ZScore',
+                                       'ZScore R'])
+        return DF
+
+    def clear(self):
+        """
+        Remove all stacked data
+        """
+        self.array = {}
+        self.array_c = {}
+        self.isNormalized = {}
+        self.isSpatialNormalized = {}
+
+    def __add__(self, to_add):
+        """
+        Add plate object to screen, use + operator, stacked data are cleared
+        :param to_add: plate object or list of plate object
+        """
+        if isinstance(to_add, list):
+            for plate in to_add:
+                self.__add__(plate)
+        elif isinstance(to_add, TCA.Plate):
+            if to_add.name in self.plates:
+                log.warning('Plate already in screen, overwriting : {}'.format(to_add.name))
+            if len(self.plates) > 0 and to_add.platemap.shape() != self.shape()[2:]:
+                raise ValueError('All plates must have same shape')
+            self.plates[to_add.name] = to_add
+            self.clear()
+        else:
+            raise AttributeError("Unsupported Type")
+        return self
+
+    def __sub__(self, to_rm):
+        """
+        Remove plate from screen, use - operator, stacked data are cleared
+        :param to_rm: name of plate
+        """
+        del self.plates[to_rm]
+        self.clear()
+        return self
+
+    def __getitem__(self, key):
+        """
+        Return plate object, use [] operator
+        :param key: name of plate
+        """
+        return self.plates[key]
+
+    def __len__(self):
+        """
+        Number of plates
+        """
+        return len(self.plates)
+
+    def __iter__(self):
+        """
+        Iterator on plates
+        """
+        for key, value in self.plates.items():
+            yield key, value
+
+    def __repr__(self):
+        """
+        Definition for the representation
+        """
+        return (
+            "\nScreen ID : " + repr(self.name) +
+            "\nNumber of plates : " + repr(len(self.plates)) +
+            "\nShape : " + repr(self.shape()) +
+            "\nStacked channels : " + repr(list(self.array.keys()))
+        )
+
+    def __str__(self):
+        """
+        Definition for the print
+        """
+        return self.__repr__()
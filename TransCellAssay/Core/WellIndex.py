@@ -0,0 +1,233 @@
+# coding=utf-8
+"""
+WellIndex describe a sorted by well layout of single cell data (CSR like), cells of a well are stored contiguously and
+an offsets array give the begin and end of each well, so that a well data is a simple slice (no copy) and reduction
+on all wells are done in one pass with numpy ufunc reduceat.
+
+    wells   = [A1, A2, B1]
+    offsets = [0, 120, 250, 400]    # A1 -> [0:120], A2 -> [120:250], B1 -> [250:400]
+
+Cells without well (NaN) are put at the end of the layout, after offsets[-1], and are ignored by reductions.
+"""
+
+import numpy as np
+import pandas as pd
+import logging
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+class WellIndex(object):
+    """
+    Class for storing the well layout of sorted single cell data
+    self.wells = np.array()             # wells name in layout order
+    self.offsets = np.array()           # begin/end of each well, len(wells) + 1
+    self.order = np.array()             # permutation that sort data by well (None if already sorted)
+    """
+
+    def __init__(self, wells_values):
+        """
+        Constructor, build layout from the well column of raw data
+        :param wells_values: well column (array or pandas serie) of raw data
+        """
+        codes, uniques = pd.factorize(wells_values, sort=True)
+        codes = np.asarray(codes)
+        nwells = len(uniques)
+        # # cells without well go at the end
+        codes[codes < 0] = nwells
+        if len(codes) > 1 and np.any(codes[1:] < codes[:-1]):
+            self.order = np.argsort(codes, kind='mergesort')
+        else:
+            self.order = None
+        counts = np.bincount(codes, minlength=nwells + 1)[:nwells]
+        self.wells = np.asarray(uniques)
+        self.offsets = np.zeros(nwells + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.__position = dict((well, i) for i, well in enumerate(self.wells))
+        self.__codes = None
+        log.debug('WellIndex created for {} wells'.format(nwells))
+
+    def __len__(self):
+        """
+        Number of wells in layout
+        """
+        return len(self.wells)
+
+    def is_sorted(self):
+        """
+        Are data already in layout order
+        """
+        return self.order is None
+
+    def set_sorted(self):
+        """
+        Data were sorted with self.order, layout is now in place
+        """
+        self.order = None
+
+    def get_counts(self):
+        """
+        Number of cells for each well
+        :return: numpy array
+        """
+        return np.diff(self.offsets)
+
+    def get_codes(self):
+        """
+        Well code (position in self.wells) for each cells of layout (cells without well excluded)
+        :return: numpy array
+        """
+        if self.__codes is None:
+            self.__codes = np.repeat(np.arange(len(self.wells)), self.get_counts())
+        return self.__codes
+
+    def get_bounds(self, well):
+        """
+        Get begin and end of well in layout
+        :param well: well name
+        :return: tuple (begin, end)
+        """
+        i = self.__position[well]
+        return self.offsets[i], self.offsets[i + 1]
+
+    def get_slice(self, well):
+        """
+        Get the slice of well in layout
+        :param well: well name
+        :return: slice object
+        """
+        begin, end = self.get_bounds(well)
+        return slice(begin, end)
+
+    def reduce(self, values, how='mean'):
+        """
+        Reduce values for each well in one pass, NaN are skipped like pandas groupby
+        :param values: 1d array of values in layout order
+        :param how: count, sum, mean or median
+        :return: numpy array with one value per well
+        """
+        values = np.asarray(values)[:self.offsets[-1]]
+        if how == 'median':
+            return self.__median(values)
+        valid = ~np.isnan(values)
+        begin = self.offsets[:-1]
+        n = np.add.reduceat(valid, begin, dtype=np.int64) if len(values) > 0 else np.zeros(len(begin), np.int64)
+        n[self.get_counts() == 0] = 0
+        if how == 'count':
+            return n
+        total = np.add.reduceat(np.where(valid, values, 0), begin, dtype=np.float64) if len(values) > 0 else \
+            np.zeros(len(begin))
+        total[self.get_counts() == 0] = 0
+        if how == 'sum':
+            return total
+        elif how == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                res = total / n
+            res[n == 0] = np.nan
+            return res
+        else:
+            raise ValueError('Unknown reduction : {}'.format(how))
+
+    def sort_values(self, values):
+        """
+        Sort values inside each well, NaN are put at the end of each well
+        :param values: 1d array of values in layout order
+        :return: sorted values and number of non NaN values for each well
+        """
+        values = np.asarray(values)[:self.offsets[-1]]
+        # # each well is a contiguous slice, sorted inplace (faster than an indirect sort of all values)
+        svalues = values.copy()
+        for begin, end in zip(self.offsets[:-1], self.offsets[1:]):
+            svalues[begin:end].sort()
+        valid = ~np.isnan(values)
+        n = np.add.reduceat(valid, self.offsets[:-1], dtype=np.int64) if len(values) > 0 else \
+            np.zeros(len(self.wells), np.int64)
+        n[self.get_counts() == 0] = 0
+        return svalues, n
+
+    def sorted_median(self, svalues, n, skipna=True):
+        """
+        Median of each well from values sorted inside wells (see sort_values)
+        :param svalues: sorted values
+        :param n: number of non NaN values for each well
+        :param skipna: skip NaN like pandas, else a well with NaN give NaN like numpy median
+        :return: numpy array with one value per well
+        """
+        res = np.full(len(self.wells), np.nan)
+        if skipna:
+            ok = n > 0
+        else:
+            ok = (self.get_counts() > 0) & (n == self.get_counts())
+        begin = self.offsets[:-1][ok]
+        low = svalues[begin + (n[ok] - 1) // 2]
+        high = svalues[begin + n[ok] // 2]
+        res[ok] = (low + high) / 2.
+        return res
+
+    def count_greater(self, svalues, n, thresholds):
+        """
+        Number of values greater than each threshold for each well, from values sorted inside wells (see
+        sort_values), each well is searched once for all thresholds
+        :param svalues: sorted values
+        :param n: number of non NaN values for each well
+        :param thresholds: list of thresholds
+        :return: numpy array of shape (len(thresholds), len(wells))
+        """
+        thresholds = np.asarray(thresholds)
+        res = np.zeros((len(thresholds), len(self.wells)), dtype=np.int64)
+        for i, (begin, size) in enumerate(zip(self.offsets[:-1], n)):
+            res[:, i] = size - np.searchsorted(svalues[begin:begin + size], thresholds, side='right')
+        return res
+
+    def percentile(self, values, q=None):
+        """
+        Median (q is None) or percentile of values for each well, in one pass and with same result as numpy median and
+        percentile (linear interpolation) on values of each well, a well with NaN give NaN
+        :param values: 1d array of values in layout order
+        :param q: percentile in [0, 100], median if None
+        :return: numpy array with one value per well
+        """
+        values = np.asarray(values)[:self.offsets[-1]]
+        svalues, n = self.sort_values(values)
+        counts = self.get_counts()
+        ok = (counts > 0) & (n == counts)
+        begin = self.offsets[:-1][ok]
+        size = counts[ok]
+        if q is None:
+            dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+            res = np.full(len(self.wells), np.nan, dtype=dtype)
+            low = svalues[begin + (size - 1) // 2]
+            high = svalues[begin + size // 2]
+            res[ok] = np.where(size % 2 == 1, low, (low + high) / 2.)
+            return res
+        if not 0 <= q <= 100:
+            raise ValueError('Percentile must be in [0, 100]')
+        res = np.full(len(self.wells), np.nan)
+        # # same interpolation as numpy, index -1 (last value) is used above bounds
+        virtual = (size - 1) * np.true_divide(q, 100)
+        lower = np.floor(virtual)
+        upper = lower + 1
+        above = virtual >= size - 1
+        lower[above] = -1
+        upper[above] = -1
+        gamma = virtual - lower
+        lower = np.where(above, size - 1, lower).astype(np.intp)
+        upper = np.where(above, size - 1, upper).astype(np.intp)
+        a = svalues[begin + lower]
+        b = svalues[begin + upper]
+        diff = b - a
+        res[ok] = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+        return res
+
+    def __median(self, values):
+        """
+        Median of each well from values sorted inside wells
+        """
+        svalues, n = self.sort_values(values)
+        return self.sorted_median(svalues, n)
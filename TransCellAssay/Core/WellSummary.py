@@ -0,0 +1,297 @@
+# coding=utf-8
+"""
+WellSummary store per well and per channel sufficient statistics of single cell data (number of cells, number of
+values, sum, centered sum of squares, min and max). Statistics are accumulated chunk by chunk, so a flat file can be
+read in one pass with constant memory (see read_csv), and two summaries can be merged.
+
+Centered sum of squares are merged with the pairwise formula of Chan et al. instead of summing raw squares, which
+avoid precision loss on variance for channels with large mean.
+
+With eps, a quantile sketch (see QuantileSketch) is also kept for each well and channel, so that median, MAD and
+percentiles are available with a rank error lower than eps.
+"""
+
+import numpy as np
+import pandas as pd
+from TransCellAssay.Core.QuantileSketch import QuantileSketch, get_sketch_size
+import logging
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+class WellSummary(object):
+    """
+    Class for storing per well statistics of single cell data, arrays are (well, channel) in well insertion order
+    self.channels = []                  # channels name
+    self.wells = []                     # wells name
+    self.cells = np.array()             # number of cells for each well
+    self.n = np.array()                 # number of non NaN values
+    self.sum = np.array()               # sum of values
+    self.m2 = np.array()                # sum of squared deviation from well mean
+    self.min = np.array()
+    self.max = np.array()
+    self.sketches = []                  # list of QuantileSketch (one by channel) for each well, if eps
+    """
+
+    def __init__(self, channels, well_key='Well', eps=None):
+        """
+        Constructor
+        :param channels: list of channels to summarize
+        :param well_key: well column name
+        :param eps: if not None, keep quantile sketches with this rank error (0.01 for 1%)
+        """
+        self.channels = list(channels)
+        self.well_key = well_key
+        self.eps = eps
+        self.__k = get_sketch_size(eps) if eps is not None else None
+        self.sketches = []
+        self.wells = []
+        self.__position = {}
+        nchan = len(self.channels)
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.n = np.zeros((0, nchan), dtype=np.int64)
+        self.sum = np.zeros((0, nchan))
+        self.m2 = np.zeros((0, nchan))
+        self.min = np.zeros((0, nchan))
+        self.max = np.zeros((0, nchan))
+
+    def __len__(self):
+        """
+        Number of wells
+        """
+        return len(self.wells)
+
+    def __add_wells(self, wells):
+        """
+        Get position of wells, unknown wells are appended
+        """
+        new = [well for well in wells if well not in self.__position]
+        if len(new) > 0:
+            for well in new:
+                self.__position[well] = len(self.wells)
+                self.wells.append(well)
+                if self.eps is not None:
+                    self.sketches.append([QuantileSketch(self.__k, seed=0) for chan in self.channels])
+            nnew, nchan = len(new), len(self.channels)
+            self.cells = np.concatenate([self.cells, np.zeros(nnew, dtype=np.int64)])
+            self.n = np.concatenate([self.n, np.zeros((nnew, nchan), dtype=np.int64)])
+            self.sum = np.concatenate([self.sum, np.zeros((nnew, nchan))])
+            self.m2 = np.concatenate([self.m2, np.zeros((nnew, nchan))])
+            self.min = np.concatenate([self.min, np.full((nnew, nchan), np.nan)])
+            self.max = np.concatenate([self.max, np.full((nnew, nchan), np.nan)])
+        return np.array([self.__position[well] for well in wells], dtype=np.int64)
+
+    def __merge(self, pos, cells, n, total, m2, vmin, vmax):
+        """
+        Merge statistics of some wells into summary
+        """
+        self.cells[pos] += cells
+        na, nb = self.n[pos], n
+        nab = na + nb
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(nb > 0, total / nb, 0) - np.where(na > 0, self.sum[pos] / na, 0)
+            corr = np.where((na > 0) & (nb > 0), delta ** 2 * na * nb / nab, 0)
+        self.m2[pos] += m2 + corr
+        self.sum[pos] += total
+        self.n[pos] = nab
+        self.min[pos] = np.fmin(self.min[pos], vmin)
+        self.max[pos] = np.fmax(self.max[pos], vmax)
+
+    def update(self, df):
+        """
+        Add cells of a dataframe (a chunk of file) to summary
+        :param df: pandas dataframe with well column and channels
+        """
+        codes, uniques = pd.factorize(df[self.well_key])
+        codes = np.asarray(codes)
+        keep = codes >= 0
+        if not np.all(keep):
+            codes = codes[keep]
+        pos = self.__add_wells(list(uniques))
+        nwells, nchan = len(uniques), len(self.channels)
+        cells = np.bincount(codes, minlength=nwells)
+        n = np.zeros((nwells, nchan), dtype=np.int64)
+        total = np.zeros((nwells, nchan))
+        m2 = np.zeros((nwells, nchan))
+        for i, chan in enumerate(self.channels):
+            values = np.asarray(df[chan].values, dtype=np.float64)
+            if not np.all(keep):
+                values = values[keep]
+            valid = ~np.isnan(values)
+            n[:, i] = np.bincount(codes, weights=valid, minlength=nwells)
+            total[:, i] = np.bincount(codes, weights=np.where(valid, values, 0), minlength=nwells)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total[:, i] / n[:, i]
+            dev = np.where(valid, values - mean[codes], 0)
+            m2[:, i] = np.bincount(codes, weights=dev ** 2, minlength=nwells)
+        gb = pd.DataFrame(np.asarray(df[self.channels].values, dtype=np.float64)[keep]).groupby(codes)
+        vmin = np.full((nwells, nchan), np.nan)
+        vmax = np.full((nwells, nchan), np.nan)
+        if len(codes) > 0:
+            mins, maxs = gb.min(), gb.max()
+            vmin[mins.index.values] = mins.values
+            vmax[maxs.index.values] = maxs.values
+        self.__merge(pos, cells, n, total, m2, vmin, vmax)
+        if self.eps is not None and len(codes) > 0:
+            # # values of each well are contiguous after a stable sort on well code
+            order = np.argsort(codes, kind='mergesort')
+            bounds = np.cumsum(cells)[:-1]
+            for i, chan in enumerate(self.channels):
+                values = np.asarray(df[chan].values, dtype=np.float64)[keep][order]
+                for j, well_values in enumerate(np.split(values, bounds)):
+                    self.sketches[pos[j]][i].update(well_values)
+
+    def merge(self, other):
+        """
+        Merge another summary (same channels) into this one
+        :param other: WellSummary object
+        """
+        if other.channels != self.channels:
+            raise ValueError('Summaries must have same channels')
+        if (self.eps is None) != (other.eps is None):
+            raise ValueError('Summaries must both have quantile sketches or not')
+        pos = self.__add_wells(other.wells)
+        self.__merge(pos, other.cells, other.n, other.sum, other.m2, other.min, other.max)
+        if self.eps is not None:
+            for j, sketches in enumerate(other.sketches):
+                for i, sketch in enumerate(sketches):
+                    self.sketches[pos[j]][i].merge(sketch)
+
+    def get_sorted_wells(self):
+        """
+        Wells sorted by name and their position in summary
+        :return: tuple (wells, positions)
+        """
+        wells = np.array(self.wells, dtype=object)
+        order = np.argsort(wells.astype(str), kind='mergesort')
+        return wells[order], order
+
+    @property
+    def sumsq(self):
+        """
+        Sum of squared values
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.m2 + np.where(self.n > 0, self.sum ** 2 / self.n, 0)
+
+    def get_stat(self, channel, stat='mean'):
+        """
+        Get a statistic of a channel for each well (in self.wells order)
+        :param channel: channel name
+        :param stat: count, sum, sumsq, mean, var, std, min, max (var and std with ddof=1 like pandas), median or mad
+        (only with quantile sketches)
+        :return: numpy array
+        """
+        if stat in ('median', 'mad'):
+            i = self.__get_sketch_channel(channel)
+            return np.array([getattr(sketches[i], stat)() for sketches in self.sketches], dtype=np.float64)
+        i = self.channels.index(channel)
+        n = self.n[:, i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if stat == 'count':
+                return n.copy()
+            elif stat == 'sum':
+                return self.sum[:, i].copy()
+            elif stat == 'sumsq':
+                return self.sumsq[:, i]
+            elif stat == 'mean':
+                return np.where(n > 0, self.sum[:, i] / n, np.nan)
+            elif stat == 'var':
+                return np.where(n > 1, self.m2[:, i] / (n - 1), np.nan)
+            elif stat == 'std':
+                return np.sqrt(np.where(n > 1, self.m2[:, i] / (n - 1), np.nan))
+            elif stat == 'min':
+                return self.min[:, i].copy()
+            elif stat == 'max':
+                return self.max[:, i].copy()
+            else:
+                raise ValueError('Unknown statistic : {}'.format(stat))
+
+    def get_quantile(self, channel, q):
+        """
+        Get a quantile of a channel for each well (in self.wells order), only with quantile sketches
+        :param channel: channel name
+        :param q: quantile in [0, 1]
+        :return: numpy array
+        """
+        i = self.__get_sketch_channel(channel)
+        return np.array([sketches[i].quantile(q) for sketches in self.sketches], dtype=np.float64)
+
+    def get_sketch(self, channel, wells=None):
+        """
+        Get quantile sketch of a channel merged over some wells, only with quantile sketches
+        :param channel: channel name
+        :param wells: list of wells, all if None
+        :return: QuantileSketch object
+        """
+        i = self.__get_sketch_channel(channel)
+        sketch = QuantileSketch(self.__k, seed=0)
+        for well in self.wells if wells is None else wells:
+            if well in self.__position:
+                sketch.merge(self.sketches[self.__position[well]][i])
+        return sketch
+
+    def __get_sketch_channel(self, channel):
+        """
+        Position of channel, raise if no quantile sketches
+        """
+        if self.eps is None:
+            raise ValueError('Quantiles need a summary built with eps')
+        return self.channels.index(channel)
+
+    def get_count(self):
+        """
+        Number of cells for each well, sorted by well
+        :return: pandas serie
+        """
+        wells, order = self.get_sorted_wells()
+        return pd.Series(self.cells[order], index=pd.Index(wells, name=self.well_key))
+
+    def to_frame(self, stats=('count', 'mean', 'std', 'min', 'max'), channels=None):
+        """
+        Statistics in a dataframe sorted by well, one column for each channel and statistic
+        :param stats: statistics to put in dataframe
+        :param channels: channels to put in dataframe, all if None
+        :return: pandas dataframe
+        """
+        wells, order = self.get_sorted_wells()
+        df = pd.DataFrame({self.well_key: wells, 'CellsCount': self.cells[order]})
+        for chan in self.channels if channels is None else channels:
+            for stat in stats:
+                df['{0} {1}'.format(chan, stat)] = self.get_stat(chan, stat)[order]
+        return df
+
+    @staticmethod
+    def read_csv(fpath, channels=None, well_key='Well', chunksize=100000, eps=None, **kwargs):
+        """
+        Read a flat file chunk by chunk into a summary, memory used depend only on chunksize
+        :param fpath: file path
+        :param channels: channels to summarize, all numeric columns if None
+        :param well_key: well column name
+        :param chunksize: number of lines read at once
+        :param eps: if not None, keep quantile sketches with this rank error
+        :param kwargs: pandas read_csv arguments
+        :return: WellSummary object
+        """
+        summary = None
+        nlines = 0
+        for chunk in pd.read_csv(fpath, engine='c', chunksize=chunksize, **kwargs):
+            if summary is None:
+                if well_key not in chunk.columns:
+                    raise ValueError('No {} column in file'.format(well_key))
+                if channels is None:
+                    channels = [col for col in chunk.columns
+                                if col != well_key and np.issubdtype(chunk[col].dtype, np.number)]
+                summary = WellSummary(channels, well_key=well_key, eps=eps)
+            summary.update(chunk)
+            nlines += len(chunk)
+        if summary is None:
+            raise IOError('Empty file : {}'.format(fpath))
+        log.info('Summarized {0} cells of {1} in {2} wells'.format(nlines, fpath, len(summary)))
+        return summary
@@ -3,3 +3,7 @@ __author__ = 'Arnaud KOPP'
 from TransCellAssay.Core.Plate import Plate
 from TransCellAssay.Core.PlateMap import PlateMap
 from TransCellAssay.Core.Replica import Replica
+from TransCellAssay.Core.WellSummary import WellSummary
+from TransCellAssay.Core.Screen import Screen
+from TransCellAssay.Core.Pipeline import Pipeline
+from TransCellAssay.Core.Gate import gate_mask, evaluate_gates, get_gate_names
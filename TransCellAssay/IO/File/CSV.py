@@ -6,6 +6,7 @@ Librarie for easy play with HTS csv data file
 import os
 import pandas as pd
 from TransCellAssay.IO.File.InputFile import InputFile
+from TransCellAssay.IO.File.Cache import BinaryCache
 import logging
 log = logging.getLogger(__name__)
 
@@ -25,17 +26,24 @@ class CSV(InputFile):
     def __init__(self):
         super(CSV, self).__init__()
 
-    def load(self, fpath, sep=',', **kwargs):
+    def load(self, fpath, sep=',', compact=False, cache=False, **kwargs):
         """
         Load csv file
         :param fpath:
+        :param compact: store data in float32 when possible and well as categorical
+        :param cache: keep parsed file in a binary sidecar cache and read it when up to date (see BinaryCache)
         """
         if os.path.isfile(fpath):
             try:
                 log.info('Reading %s File' % fpath)
-                self.dataframe = pd.read_csv(fpath, engine='c', **kwargs)
+                if cache:
+                    self.dataframe = BinaryCache(fpath).read_csv(**kwargs)
+                else:
+                    self.dataframe = pd.read_csv(fpath, engine='c', **kwargs)
                 log.info('Finish reading file')
                 self.__filepath = fpath
+                if compact:
+                    self.compact()
             except Exception as e:
                 log.error(e)
                 pass
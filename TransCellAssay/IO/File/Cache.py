@@ -0,0 +1,221 @@
+# coding=utf-8
+"""
+Binary sidecar cache for parsed flat files, each column is stored in a .npy file next to the source and a small json
+manifest describe the columns and the source file, so that re-opening a file mmap the columns instead of parsing text.
+
+    data.csv
+    data.csv.tca/manifest.json
+    data.csv.tca/0.npy, 1.npy ...
+
+Cache is valid only if path, size, mtime and a sampled content hash of the source file are unchanged, and if file
+was read with same pandas arguments.
+
+Rows can be written sorted by well (sort_by), each well is then a contiguous block of pages in column files, and
+dataframe can be built directly over copy on write memory maps (copy=False) for working on data larger than RAM.
+"""
+
+import os
+import json
+import hashlib
+import shutil
+import numpy as np
+import pandas as pd
+from TransCellAssay.Core.WellIndex import WellIndex
+import logging
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+CACHE_VERSION = 1
+
+
+class BinaryCache(object):
+    """
+    Class for storing a parsed flat file in binary columnar format
+    self.fpath = str                    # source file
+    self.directory = str                # cache directory
+    """
+
+    def __init__(self, fpath, directory=None, sample_size=1 << 16):
+        """
+        Constructor
+        :param fpath: source file path
+        :param directory: cache directory, default is fpath + '.tca'
+        :param sample_size: size in bytes of the 3 blocks (begin, middle, end) used for content hash
+        """
+        self.fpath = os.path.abspath(fpath)
+        self.directory = directory if directory is not None else self.fpath + '.tca'
+        self.sample_size = sample_size
+        self.__manifest = None
+
+    def get_key(self):
+        """
+        Key of source file : path, size, mtime and content hash, hash is done on 3 blocks of file and not on the
+        whole file for being fast on multi-GB files
+        :return: dict
+        """
+        stat = os.stat(self.fpath)
+        sha = hashlib.sha1(str(stat.st_size).encode())
+        with open(self.fpath, 'rb') as f:
+            for pos in (0, max(0, stat.st_size // 2 - self.sample_size // 2), max(0, stat.st_size - self.sample_size)):
+                f.seek(pos)
+                sha.update(f.read(self.sample_size))
+        return {'path': self.fpath, 'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': sha.hexdigest()}
+
+    def get_manifest(self):
+        """
+        Read manifest of cache
+        :return: dict or None if no cache
+        """
+        if self.__manifest is None:
+            try:
+                with open(os.path.join(self.directory, 'manifest.json'), 'r') as f:
+                    self.__manifest = json.load(f)
+            except (IOError, OSError, ValueError):
+                return None
+        return self.__manifest
+
+    def is_valid(self, sort_by=None, **kwargs):
+        """
+        Is cache up to date with source file
+        :param sort_by: if not None, rows of cache must be sorted by this column
+        :param kwargs: pandas arguments used for reading source file
+        :return: bool
+        """
+        manifest = self.get_manifest()
+        if manifest is None or manifest.get('version') != CACHE_VERSION:
+            return False
+        if sort_by is not None and manifest.get('sort_by') != sort_by:
+            return False
+        if manifest.get('kwargs') != self.__kwargs_key(kwargs):
+            return False
+        try:
+            return manifest.get('key') == self.get_key()
+        except (IOError, OSError):
+            return False
+
+    def get_columns(self):
+        """
+        Columns stored in cache
+        :return: list
+        """
+        manifest = self.get_manifest()
+        if manifest is None:
+            raise IOError('No cache for {}'.format(self.fpath))
+        return [col['name'] for col in manifest['columns']]
+
+    def load(self, columns=None, mmap=True, copy=True):
+        """
+        Load columns from cache
+        :param columns: list of columns to load, all if None
+        :param mmap: memory map the column files instead of reading them, True for read only map or a numpy mmap
+        mode ('c' for copy on write)
+        :param copy: if False and mmap, dataframe columns are the memory maps (no copy in RAM)
+        :return: pandas dataframe
+        """
+        manifest = self.get_manifest()
+        if manifest is None:
+            raise IOError('No cache for {}'.format(self.fpath))
+        if mmap is True:
+            mmap_mode = 'r'
+        else:
+            mmap_mode = mmap if mmap else None
+        data = dict()
+        names = []
+        for col in manifest['columns']:
+            if columns is not None and col['name'] not in columns:
+                continue
+            values = np.load(os.path.join(self.directory, col['file']), mmap_mode=mmap_mode)
+            if col['categories'] is not None:
+                categories = np.load(os.path.join(self.directory, col['categories']))
+                values = pd.Categorical.from_codes(np.asarray(values), categories=categories.astype(object))
+                if not col['categorical']:
+                    values = np.asarray(values, dtype=object)
+            data[col['name']] = values
+            names.append(col['name'])
+        if columns is not None:
+            missing = [col for col in columns if col not in data]
+            if len(missing) > 0:
+                raise ValueError('Columns not in cache : {}'.format(missing))
+            names = [col for col in columns]
+        log.debug('Loaded {0} columns from cache : {1}'.format(len(names), self.directory))
+        return pd.DataFrame(data, columns=names, copy=copy)
+
+    def save(self, df, sort_by=None, **kwargs):
+        """
+        Save a dataframe in cache, manifest is written last so that an interrupted save give an invalid cache
+        :param df: pandas dataframe parsed from source file
+        :param sort_by: write rows sorted by this column (stable, cells keep their order inside a well)
+        :param kwargs: pandas arguments used for reading source file
+        """
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        self.__manifest = None
+        if sort_by is not None:
+            wellidx = WellIndex(df[sort_by])
+            if not wellidx.is_sorted():
+                df = df.take(wellidx.order)
+        columns = []
+        for i, name in enumerate(df.columns):
+            values = df[name]
+            col = {'name': name, 'file': '{}.npy'.format(i), 'categories': None, 'categorical': False}
+            if values.dtype.name == 'category' or values.dtype == object:
+                # # strings are stored as codes and categories, no pickle in npy files
+                col['categorical'] = values.dtype.name == 'category'
+                cat = pd.Categorical(values)
+                col['categories'] = '{}_categories.npy'.format(i)
+                np.save(os.path.join(self.directory, col['categories']), np.asarray(cat.categories, dtype=str))
+                values = cat.codes
+            np.save(os.path.join(self.directory, col['file']), np.ascontiguousarray(values))
+            columns.append(col)
+        manifest = {'version': CACHE_VERSION, 'key': self.get_key(), 'kwargs': self.__kwargs_key(kwargs),
+                    'sort_by': sort_by, 'nrows': len(df), 'columns': columns}
+        with open(os.path.join(self.directory, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        log.info('Cache written : {}'.format(self.directory))
+
+    def clear(self):
+        """
+        Remove cache
+        """
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        self.__manifest = None
+
+    def read_csv(self, mmap=True, copy=True, sort_by=None, **kwargs):
+        """
+        Read source file from cache if valid, else parse it with pandas and write cache, error on writing cache are
+        logged but not raised (read only directory ...)
+        :param mmap: memory map the column files instead of reading them (see load)
+        :param copy: if False, dataframe columns are the memory maps (see load)
+        :param sort_by: cache rows must be sorted by this column, cache is rewritten if not
+        :param kwargs: pandas read_csv arguments
+        :return: pandas dataframe
+        """
+        if 'index_col' in kwargs:
+            # # only columns are cached
+            return pd.read_csv(self.fpath, engine='c', **kwargs)
+        if self.is_valid(sort_by=sort_by, **kwargs):
+            log.info('Reading cache of FlatFile : %s' % self.fpath)
+            return self.load(mmap=mmap, copy=copy)
+        log.info('Reading FlatFile : %s' % self.fpath)
+        df = pd.read_csv(self.fpath, engine='c', **kwargs)
+        try:
+            self.save(df, sort_by=sort_by, **kwargs)
+        except (IOError, OSError) as e:
+            log.warning('Cache not written for {0} : {1}'.format(self.fpath, e))
+            return df
+        return self.load(mmap=mmap, copy=copy)
+
+    @staticmethod
+    def __kwargs_key(kwargs):
+        """
+        Comparable representation of pandas arguments
+        """
+        return json.loads(json.dumps(dict((str(k), repr(v)) for k, v in kwargs.items()), sort_keys=True))
@@ -4,8 +4,10 @@ Basic Class for manipulating data into dataframe
 """
 
 import numpy as np
+import pandas as pd
 import os
 import re
+import TransCellAssay as TCA
 import logging
 
 log = logging.getLogger(__name__)
@@ -42,14 +44,28 @@ class InputFile(object):
         Format data by removing some blank space and to have a good well if format
         """
         log.debug('Formatting Well')
-        # remove some blank space
-        self.dataframe.loc[:, self.WellKey] = self.dataframe.loc[:, self.WellKey].apply(
-            lambda x: re.sub('(\s)(?<!$)', '', x))
-        # pass to B01 to B1
-        self.dataframe.loc[:, self.WellKey] = self.dataframe.loc[:, self.WellKey].apply(
-            lambda x: re.sub('(0)(?<!$)', '', x))
+        if self.dataframe[self.WellKey].dtype.name == 'category':
+            # # format only categories and map them on cells
+            wells = self.dataframe[self.WellKey]
+            categories = pd.Series(wells.cat.categories)
+            formatted = categories.apply(lambda x: re.sub('(\s)(?<!$)', '', x)).apply(lambda x: re.sub('(0)(?<!$)', '', x))
+            self.dataframe[self.WellKey] = wells.map(dict(zip(categories, formatted))).astype('category')
+        else:
+            # remove some blank space
+            self.dataframe.loc[:, self.WellKey] = self.dataframe.loc[:, self.WellKey].apply(
+                lambda x: re.sub('(\s)(?<!$)', '', x))
+            # pass to B01 to B1
+            self.dataframe.loc[:, self.WellKey] = self.dataframe.loc[:, self.WellKey].apply(
+                lambda x: re.sub('(0)(?<!$)', '', x))
         self.rename_col(self.WellKey, 'Well')
 
+    def compact(self):
+        """
+        Reduce memory of data, float channels in float32 when they fit in float32 range and well as categorical
+        """
+        self.dataframe = TCA.compact_dataframe(self.dataframe, well_key=self.WellKey)
+        log.debug('Compact data : {0:.1f} MB'.format(self.dataframe.memory_usage(deep=True).sum() / 1024. ** 2))
+
     def get_col(self):
         """
         Get all Columns
@@ -5,6 +5,7 @@ Librarie for easy play with HTS txt data file
 
 import os
 from TransCellAssay.IO.File.InputFile import InputFile
+from TransCellAssay.IO.File.Cache import BinaryCache
 import pandas as pd
 import logging
 log = logging.getLogger(__name__)
@@ -25,17 +26,24 @@ class TXT(InputFile):
     def __init__(self):
         super(TXT, self).__init__()
 
-    def load(self, fpath, sep='\t', **kwargs):
+    def load(self, fpath, sep='\t', compact=False, cache=False, **kwargs):
         """
         Load csv file
         :param fpath:
+        :param compact: store data in float32 when possible and well as categorical
+        :param cache: keep parsed file in a binary sidecar cache and read it when up to date (see BinaryCache)
         """
         if os.path.isfile(fpath):
             try:
                 log.info('Reading %s File' % fpath)
-                self.dataframe = pd.read_table(fpath, engine='c', **kwargs)
+                if cache:
+                    self.dataframe = BinaryCache(fpath).read_csv(sep=sep, **kwargs)
+                else:
+                    self.dataframe = pd.read_table(fpath, engine='c', **kwargs)
                 log.info('Finish reading file')
                 self.__filepath = fpath
+                if compact:
+                    self.compact()
             except Exception as e:
                 log.error(e)
                 pass
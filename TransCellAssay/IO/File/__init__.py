@@ -1,5 +1,6 @@
 # coding=utf-8
 __author__ = 'Arnaud KOPP'
+from TransCellAssay.IO.File.Cache import BinaryCache
 from TransCellAssay.IO.File.CSV import CSV
 from TransCellAssay.IO.File.Excel import EXCEL
 from TransCellAssay.IO.File.TXT import TXT
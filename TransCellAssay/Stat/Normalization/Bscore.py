@@ -17,7 +17,7 @@ trimmed mean : cut the outside limit default = 0.0 so its equivalent to the 'sta
 import numpy as np
 import logging
 from TransCellAssay.Utils.Stat import mad
-from TransCellAssay.Stat.Normalization.MedianPolish import median_polish
+from TransCellAssay.Stat.Normalization.MedianPolish import median_polish, median_polish_stack
 log = logging.getLogger(__name__)
 
 
@@ -101,3 +101,20 @@ def bzscore(array, max_iterations=100, eps=0.01, verbose=False):
         print("")
 
     return grand_effect, col_effects, row_effects, tbl, tbl_org
+
+
+def bscore_stack(array, max_iterations=10, eps=0.01):
+    """
+    Bscore of a stack of plates in one vectorized pass, last two axes are plate rows and cols (for example a
+    (plate, replica, row, col) array), see bscore
+    :param array: numpy array (..., row, col)
+    :param max_iterations: max iterations in process
+    :param eps: epsilon
+    :return: Bscore array with same shape
+    """
+    grand_effect, col_effects, row_effects, tbl = median_polish_stack(array, max_iterations=max_iterations, eps=eps)
+    # # MAD of residuals of each plate
+    flat = tbl.reshape(tbl.shape[:-2] + (-1,))
+    med = np.nanmedian(flat, axis=-1)
+    MAD = 1.4826 * np.nanmedian(np.absolute(flat - med[..., np.newaxis]), axis=-1)
+    return tbl / MAD[..., np.newaxis, np.newaxis]
@@ -6,7 +6,6 @@ Filtering data with given condition
 import numpy as np
 import TransCellAssay as TCA
 import logging
-import copy
 
 log = logging.getLogger(__name__)
 
@@ -20,14 +19,15 @@ __email__ = "kopp.arnaud@gmail.com"
 
 def channel_filtering(plate, channel, value, exclude="lower", include=True, percent=False):
     """
-    Make filtering of raw_data by condition
+    Make filtering of raw_data by condition, filtered plate share raw data with plate until one of them is modified
+    (see Plate.view), cells are selected with a mask (see Replica.add_filter)
     :param plate: Plate object
     :param channel: on which channel to apply filtering
     :param value: dict with key are rep name and items the cut_value for each replica
     :param exclude: exclude lower or upper value
     :param include: include or not limit value
     :param percent: Percent or value
-    :return: filtered raw data
+    :return: filtered plate
     """
     assert isinstance(plate, TCA.Plate)
     assert isinstance(value, dict)
@@ -36,47 +36,43 @@ def channel_filtering(plate, channel, value, exclude="lower", include=True, perc
     assert exclude in __valid_exclude, "type must be {}".format(__valid_exclude)
 
     log.info('Apply filtering on :{}'.format(plate.name))
-    plate.clear_cache()
-    PlateCopy = copy.deepcopy(plate)
+    PlateCopy = plate.view()
     for key, values in PlateCopy:
-        PlateCopy[key] = __replica_filtering(values, channel, exclude, value[key], include, percent)
-
-    if plate.platemap.get_file_location() == 'Not available':
-        PlateCopy.platemap = plate.platemap
+        log.debug('Apply filtering on :{}'.format(values.name))
+        cut_value = value[key]
+        if percent:
+            # # percentile of data already filtered, not of shared raw data
+            values.load_channels(channel)
+            cut_value = np.percentile(values.df[channel], cut_value)
+        values.add_filter(__get_filter_name(values), channel, cut_value, exclude=exclude, include=include)
 
     return PlateCopy
 
 
-def __replica_filtering(replica, channel, exclude, cut_value, include=True, percent=False):
-    log.debug('Apply filtering on :{}'.format(replica.name))
-    replica.df = __filtering_raw_data(replica.df, channel, exclude, cut_value, include, percent)
-    replica._new_caching()
-    return replica
-
-
-def __filtering_raw_data(raw_data, channel, exclude, value, include=True, percent=False):
+def filter_mask(values, value, exclude="lower", include=True, percent=False):
+    """
+    Get cells kept by a filtering condition
+    :param values: numpy array of channel values
+    :param value: cut value
+    :param exclude: exclude lower or upper value
+    :param include: include or not limit value
+    :param percent: cut value is a percentile of values
+    :return: numpy array of bool
+    """
     if percent:
-        value = np.percentile(raw_data[channel], value)
-    if exclude == "upper":
-        filtered = __upper_filter_raw_data(raw_data, channel, value, include)
-    if exclude == "lower":
-        filtered = __lower_filter_raw_data(raw_data, channel, value, include)
-    return filtered
-
-
-def __upper_filter_raw_data(raw_data, channel, threshold, include):
-    log.debug('Upper cut')
-    if include:
-        cutted = raw_data[raw_data[channel] <= threshold]
-    else:
-        cutted = raw_data[raw_data[channel] < threshold]
-    return cutted
+        value = np.percentile(values, value)
+    with np.errstate(invalid='ignore'):
+        if exclude == "upper":
+            return values <= value if include else values < value
+        return values >= value if include else values > value
 
 
-def __lower_filter_raw_data(raw_data, channel, threshold, include):
-    log.debug('Lower cut')
-    if include:
-        cutted = raw_data[raw_data[channel] >= threshold]
-    else:
-        cutted = raw_data[raw_data[channel] > threshold]
-    return cutted
+def __get_filter_name(replica):
+    """
+    Name for a new filter of replica
+    """
+    filters = replica.get_filters()
+    i = len(filters)
+    while 'filter{}'.format(i) in filters:
+        i += 1
+    return 'filter{}'.format(i)
@@ -82,3 +82,47 @@ def median_polish(array, max_iterations=10, eps=0.01, verbose=False):
         print("")
 
     return t, c, r, z, tbl_org
+
+
+def median_polish_stack(array, max_iterations=10, eps=0.01):
+    """
+    Median polish of a stack of plates in one vectorized pass, last two axes are plate rows and cols (for example a
+    (plate, replica, row, col) array). Each plate stop at the same iteration as median_polish on it alone
+    :param array: numpy array (..., row, col)
+    :param max_iterations: max iterations in process
+    :param eps: epsilon
+    :return: grand effect (...), col effects (..., col), row effects (..., row) and residuals (..., row, col)
+    """
+    assert isinstance(array, np.ndarray)
+
+    z = np.array(array, dtype=np.float64)
+    t = np.zeros(z.shape[:-2])
+    r = np.zeros(z.shape[:-1])
+    c = np.zeros(z.shape[:-2] + z.shape[-1:])
+    oldsum = np.zeros(z.shape[:-2])
+    # # plates not yet converged
+    active = np.ones(z.shape[:-2], dtype=bool)
+
+    for i in range(max_iterations):
+        log.debug('Median Polish stack : iteration {0}, {1} plates to polish'.format(i, np.sum(active)))
+        a = active[..., np.newaxis]
+        rdelta = np.where(a, np.median(z, axis=-1), 0)
+        z -= rdelta[..., np.newaxis]
+        r += rdelta
+        delta = np.where(active, np.median(r, axis=-1), 0)
+        c += delta[..., np.newaxis]
+        r -= delta[..., np.newaxis]
+        cdelta = np.where(a, np.median(z, axis=-2), 0)
+        z -= cdelta[..., np.newaxis, :]
+        c += cdelta
+        delta = np.where(active, np.median(c, axis=-1), 0)
+        r -= delta[..., np.newaxis]
+        t += delta
+
+        newsum = np.sum(z.reshape(z.shape[:-2] + (-1,)), axis=-1)
+        active &= ~((newsum == 0) | (np.abs(newsum - oldsum) < eps * newsum))
+        if not np.any(active):
+            break
+        oldsum = newsum
+
+    return t, c, r, z
@@ -12,7 +12,6 @@ http://en.wikipedia.org/wiki/Feature_scaling
 import numpy as np
 import pandas as pd
 import TransCellAssay as TCA
-from TransCellAssay.Utils.Stat import mad
 import logging
 log = logging.getLogger(__name__)
 
@@ -41,6 +40,7 @@ def plate_feature_scaling(plate, channel, mean_scaling=False):
 
         # search min and max across all replica
         for key, value in plate:
+            value.load_channels(channel)
             min_lst.append(np.min(value.df[channel].values))
             max_lst.append(np.max(value.df[channel].values))
 
@@ -65,9 +65,11 @@ def __df_scaling(replica, min_val, max_val, channel, mean=False):
     :return: normalized raw data
     """
     assert isinstance(replica, TCA.Replica)
+    replica._prepare_write()
     replica.df.loc[:, channel] = (replica.df.loc[:, channel] - min(min_val)) / (max(max_val) - min(min_val))
     if mean:
         replica.df.loc[:, channel] *= (sum(max_val) / len(max_val))
+    replica._data_changed()
     return replica
 
 
@@ -75,8 +77,10 @@ def rawdata_variability_normalization(obj, channel, method=None, log2_transf=Tru
                                       threshold=None):
     """
     Take a dataframe from replica object and apply desired strategy of variability normalization
+    Multiple channels are normalized at once on a 2d block of values, giving same result as normalizing them one after
+    the other
     :param obj: Plate or replica object
-    :param channel: on which channel to normalize
+    :param channel: on which channel (or list of channels) to normalize
     :param method: which method to apply
     :param log2_transf: apply log2 transformation
     :param neg_control: list of well for negative control A1 A2 ...
@@ -91,17 +95,15 @@ def rawdata_variability_normalization(obj, channel, method=None, log2_transf=Tru
         if method not in __valid_method:
             raise ValueError("Method don't exist, choose : {}".format(__valid_method))
 
-        # check if channel is list
-        if isinstance(channel, list):
-            raise NotImplementedError("Multiple channels normalization don't implemented, use class functions")
+        channels = channel if isinstance(channel, list) else [channel]
 
         if isinstance(obj, TCA.Plate):
             for key, value in obj:
-                value = __rd_norm(value, channel, method, log2_transf, neg_control, pos_control,
+                value = __rd_norm(value, channels, method, log2_transf, neg_control, pos_control,
                                              threshold)
             log.info('Plate {} : RawData normalization on channel {}'.format(obj.name, channel))
         elif isinstance(obj, TCA.Replica):
-            obj = __rd_norm(obj, channel, method, log2_transf, neg_control, pos_control,
+            obj = __rd_norm(obj, channels, method, log2_transf, neg_control, pos_control,
                                        threshold)
             log.info('Replica {} : RawData normalization on channel {}'.format(obj.name, channel))
         else:
@@ -110,103 +112,128 @@ def rawdata_variability_normalization(obj, channel, method=None, log2_transf=Tru
         print(e)
 
 
-def __rd_norm(replica, channel, method=None, log2_transf=True, neg_control=None, pos_control=None, threshold=None):
+def __rd_norm(replica, channels, method=None, log2_transf=True, neg_control=None, pos_control=None, threshold=None):
     """
-    Function that picked up functions for normalize replica raw data
+    Function that picked up functions for normalize replica raw data, all channels are transformed in one 2d array
+    (cells, channels) and written back at once
     """
     assert isinstance(replica, TCA.Replica)
-    if log2_transf:
-        replica = __log2_transformation(replica, channel)
-    if method == 'Zscore':
-        replica = __zscore_(replica, channel)
-    if method == 'RobustZscore':
-        replica = __robustzscore(replica, channel)
-    if method == 'PercentOfSample':
-        replica = __percentofsample(replica, channel)
-    if method == 'RobustPercentOfSample':
-        replica = __robustpercentofsample(replica, channel)
-    if method == 'PercentOfControl':
-        replica = __percentofcontrol(replica, channel, neg_control, pos_control)
-    if method == 'RobustPercentOfControl':
-        replica = __robustpercentofcontrol(replica, channel, neg_control, pos_control)
-    if method == 'NormalizedPercentInhibition':
-        replica = __normalizedpercentinhibition(replica, channel, neg_control, pos_control)
+    replica.load_channels(channels)
+    replica._prepare_write()
+    if log2_transf or method != 'BackgroundSubstraction':
+        values = replica.df[channels].values
+        invalid = None
+        if log2_transf:
+            # # log is computed in data type (float32 in compact mode), like on each column
+            values, invalid = __log2_transformation(values)
+        values = np.array(values, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if method == 'Zscore':
+                values = __zscore_(values)
+            if method == 'RobustZscore':
+                values = __robustzscore(values)
+            if method == 'PercentOfSample':
+                values = __percentofsample(values)
+            if method == 'RobustPercentOfSample':
+                values = __robustpercentofsample(values)
+            if method == 'PercentOfControl':
+                values = __percentofcontrol(replica, values, neg_control, pos_control)
+            if method == 'RobustPercentOfControl':
+                values = __robustpercentofcontrol(replica, values, neg_control, pos_control)
+            if method == 'NormalizedPercentInhibition':
+                values = __normalizedpercentinhibition(replica, values, neg_control, pos_control)
+        for i, channel in enumerate(channels):
+            # # columns are replaced, float32 columns (compact mode) stay float32
+            dtype = replica.df[channel].dtype
+            replica.df[channel] = values[:, i].astype(dtype) if np.issubdtype(dtype, np.floating) else values[:, i]
+        if invalid is not None and np.any(invalid):
+            # # cells with a non positive value in one channel are removed (NaN) from all columns
+            replica.df.loc[invalid, :] = np.nan
+        replica._data_changed()
     if method == 'BackgroundSubstraction':
-        replica = __backgroundsubstraction(replica, channel, threshold)
-        # Set to zero value below zero
-        replica.df.loc[replica[channel] < 0, channel] = 0
+        replica = __backgroundsubstraction(replica, channels, threshold)
+        for channel in channels:
+            # Set to zero value below zero
+            replica.df.loc[replica.df[channel] < 0, channel] = 0
+        replica._data_changed()
     return replica
 
 
-def __log2_transformation(replica, channel):
+def __log2_transformation(values):
     """
-    Apply log2 transformation on replica
-    :param replica: replica object
-    :param channel: channel to apply
-    :return: transformed replica rawdata
+    Apply log2 transformation on a block of channels, like channel after channel : a cell with a non positive value in
+    a channel is NaN in this channel and all following ones
+    :param values: numpy array (cells, channels)
+    :return: transformed values and mask of cells to remove
     """
     log.debug('Perform Log2 transformation')
-    replica.df.loc[:] = replica.df[replica.df[channel] > 0]
-    replica.df.loc[:, channel] = np.log2(replica.df[channel])
-    return replica
+    with np.errstate(invalid='ignore'):
+        valid = np.logical_and.accumulate(values > 0, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = np.where(valid, np.log2(values), np.nan)
+    return values, ~valid[:, -1]
 
 
-def __zscore_(replica, channel):
+def __get_control_data(replica, values, control):
     """
-    Apply Zscore normalization on replica
+    Values of control cells, positions of control cells are kept by replica (see Replica.get_control_index)
     :param replica: replica object
-    :param channel: channel to apply
-    :return: transformed replica rawdata
+    :param values: numpy array (cells, channels)
+    :param control: well or list of wells
+    :return: numpy array (cells, channels)
+    """
+    return values.take(replica.get_control_index(control), axis=0)
+
+
+def __zscore_(values):
+    """
+    Apply Zscore normalization on channels
+    :param values: numpy array (cells, channels)
+    :return: normalized values
     """
     log.debug('Perform Zscore')
-    replica.df.loc[:, channel] = (replica.df.loc[:, channel] - np.mean(replica.df[channel])) / np.std(replica.df[channel])
-    return replica
+    return (values - np.nanmean(values, axis=0)) / np.nanstd(values, axis=0)
 
 
-def __robustzscore(replica, channel):
+def __robustzscore(values):
     """
-    Apply robust Zscore normalization on replica
-    :param replica: replica object
-    :param channel: channel to apply
-    :return: transformed replica rawdata
+    Apply robust Zscore normalization on channels
+    :param values: numpy array (cells, channels)
+    :return: normalized values
     """
     log.debug('Perform robustZscore')
-    replica.df.loc[:, channel] = (replica.df.loc[:, channel] - np.median(replica.df[channel])) / mad(replica.df[channel])
-    return replica
+    med = np.nanmedian(values, axis=0)
+    return (values - med) / (1.4826 * np.nanmedian(np.absolute(values - med), axis=0))
 
 
-def __percentofsample(replica, channel):
+def __percentofsample(values):
     """
-    Apply percent of sample normalization on replica
-    :param replica: replica object
-    :param channel: channel to apply
-    :return: transformed replica rawdata
+    Apply percent of sample normalization on channels
+    :param values: numpy array (cells, channels)
+    :return: normalized values
     """
     log.debug('Perform PercentofSample')
-    replica.df.loc[:, channel] = (replica.df.loc[:, channel] / np.mean(replica.df[channel])) * 100
-    return replica
+    return (values / np.nanmean(values, axis=0)) * 100
 
 
-def __robustpercentofsample(replica, channel):
+def __robustpercentofsample(values):
     """
-    Apply robust percent of sample normalization on replica
-    :param replica: replica object
-    :param channel: channel to apply
-    :return: transformed replica rawdata
+    Apply robust percent of sample normalization on channels
+    :param values: numpy array (cells, channels)
+    :return: normalized values
     """
     log.debug('Perform robustPercentofSample')
-    replica.df.loc[:, channel] = (replica.df.loc[:, channel] / np.median(replica.df[channel])) * 100
-    return replica
+    return (values / np.nanmedian(values, axis=0)) * 100
 
 
-def __percentofcontrol(replica, channel, neg=None, pos=None):
+def __percentofcontrol(replica, values, neg=None, pos=None):
     """
-    Apply a percent of control (ration) normalization on replica
+    Apply a percent of control (ration) normalization on channels
     :param replica: replica object
-    :param channel: on which channel to work
+    :param values: numpy array (cells, channels)
     :param neg: neg reference
     :param pos: pos reference if neg is not provided
-    :return: return raw data
+    :return: normalized values
     """
     log.debug('Perform PercentofControl')
     if neg is None:
@@ -214,23 +241,22 @@ def __percentofcontrol(replica, channel, neg=None, pos=None):
             raise AttributeError("Need Negative or Positive control")
         else:
             # Using positive control
-            ctrl = replica.get_rawdata(channel=channel, well=pos)
+            ctrl = __get_control_data(replica, values, pos)
     else:
         # Using negative control
-        ctrl = replica.get_rawdata(channel=channel, well=neg)
+        ctrl = __get_control_data(replica, values, neg)
 
-    replica.df.loc[:, channel] = (replica.df.loc[:, channel] / np.mean(ctrl)) * 100
-    return replica
+    return (values / np.nanmean(ctrl, axis=0)) * 100
 
 
-def __robustpercentofcontrol(replica, channel, neg=None, pos=None):
+def __robustpercentofcontrol(replica, values, neg=None, pos=None):
     """
-    Apply a percent of control (ration) normalization on replica
+    Apply a percent of control (ration) normalization on channels
     :param replica: replica object
-    :param channel: on which channel to work
+    :param values: numpy array (cells, channels)
     :param neg: neg reference
     :param pos: pos reference if neg is not provided
-    :return: return raw data
+    :return: normalized values
     """
     log.debug('Perform PercentofControl')
     if neg is None:
@@ -238,48 +264,54 @@ def __robustpercentofcontrol(replica, channel, neg=None, pos=None):
             raise AttributeError("Need Negative or Positive control")
         else:
             # Using positive control
-            ctrl = replica.get_rawdata(channel=channel, well=pos)
+            ctrl = __get_control_data(replica, values, pos)
     else:
         # Using negative control
-        ctrl = replica.get_rawdata(channel=channel, well=neg)
+        ctrl = __get_control_data(replica, values, neg)
 
-    replica.df.loc[:, channel] = (replica.df.loc[:, channel] / np.median(ctrl)) * 100
-    return replica
+    return (values / np.nanmedian(ctrl, axis=0)) * 100
 
 
-def __normalizedpercentinhibition(replica, channel, neg=None, pos=None):
+def __normalizedpercentinhibition(replica, values, neg=None, pos=None):
     """
-    Apply a normalized percent inhibition normalization on replica
+    Apply a normalized percent inhibition normalization on channels
     :param replica: replica object
-    :param channel: on which channel to work
+    :param values: numpy array (cells, channels)
     :param neg: neg reference
     :param pos: pos reference
-    :return: return normalized raw data
+    :return: normalized values
     """
     log.debug('Perform NormalizedPercentInhibition')
     if neg is None:
         if pos is None:
             raise AttributeError("Need Negative and Positive control")
         raise AttributeError("Need Negative Control")
-    neg_data = replica.get_rawdata(channel=channel, well=pos)
-    pos_data = replica.get_rawdata(channel=channel, well=neg)
-    replica.df.loc[:, channel] = ((np.mean(pos_data) - replica.df[channel]) / (np.mean(pos_data) - np.mean(neg_data))) * 100
-    return replica
+    neg_data = __get_control_data(replica, values, pos)
+    pos_data = __get_control_data(replica, values, neg)
+    pos_mean = np.nanmean(pos_data, axis=0)
+    return ((pos_mean - values) / (pos_mean - np.nanmean(neg_data, axis=0))) * 100
 
 
-def __backgroundsubstraction(replica, channel, threshold):
+def __backgroundsubstraction(replica, channels, threshold):
     """
-    Apply a background substraction by removing median of well on each wells
+    Apply a background substraction by removing median (or percentile) of well on each wells, background of all wells
+    is computed at once from values sorted inside wells (see WellIndex), cells without well are left unchanged
     :param replica: replica object
-    :param channel: which channel to apply
+    :param channels: which channels to apply
+    :param threshold: percentile used as background, median if None
     :return: return normalized raw data
     """
-    for well in replica.get_unique_well():
-        well_data = replica.get_rawdata(channel=channel, well=well)
-        if threshold is not None:
-            background = np.percentile(well_data, threshold)
-        else:
-            background = np.median(well_data)
-        log.debug('{0}  Median substracted : {1}'.format(well, background))
-        replica.df.loc[replica.df[replica.WellKey] == str(well), channel] = well_data - background
+    wellidx, cells = replica.get_well_layout()
+    counts = wellidx.get_counts()
+    for channel in channels:
+        values = replica.df[channel].values
+        well_data = values[cells]
+        background = wellidx.percentile(well_data, threshold)
+        if np.issubdtype(values.dtype, np.floating):
+            # # substraction is done in data type, like with a numpy scalar
+            background = background.astype(values.dtype)
+        log.debug('{0} : background substracted on {1} wells'.format(channel, len(wellidx)))
+        result = values.astype(np.result_type(values.dtype, background.dtype))
+        result[cells] = well_data - np.repeat(background, counts)
+        replica.df[channel] = result
     return replica
@@ -1,11 +1,11 @@
 # coding=utf-8
 __author__ = 'Arnaud KOPP'
-from TransCellAssay.Stat.Normalization.Bscore import bscore, bzscore
+from TransCellAssay.Stat.Normalization.Bscore import bscore, bzscore, bscore_stack
 from TransCellAssay.Stat.Normalization.MatrixErrorAmendment import matrix_error_amendmend
 from TransCellAssay.Stat.Normalization.PartialMedianPolish import partial_mean_polish
 from TransCellAssay.Stat.Normalization.DiffusionModel import diffusion_model
 from TransCellAssay.Stat.Normalization.SystematicErrorDetectionTest import systematic_error_detection_test
 from TransCellAssay.Stat.Normalization.Rawdata_norm import rawdata_variability_normalization, plate_feature_scaling
-from TransCellAssay.Stat.Normalization.Filtering import channel_filtering
+from TransCellAssay.Stat.Normalization.Filtering import channel_filtering, filter_mask
 from TransCellAssay.Stat.Normalization.Polyfit import polynomial_fitting, lowess_fitting
-from TransCellAssay.Stat.Normalization.MedianPolish import median_polish
+from TransCellAssay.Stat.Normalization.MedianPolish import median_polish, median_polish_stack
@@ -61,6 +61,7 @@ SSMD,CVD and Z-factor are in robust version
 
 import numpy as np
 import pandas as pd
+import collections
 import TransCellAssay as TCA
 import logging
 
@@ -130,35 +131,45 @@ def plate_quality_control(plate, channel, cneg, cpos, sec_data=False):
 
         # # get Data
         if sec_data and replica.isNormalized:
-            negdata = __get_data_control_array(replica.array_c, c_ref=valid_neg_well)
-            posdata = __get_data_control_array(replica.array_c, c_ref=valid_pos_well)
+            array = replica.array_c
         else:
-            negdata = __get_data_control_array(replica.array, c_ref=valid_neg_well)
-            posdata = __get_data_control_array(replica.array, c_ref=valid_pos_well)
-
-        qc_rep_data = pd.DataFrame(
-            np.zeros(1, dtype=[('Replicat ID', str), ('Neg Mean', float), ('Neg SD', float), ('Pos Mean', float),
-                               ('Pos SD', float), ('Plate Mean', float), ('Plate SD', float)]))
-
-        qc_rep_data['Replicat ID'] = "{0}--{1}".format(plate.name, replica.name)
-        qc_rep_data['Neg Mean'] = np.mean(negdata)
-        qc_rep_data['Neg SD'] = np.std(negdata)
-        qc_rep_data['Pos Mean'] = np.mean(posdata)
-        qc_rep_data['Pos SD'] = np.std(posdata)
-        if sec_data and replica.isNormalized:
-            qc_rep_data['Plate Mean'] = np.mean(replica.array_c.flatten())
-            qc_rep_data['Plate SD'] = np.std(replica.array_c.flatten())
-        else:
-            qc_rep_data['Plate Mean'] = np.mean(replica.array.flatten())
-            qc_rep_data['Plate SD'] = np.std(replica.array.flatten())
+            array = replica.array
+
+        qc_rep_data = pd.DataFrame(array_quality_control(array, valid_neg_well, valid_pos_well), index=[0])
+        qc_rep_data.insert(0, 'Replicat ID', "{0}--{1}".format(plate.name, replica.name))
         X = X.append(qc_rep_data)
 
+    X = quality_control_metrics(X)
+
+    return X
+
+
+def array_quality_control(array, neg_well, pos_well):
+    """
+    Compute mean and standard deviation of controls and plate from a well data array
+    :param array: numpy array of well data
+    :param neg_well: negative control wells, in (row, col) or A1 format
+    :param pos_well: positive control wells, in (row, col) or A1 format
+    :return: OrderedDict with Neg Mean, Neg SD, Pos Mean, Pos SD, Plate Mean and Plate SD
+    """
+    negdata = __get_data_control_array(array, c_ref=neg_well)
+    posdata = __get_data_control_array(array, c_ref=pos_well)
+    return collections.OrderedDict([('Neg Mean', np.mean(negdata)), ('Neg SD', np.std(negdata)),
+                                    ('Pos Mean', np.mean(posdata)), ('Pos SD', np.std(posdata)),
+                                    ('Plate Mean', np.mean(array.flatten())), ('Plate SD', np.std(array.flatten()))])
+
+
+def quality_control_metrics(X):
+    """
+    Add AVR, ZFactor*, ZFactor, SSMD and CVD columns to a dataframe with Neg, Pos and Plate Mean and SD columns
+    :param X: dataframe, one line for each replica
+    :return: dataframe with quality control metrics
+    """
     X.loc[:, "AVR"] = (3 * X["Pos SD"] + 3 * X["Neg SD"]) / np.abs(X["Pos Mean"] - X["Neg Mean"])
     X.loc[:, "ZFactor*"] = 1 - (3 * X["Pos SD"] + 3 * X["Neg SD"]) / np.abs(X["Pos Mean"] - X["Neg Mean"])
     X.loc[:, "ZFactor"] = 1 - (3 * X["Pos SD"] + 3 * X["Plate SD"]) / np.abs(X["Pos Mean"] - X["Neg Mean"])
     X.loc[:, "SSMD"] = (X["Pos Mean"] - X["Neg Mean"]) / np.sqrt(np.abs(X["Pos SD"] ** 2 - X["Neg SD"] ** 2))
     X.loc[:, "CVD"] = np.sqrt(np.abs(X["Pos SD"] ** 2 - X["Neg SD"] ** 2)) / (X["Pos Mean"] - X["Neg Mean"])
-
     return X
 
 
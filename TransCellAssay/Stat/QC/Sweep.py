@@ -0,0 +1,139 @@
+# coding=utf-8
+"""
+Compare normalization strategies on a plate : each combination of raw data normalization method and systematic error
+correction algorithm is evaluated with quality control metrics (Z'factor, SSMD, AVR, CVD ...), so that the best
+strategy can be chosen before processing the whole screen.
+
+Well data of each raw data normalization are computed once for all replica (on temporary layers, raw data are kept
+unchanged), then all systematic error corrections are run in parallel from these base arrays.
+"""
+
+import numpy as np
+import pandas as pd
+import TransCellAssay as TCA
+import concurrent.futures
+import functools
+import itertools
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+def plate_normalization_sweep(plate, channel, cneg, cpos, methods=(None, 'Zscore', 'RobustZscore'),
+                              sec_algorithms=(None, 'Bscore', 'MEA', 'PMP'), log_t=True, neg=None, pos=None,
+                              skipping_wells=False, threshold=None, executor='process', n_jobs=None, **kwargs):
+    """
+    Compute quality control of plate for each combination of raw data normalization and systematic error correction
+    :param plate: Plate object
+    :param channel: channel on which we performed quality control
+    :param cneg: negative control Name
+    :param cpos: positive control Name
+    :param methods: raw data normalization methods to compare (see rawdata_variability_normalization), None for raw
+    data
+    :param sec_algorithms: systematic error correction algorithms to compare, None for no correction
+    :param log_t: Performed log2 Transformation in raw data normalization
+    :param neg: negative control wells used in raw data normalization, default to wells of cneg
+    :param pos: positive control wells used in raw data normalization, default to wells of cpos
+    :param skipping_wells: skip defined wells, use it with poc and npi
+    :param threshold: used in background subtraction
+    :param executor: None, 'thread' or 'process' for running systematic error corrections
+    :param n_jobs: number of workers, default to number of cpu
+    :param kwargs: parameters of systematic error correction (see Plate.apply_systematic_error_correction)
+    :return: dataframe with qc, one line for each replica and combination
+    """
+    assert isinstance(plate, TCA.Core.Plate)
+    if executor not in (None, 'thread', 'process'):
+        raise ValueError("Executor must be None, 'thread' or 'process'")
+    if plate._is_cutted:
+        raise ValueError('Plate was cutted, quality control cannot be performed')
+    try:
+        neg_well = plate.platemap.search_coord(cneg)
+        pos_well = plate.platemap.search_coord(cpos)
+    except KeyError:
+        raise ValueError('Some Reference are non existing : {0} {1}'.format(cneg, cpos))
+    if neg is None:
+        neg = plate.platemap.search_well(cneg)
+    if pos is None:
+        pos = plate.platemap.search_well(cpos)
+
+    methods = list(methods)
+    sec_algorithms = list(sec_algorithms)
+    replica = list(plate.replica.values())
+    n_jobs = n_jobs if n_jobs is not None else (os.cpu_count() or 1)
+
+    log.info('Normalization sweep on {0} : {1} x {2}'.format(plate.name, methods, sec_algorithms))
+
+    # # base arrays, each replica compute all normalization methods in a thread
+    def __replica_arrays(rep):
+        return [__normalized_array(rep, channel, method, log_t=log_t, neg=neg, pos=pos,
+                                   skipping_wells=skipping_wells, threshold=threshold) for method in methods]
+
+    if executor is None or len(replica) < 2:
+        base = [__replica_arrays(rep) for rep in replica]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(replica), n_jobs)) as pool:
+            base = list(pool.map(__replica_arrays, replica))
+
+    # # systematic error corrections, only arrays are sent to workers
+    tasks = [(i, j, algo) for i, j, algo in itertools.product(range(len(replica)), range(len(methods)),
+                                                              sec_algorithms) if algo is not None]
+    corrected = {}
+    if len(tasks) > 0:
+        func = functools.partial(__correct, **kwargs)
+        args = [(algo, base[i][j].copy()) for i, j, algo in tasks]
+        if executor is None or len(tasks) < 2:
+            results = [func(arg) for arg in args]
+        else:
+            pool_class = (concurrent.futures.ProcessPoolExecutor if executor == 'process' else
+                          concurrent.futures.ThreadPoolExecutor)
+            with pool_class(max_workers=min(len(tasks), n_jobs)) as pool:
+                results = list(pool.map(func, args))
+        corrected = dict(zip(tasks, results))
+
+    lines = []
+    for j, algo, (i, rep) in itertools.product(range(len(methods)), sec_algorithms, enumerate(replica)):
+        array = base[i][j] if algo is None else np.nan_to_num(corrected[(i, j, algo)])
+        line = TCA.array_quality_control(array, neg_well, pos_well)
+        line['Normalization'] = methods[j] if methods[j] is not None else 'None'
+        line['SEC'] = algo if algo is not None else 'None'
+        line['Replicat ID'] = "{0}--{1}".format(plate.name, rep.name)
+        lines.append(line)
+
+    X = pd.DataFrame(lines, columns=['Normalization', 'SEC', 'Replicat ID', 'Neg Mean', 'Neg SD', 'Pos Mean',
+                                     'Pos SD', 'Plate Mean', 'Plate SD'])
+    return TCA.quality_control_metrics(X)
+
+
+def __normalized_array(replica, channel, method, log_t=True, neg=None, pos=None, skipping_wells=False,
+                       threshold=None):
+    """
+    Well data of replica for a raw data normalization method, computed on a temporary layer
+    """
+    if method is None:
+        return replica.get_data_channels([channel])[0]
+    name = '__sweep_{}'.format(method)
+    current = replica.get_layer_name()
+    replica.add_layer(name, [channel], method=method, log_t=log_t, neg=neg, pos=pos, skipping_wells=skipping_wells,
+                      threshold=threshold)
+    try:
+        replica.set_layer(name)
+        return replica.get_data_channels([channel])[0]
+    finally:
+        replica.set_layer(current)
+        replica.remove_layer(name)
+
+
+def __correct(args, **kwargs):
+    """
+    Apply a systematic error correction algorithm on array, module function so that it can be run in another process
+    """
+    algorithm, array = args
+    return TCA.Core.GenericPlate.correct_array(array, algorithm=algorithm, **kwargs)
@@ -1,3 +1,5 @@
 # coding=utf-8
 __author__ = 'Arnaud KOPP'
-from TransCellAssay.Stat.QC.QualityControl import plate_quality_control, plates_quality_control
+from TransCellAssay.Stat.QC.QualityControl import plate_quality_control, plates_quality_control, \
+    array_quality_control, quality_control_metrics
+from TransCellAssay.Stat.QC.Sweep import plate_normalization_sweep
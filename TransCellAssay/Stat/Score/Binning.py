@@ -8,6 +8,7 @@ import numpy as np
 import pandas  as pd
 import logging
 import collections
+import numbers
 
 log = logging.getLogger(__name__)
 
@@ -22,9 +23,10 @@ __email__ = "kopp.arnaud@gmail.com"
 def Binning(Plate, chan, bins=None, nbins=10, percent=True):
     """
     Make binning (intervals) for various channels, return a dict with key is replica name and value the df of binning
+    Intervals are right closed (a, b], cells outside of bins are not counted
     param Plate: Plate Object
     param chan: On which channel make the binning
-    param bins: default is None, but can provided custom intervals
+    param bins: default is None, but can provided custom intervals (see get_bin_edges for same bins on all plates)
     param nbins: by default, make 10 bins with min and max of channel as extreme
     return a dict with key is rep name and value a dataframe with binning data
     """
@@ -36,14 +38,259 @@ def Binning(Plate, chan, bins=None, nbins=10, percent=True):
         assert chan in value.get_channels_list(), "Given channel {0} -> not in available channels : {1}".format(chan,
                                                                                                                 value.get_channels_list())
         log.debug("Iterate on : {}".format(key))
+        value.load_channels(chan)
 
-        x = _dfbinning(value.df, on=chan, key="Well", bins=bins, nbins=nbins, percent=percent)
+        x = _dfbinning(value.df, on=chan, key=value.WellKey, bins=bins, nbins=nbins, percent=percent)
 
         frames[key] = x
 
     return frames
 
 
+def binning_counts(plate, channels, bins=None, nbins=10):
+    """
+    Count cells of each well in bins (intervals) for multiple channels, with same bins for all replica
+    Intervals are right closed (a, b], cells outside of bins are not counted
+    param plate: Plate Object
+    param channels: channel or list of channels
+    param bins: bins edges for all channels, or dict with channel as key and edges as value, if None edges are computed
+    from min and max of all replica (see get_bin_edges)
+    param nbins: number of edges when bins are computed
+    return a dict with key is rep name and value a numpy array of shape (channel, well, bin) with cells count, wells of
+    platemap in row major order (A1, A2 ...) and dict with channel as key and edges as value
+    """
+    assert isinstance(plate, TCA.Plate)
+    if not isinstance(channels, list):
+        channels = [channels]
+    edges = __get_edges(plate, channels, bins, nbins)
+    log.info("Binning process on : {0} for {1}".format(plate.name, channels))
+
+    wells = __get_platemap_wells(plate)
+    counts = collections.OrderedDict()
+    for key, value in plate:
+        counts[key], wells = __replica_bin_counts(value, channels, edges, wells)
+    return counts, list(wells), edges
+
+
+def joint_binning_counts(obj, pairs, bins=None, nbins=50, by_well=True):
+    """
+    Count cells in 2-D bins for pairs of channels (joint histogram), for each well or for the whole replica, bins index
+    of each channel are computed once and all pairs are counted by one bincount
+    Intervals are right closed (a, b], cells outside of bins are not counted
+    param obj: Plate or Replica Object
+    param pairs: pair of channels (x, y) or list of pairs
+    param bins: bins edges for all channels, or dict with channel as key and edges as value, if None edges are computed
+    from min and max of all replica (see get_bin_edges)
+    param nbins: number of edges when bins are computed
+    param by_well: count each well or all cells of replica
+    return numpy array of shape (pair, well, bin x, bin y) or (pair, bin x, bin y) if not by_well, a dict with key is
+    rep name and array as value for a plate, wells (platemap wells in row major order for a plate, wells of replica
+    for a replica, None if not by_well) and dict with channel as key and edges as value
+    """
+    assert isinstance(obj, (TCA.Plate, TCA.Replica))
+    if isinstance(pairs, tuple):
+        pairs = [pairs]
+    channels = []
+    for pair in pairs:
+        if len(pair) != 2:
+            raise ValueError('Pair of channels must be (x, y) : {}'.format(pair))
+        channels.extend(chan for chan in pair if chan not in channels)
+    edges = __get_edges(obj, channels, bins, nbins)
+    log.info("Joint binning process on : {0} for {1}".format(obj.name, pairs))
+
+    if isinstance(obj, TCA.Replica):
+        counts, wells = __replica_joint_counts(obj, pairs, edges, by_well=by_well)
+        return counts, (list(wells) if wells is not None else None), edges
+
+    wells = __get_platemap_wells(obj) if by_well else None
+    counts = collections.OrderedDict()
+    for key, value in obj:
+        counts[key], wells = __replica_joint_counts(value, pairs, edges, wells=wells, by_well=by_well)
+    return counts, (list(wells) if wells is not None else None), edges
+
+
+def joint_histogram(x, y, bins=50):
+    """
+    Count values in 2-D bins (joint histogram) of two arrays with one bincount, intervals are right closed (a, b]
+    param x: numpy array of value
+    param y: numpy array of value
+    param bins: number of edges (edges go from min - 1 to max like Binning), or (x edges, y edges)
+    return numpy array of shape (bin x, bin y), x edges and y edges
+    """
+    x = np.asarray(x, dtype=np.float64).flatten()
+    y = np.asarray(y, dtype=np.float64).flatten()
+    if len(x) != len(y):
+        raise ValueError('x and y must have same length')
+    if isinstance(bins, numbers.Integral):
+        x_edges = np.linspace(np.nanmin(x) - 1, np.nanmax(x), bins)
+        y_edges = np.linspace(np.nanmin(y) - 1, np.nanmax(y), bins)
+    else:
+        x_edges, y_edges = np.asarray(bins[0], dtype=np.float64), np.asarray(bins[1], dtype=np.float64)
+    nbx, nby = len(x_edges) - 1, len(y_edges) - 1
+    idx_x, idx_y = _bin_index(x_edges, x, 'x'), _bin_index(y_edges, y, 'y')
+    valid = (idx_x >= 0) & (idx_x < nbx) & (idx_y >= 0) & (idx_y < nby)
+    counts = np.bincount(idx_x[valid] * nby + idx_y[valid], minlength=nbx * nby)
+    return counts.reshape(nbx, nby), x_edges, y_edges
+
+
+def get_bin_edges(plates, channels, nbins=10):
+    """
+    Compute bins edges from min and max of channels over all replica of plates, min and max are reduced replica by
+    replica (summary of replica in summary mode), so that bins are the same for a whole screen
+    param plates: Replica, Plate, list of Plate or Screen
+    param channels: channel or list of channels
+    param nbins: number of edges, like Binning edges go from min - 1 to max
+    return a dict with channel as key and edges as value
+    """
+    if isinstance(plates, TCA.Replica):
+        plates = [[(plates.name, plates)]]
+    elif isinstance(plates, TCA.Plate):
+        plates = [plates]
+    elif isinstance(plates, TCA.Screen):
+        plates = plates.get_plates()
+    if not isinstance(channels, list):
+        channels = [channels]
+
+    edges = collections.OrderedDict()
+    for chan in channels:
+        vmin, vmax = np.inf, -np.inf
+        for plate in plates:
+            for key, replica in plate:
+                if replica._summary is not None:
+                    summary = replica.get_well_summary([chan])
+                    rmin, rmax = np.nanmin(summary.get_stat(chan, 'min')), np.nanmax(summary.get_stat(chan, 'max'))
+                else:
+                    replica.load_channels(chan)
+                    values = replica.df[chan].values
+                    rmin, rmax = np.nanmin(values), np.nanmax(values)
+                vmin, vmax = min(vmin, rmin), max(vmax, rmax)
+        if not np.isfinite(vmin) or not np.isfinite(vmax):
+            raise ValueError('No data for computing bins of {}'.format(chan))
+        edges[chan] = np.linspace(vmin - 1, vmax, nbins)
+    return edges
+
+
+def __replica_bin_counts(replica, channels, edges, wells=None):
+    """
+    Count cells of each well in bins, cells are mapped to a well code and a bin index and counted by one bincount
+    param replica: Replica Object
+    param channels: list of channels
+    param edges: dict with channel as key and bins edges as value
+    param wells: wells to count, None for all wells of replica in sorted order
+    return numpy array of shape (channel, well, bin) and wells
+    """
+    codes, wells = __get_well_codes(replica, channels, wells)
+
+    nbins = max(len(edges[chan]) - 1 for chan in channels)
+    counts = np.zeros((len(channels), len(wells), nbins), dtype=np.int64)
+    for i, chan in enumerate(channels):
+        nb = len(edges[chan]) - 1
+        counts[i, :, :nb] = _bincount(codes, _bin_index(edges[chan], replica.df[chan].values, chan), len(wells), nb)
+    return counts, wells
+
+
+def __replica_joint_counts(replica, pairs, edges, wells=None, by_well=True):
+    """
+    Count cells of each well in 2-D bins of pairs of channels, bins index are computed once by channel and cells of
+    all pairs are counted by one bincount on combined index (((pair * well) * bin x) * bin y)
+    param replica: Replica Object
+    param pairs: list of pairs of channels
+    param edges: dict with channel as key and bins edges as value
+    param wells: wells to count, None for all wells of replica in sorted order
+    param by_well: count each well or all cells of replica
+    return numpy array of shape (pair, well, bin x, bin y) or (pair, bin x, bin y) and wells
+    """
+    channels = []
+    for pair in pairs:
+        channels.extend(chan for chan in pair if chan not in channels)
+    if by_well:
+        codes, wells = __get_well_codes(replica, channels, wells)
+        nwells = len(wells)
+    else:
+        codes, wells = __get_well_codes(replica, channels, None)
+        codes, nwells, wells = np.where(codes >= 0, 0, -1), 1, None
+
+    index = {chan: _bin_index(edges[chan], replica.df[chan].values, chan) for chan in channels}
+    nbx = max(len(edges[x]) - 1 for x, y in pairs)
+    nby = max(len(edges[y]) - 1 for x, y in pairs)
+    combined = []
+    for i, (x, y) in enumerate(pairs):
+        idx_x, idx_y = index[x], index[y]
+        valid = ((idx_x >= 0) & (idx_x < len(edges[x]) - 1) & (idx_y >= 0) & (idx_y < len(edges[y]) - 1) &
+                 (codes >= 0))
+        combined.append(((i * nwells + codes[valid]) * nbx + idx_x[valid]) * nby + idx_y[valid])
+    flat = np.bincount(np.concatenate(combined), minlength=len(pairs) * nwells * nbx * nby)
+    counts = flat.reshape(len(pairs), nwells, nbx, nby)
+    return (counts if by_well else counts[:, 0]), wells
+
+
+def __get_edges(obj, channels, bins, nbins):
+    """
+    Bins edges of channels from custom bins or from min and max of channels (see get_bin_edges)
+    """
+    if bins is None:
+        return get_bin_edges(obj, channels, nbins=nbins)
+    elif isinstance(bins, dict):
+        return collections.OrderedDict((chan, np.asarray(bins[chan], dtype=np.float64)) for chan in channels)
+    return collections.OrderedDict((chan, np.asarray(bins, dtype=np.float64)) for chan in channels)
+
+
+def __get_platemap_wells(plate):
+    """
+    Wells of platemap in row major order (A1, A2 ...)
+    """
+    platemap = plate.platemap.platemap
+    return np.array([str(r) + str(c) for r in platemap.index for c in platemap.columns], dtype=object)
+
+
+def __get_well_codes(replica, channels, wells=None):
+    """
+    Load channels and map cells of replica to position of their well
+    param replica: Replica Object
+    param channels: list of channels
+    param wells: wells to count, None for all wells of replica in sorted order
+    return numpy array of well position for each cell (-1 if well is not in wells) and wells
+    """
+    if replica._summary is not None:
+        raise ValueError('Binning is not available in summary mode')
+    replica.load_channels(channels)
+    codes, uniques = pd.factorize(replica.df[replica.WellKey].values, sort=True)
+    codes = np.asarray(codes)
+    if wells is None:
+        return codes, np.asarray(uniques)
+    # # position of replica wells in given wells
+    position = pd.Index(np.asarray(wells).astype(str)).get_indexer(np.asarray(uniques).astype(str))
+    return np.where(codes >= 0, position[codes], -1), wells
+
+
+def _bin_index(bins, values, chan=None):
+    """
+    Index of bin of values for right closed bins (a, b] like pandas cut, NaN and values outside bins are out of range
+    (-1 or len(bins) - 1)
+    param bins: bins edges
+    param values: numpy array of value
+    param chan: channel name for error message
+    return numpy array of bin index
+    """
+    if np.any(np.diff(bins) <= 0):
+        raise ValueError('Bins must increase monotonically : {}'.format(chan))
+    return np.searchsorted(bins, values, side='left') - 1
+
+
+def _bincount(codes, idx, nwells, nbins):
+    """
+    Count cells by well and bin in one bincount on combined index (well * nbins + bin)
+    param codes: well position of cells, negative for cells not counted
+    param idx: bin index of cells (searchsorted - 1 on right closed bins), NaN and values outside bins are out of range
+    param nwells: number of wells
+    param nbins: number of bins
+    return numpy array of shape (well, bin)
+    """
+    valid = (idx >= 0) & (idx < nbins) & (codes >= 0)
+    flat = np.bincount(codes[valid] * nbins + idx[valid], minlength=nwells * nbins)
+    return flat.reshape(nwells, nbins)
+
+
 def _dfbinning(df, on, key, bins, nbins, percent):
     """
     Make the binning for a dataframe
@@ -56,12 +303,18 @@ def _dfbinning(df, on, key, bins, nbins, percent):
     """
 
     if bins is None:
-        bins = np.linspace(np.min(df.loc[:, on].values)-1, np.max(df.loc[:, on].values), nbins)
+        bins = np.linspace(np.nanmin(df.loc[:, on].values)-1, np.nanmax(df.loc[:, on].values), nbins)
+    bins = np.asarray(bins)
 
-    x = df.groupby(by=[key, pd.cut(df.loc[:, on], bins)]).count().loc[:, on]
-    x = x.unstack()
+    # # right closed intervals (a, b], labels formatted like pandas cut
+    idx = _bin_index(bins, df[on].values, on)
+    intervals = pd.cut(np.array([], dtype=np.float64), bins).categories
+    codes, wells = pd.factorize(df[key].values, sort=True)
+    counts = _bincount(np.asarray(codes), idx, len(wells), len(intervals))
+    x = pd.DataFrame(counts, index=pd.Index(wells, name=key),
+                     columns=pd.CategoricalIndex(intervals, categories=intervals, ordered=True, name=on))
 
     if percent:
-        x = x.iloc[:, :].apply(lambda a: a / x.sum(axis=1) * 100)
+        x = x.div(x.sum(axis=1), axis=0) * 100
 
     return x.fillna(0)
@@ -43,7 +43,8 @@ def getThreshold(plate, ctrl, channels, threshold, percent=True, fixed_threshold
     :param threshold: fixe the percent of positive well found in  control well
     :param percent: True if threshold value is percent, False if we want to give a value
     :param fixed_threshold: use given threshold (value mode) for all well
-    return a dict with value Chan -> repId -> value
+    return a dict with value Chan -> repId -> value, in summary mode percent thresholds are computed from quantile
+    sketches with rank error of replica (Replica sketch_eps)
     """
     assert isinstance(plate, TCA.Plate)
     ThresholdVALUE = {}
@@ -79,23 +80,129 @@ def getThreshold(plate, ctrl, channels, threshold, percent=True, fixed_threshold
                 fixed_threshold = True
 
             for repName, replica in plate:
-                datagb = replica.get_groupby_data()
-
                 if fixed_threshold:
                     ThresholdValue = THRES
                 else:
-                    ControlData = replica.get_rawdata(channel=chan, well=neg_well)
-                    if percent:
-                        ThresholdValue = np.percentile(ControlData, THRES)
-                    else:
-                        # Take mean of neg ctrl if fixed_threshold and percent are False
-                        ThresholdValue = np.mean(ControlData)
+                    # # threshold is kept by replica until raw data are modified
+                    ThresholdValue = replica._get_derived(('threshold', chan, tuple(neg_well), THRES, percent),
+                                                          lambda: __control_threshold(replica, chan, neg_well, THRES,
+                                                                                      percent))
 
                 ThresholdVALUE[chan][repName] = ThresholdValue
 
     return ThresholdVALUE
 
 
+def __control_threshold(replica, chan, ctrl_well, threshold, percent):
+    """
+    Compute threshold value from control well data of replica
+    """
+    if replica._summary is not None:
+        # # no single cell data, use per well statistics, percentile accuracy is the sketch_eps of replica
+        if percent and replica._summary.eps is None:
+            raise ValueError('Percent threshold in summary mode need quantile sketches, see Replica sketch_eps')
+        summary = replica.get_well_summary([chan], eps=replica._summary.eps if percent else None)
+        if percent:
+            return summary.get_sketch(chan, ctrl_well).percentile(threshold)
+        pos = [i for i, well in enumerate(summary.wells) if well in ctrl_well]
+        return np.sum(summary.get_stat(chan, 'sum')[pos]) / np.sum(summary.get_stat(chan, 'count')[pos])
+    if percent:
+        return replica.get_control_stat(chan, ctrl_well, threshold)
+    else:
+        # Take mean of neg ctrl if fixed_threshold and percent are False
+        return replica.get_control_stat(chan, ctrl_well, 'mean')
+
+
+def getThresholdSweep(plate, channel, thresholds=None, neg=None, percentiles=None, pos=None):
+    """
+    Compute percent of positive cells of each well for many thresholds at once, cells of each well are sorted once and
+    all thresholds are counted by binary search
+    :param plate: plate object
+    :param channel: channel
+    :param thresholds: list of threshold values, same for all replica
+    :param neg: negative control (name or list of wells), used with percentiles and for quality control
+    :param percentiles: list of percentiles of negative control cells, used as thresholds of each replica
+    :param pos: positive control (name or list of wells), if given quality control between negative and positive
+    control (ZFactor, SSMD ...) is computed for each threshold
+    :return: dict with replica name as key and numpy array of shape (threshold, row, col) as value, dict with
+    thresholds of each replica and if pos is given a dataframe with quality control for each replica and threshold
+    """
+    assert isinstance(plate, TCA.Plate)
+    if (thresholds is None) == (percentiles is None):
+        raise ValueError('Give thresholds or percentiles')
+
+    neg_well = __get_control_wells(plate, neg)
+    pos_well = __get_control_wells(plate, pos)
+    if percentiles is not None and neg_well is None:
+        raise ValueError('Negative control is needed for percentiles')
+    if pos_well is not None and neg_well is None:
+        raise ValueError('Negative control is needed for quality control')
+
+    log.info('Threshold sweep on {0} for {1}'.format(plate.name, channel))
+    shape = plate.platemap.shape()
+    SWEEP = collections.OrderedDict()
+    THRESHOLD = collections.OrderedDict()
+    QC = []
+    for replicaId, replica in plate:
+        if replica._summary is not None:
+            raise ValueError('Threshold sweep is not available in summary mode')
+        if percentiles is not None:
+            data = np.asarray(replica.get_control_data(channel, neg_well), dtype=np.float64)
+            rep_thresholds = np.nanpercentile(data, percentiles)
+        else:
+            rep_thresholds = np.asarray(thresholds, dtype=np.float64)
+
+        replica.load_channels(channel)
+        wellidx, cells = replica.get_well_layout()
+        svalues, n = wellidx.sort_values(replica.df[channel].values[cells])
+        counts = wellidx.get_counts()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percent = wellidx.count_greater(svalues, n, rep_thresholds) / counts * 100
+
+        rows, cols = TCA.get_wells_coord(wellidx.wells)
+        valid = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        sweep = np.full((len(rep_thresholds),) + tuple(shape), np.nan)
+        sweep[:, rows[valid], cols[valid]] = percent[:, valid]
+        SWEEP[replicaId] = sweep
+        THRESHOLD[replicaId] = rep_thresholds
+
+        if pos_well is not None:
+            QC.append(__sweep_quality_control(sweep, neg_well, pos_well, rep_thresholds,
+                                              "{0}--{1}".format(plate.name, replica.name)))
+
+    if pos_well is not None:
+        return SWEEP, THRESHOLD, TCA.quality_control_metrics(pd.concat(QC, ignore_index=True))
+    return SWEEP, THRESHOLD
+
+
+def __get_control_wells(plate, ctrl):
+    """
+    Wells of a control, ctrl is a control name or a list of wells
+    """
+    if ctrl is None:
+        return None
+    if isinstance(ctrl, list):
+        return ctrl
+    return plate.platemap.search_well(ctrl)
+
+
+def __sweep_quality_control(sweep, neg_well, pos_well, thresholds, name):
+    """
+    Mean and standard deviation of controls and plate for each threshold of a sweep
+    """
+    nrows, ncols = TCA.get_wells_coord(neg_well)
+    prows, pcols = TCA.get_wells_coord(pos_well)
+    negdata = sweep[:, nrows, ncols]
+    posdata = sweep[:, prows, pcols]
+    platedata = sweep.reshape(len(sweep), -1)
+    with np.errstate(invalid='ignore'):
+        return pd.DataFrame(collections.OrderedDict([
+            ('Replicat ID', name), ('Threshold', thresholds),
+            ('Neg Mean', np.nanmean(negdata, axis=1)), ('Neg SD', np.nanstd(negdata, axis=1)),
+            ('Pos Mean', np.nanmean(posdata, axis=1)), ('Pos SD', np.nanstd(posdata, axis=1)),
+            ('Plate Mean', np.nanmean(platedata, axis=1)), ('Plate SD', np.nanstd(platedata, axis=1))]))
+
+
 def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=True, fixed_threshold=False,
                           clean=False, noposcell=False, multiIndexDF=False):
     """
@@ -113,6 +220,10 @@ def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=
     """
     assert isinstance(plate, TCA.Plate)
 
+    for replicaId, replica in plate:
+        if replica._summary is not None:
+            raise ValueError('Plate channels analysis is not available in summary mode, use PlateWellSummary')
+
     if not len(plate) > 0:
         log.error('Empty Plate Object, add some replica to perform PlateAnalysis')
         return
@@ -136,7 +247,7 @@ def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=
     # CELLS COUNT
 
     for replicaId, replica in plate:
-        cellcount = replica.get_groupby_data()[__WellKey].count()
+        cellcount = replica.get_count().iloc[:, 0]
         cellcount.name = replicaId+" CellsCount"
         COUNT = pd.merge(COUNT, cellcount.reset_index(), how='left', on=__WellKey)
 
@@ -162,8 +273,9 @@ def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=
 
         if NREP > 1:
             negdata = COUNT[COUNT.loc[:, "PlateMap"] == neg].loc[:, "Tox mean"].values
-            COUNT.loc[:, "Tox pvalue"] = COUNT.iloc[:, -NREP-2: -2].apply((lambda x: stats.ttest_ind(x, negdata,
-                                                                                                     equal_var=False)[1]), axis=1)
+            # # welch test of all wells at once against negative control
+            COUNT.loc[:, "Tox pvalue"] = stats.ttest_ind(COUNT.iloc[:, -NREP-2: -2].values.astype(float),
+                                                         negdata[np.newaxis, :], axis=1, equal_var=False)[1]
             COUNT.loc[:, "Tox fdr"] = TCA.adjustpvalues(pvalues=COUNT.loc[:, "Tox pvalue"])
 
     # ANALYSING CHANNELS
@@ -182,8 +294,15 @@ def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=
                                           fixed_threshold=fixed_threshold)
             log.debug("Threshold used : {}".format(ThresholdVALUE))
 
+        # # all statistics of all channels, computed for each replica in a few passes over cells
+        STATS = collections.OrderedDict()
+        for replicaId, replica in plate:
+            thresholds = None if noposcell else [ThresholdVALUE[chan][replicaId] for chan in channels]
+            STATS[replicaId] = __replica_channels_stats(replica, channels, __array_pattern[__WellKey].values,
+                                                        thresholds)
+
         # iterate over channels
-        for chan in channels:
+        for i, chan in enumerate(channels):
             MEAN = __array_pattern.copy()
             MEDIAN = __array_pattern.copy()
             STD = __array_pattern.copy()
@@ -191,54 +310,13 @@ def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=
             if noposcell is False:
                 PERCENT = __array_pattern.copy()
 
-            for replicaId, replica in plate:
-                datagb = replica.get_groupby_data()
-                if noposcell is False:
-                    # POSITIVE CELLS %
-                    # threshold value for control
-                    ThresholdValue = ThresholdVALUE[chan][replicaId]
-
-                # VARIABILITY & % OF POSITIVE CELLS
-                # iterate on well
-                if noposcell is False:
-                    PercentCells = {}
-                MeanCells = {}
-                MedianCells = {}
-                SdCells = {}
-                MadCells = {}
-
-                for well in replica.get_unique_well():
-                    xdata = datagb.get_group(well)[chan]
-                    if noposcell is False:
-                        len_total = len(xdata.values)
-                        len_thres = len(np.extract(xdata.values > ThresholdValue, xdata.values))
-                        # include in dict key is the position and value is a %
-                        PercentCells[well] = (len_thres / len_total) * 100
-                    SdCells[well] = np.std(xdata.values)
-                    MadCells[well] = TCA.mad(xdata.values)
-                    MeanCells[well] = np.mean(xdata.values)
-                    MedianCells[well] = np.median(xdata.values)
-
-                mean = pd.DataFrame.from_dict(MeanCells, orient='index').reset_index()
-                mean.columns = [__WellKey, replicaId+" Mean"]
-                MEAN = pd.merge(MEAN, mean, how='left', on=__WellKey)
-
-                median = pd.DataFrame.from_dict(MedianCells, orient='index').reset_index()
-                median.columns = [__WellKey, replicaId+" Median"]
-                MEDIAN = pd.merge(MEDIAN, median, how='left', on=__WellKey)
-
-                std = pd.DataFrame.from_dict(SdCells, orient='index').reset_index()
-                std.columns = [__WellKey, replicaId+" Std"]
-                STD = pd.merge(STD, std, how='left', on=__WellKey)
-
-                mad = pd.DataFrame.from_dict(MadCells, orient='index').reset_index()
-                mad.columns = [__WellKey, replicaId+" Mad"]
-                MAD = pd.merge(MAD, mad, how='left', on=__WellKey)
-
+            for replicaId, stat in STATS.items():
+                MEAN.loc[:, replicaId+" Mean"] = stat['Mean'][i]
+                MEDIAN.loc[:, replicaId+" Median"] = stat['Median'][i]
+                STD.loc[:, replicaId+" Std"] = stat['Std'][i]
+                MAD.loc[:, replicaId+" Mad"] = stat['Mad'][i]
                 if noposcell is False:
-                    percent = pd.DataFrame.from_dict(PercentCells, orient='index').reset_index()
-                    percent.columns = [__WellKey, replicaId+" PosCells"]
-                    PERCENT = pd.merge(PERCENT, percent, how='left', on=__WellKey)
+                    PERCENT.loc[:, replicaId+" PosCells"] = stat['PosCells'][i]
 
             MEAN.loc[:, "Mean mean"] = MEAN.iloc[:, -NREP:].mean(axis=1)
             MEDIAN.loc[:, "Median mean"] = MEDIAN.iloc[:, -NREP:].mean(axis=1)
@@ -256,7 +334,8 @@ def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=
                 if neg is not None:
                     if NREP > 1:
                         NegData = np.concatenate(PERCENT[PERCENT.loc[:, "PlateMap"] == neg].iloc[:, -NREP-2:-2].values).flatten()
-                        pvalue = PERCENT.iloc[:, -NREP-2: -2].apply((lambda x: stats.ttest_ind(x, NegData, equal_var=False)[1]), axis=1)
+                        pvalue = stats.ttest_ind(PERCENT.iloc[:, -NREP-2: -2].values.astype(float),
+                                                 NegData[np.newaxis, :], axis=1, equal_var=False)[1]
                         PERCENT.loc[:, "PosCells pvalue"] = pvalue
                         PERCENT.loc[:, "PosCells fdr"] = TCA.adjustpvalues(pvalues=PERCENT.loc[:, "PosCells pvalue"])
 
@@ -300,3 +379,84 @@ def PlateChannelsAnalysis(plate, channels=None, neg=None, threshold=50, percent=
             return result
     else:
         return result
+
+
+def __replica_channels_stats(replica, channels, wells, thresholds=None):
+    """
+    Compute mean, std, median, mad and percent of cells above threshold of each well for multiple channels, all wells
+    are reduced at once from by well layout of raw data (see WellIndex), with same results as numpy functions on
+    data of each well
+    :param replica: replica object
+    :param channels: list of channels
+    :param wells: wells for which statistics are returned, NaN for wells without cells
+    :param thresholds: threshold of each channel for positive cells, None for not computing percent
+    :return: dict with statistic as key and numpy array of shape (channel, well) as value
+    """
+    replica.load_channels(channels)
+    wellidx, cells = replica.get_well_layout()
+    counts = wellidx.get_counts()
+    begin = wellidx.offsets[:-1]
+    empty = len(wellidx) == 0 or wellidx.offsets[-1] == 0
+    # # position of wanted wells in layout
+    position = pd.Index(wellidx.wells.astype(str)).get_indexer(np.asarray(wells).astype(str))
+    found = position >= 0
+
+    res = dict((stat, np.full((len(channels), len(wells)), np.nan)) for stat in ['Mean', 'Std', 'Median', 'Mad'])
+    if thresholds is not None:
+        res['PosCells'] = np.full((len(channels), len(wells)), np.nan)
+    if empty:
+        return res
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i, chan in enumerate(channels):
+            data = replica.df[chan].values[cells]
+            values = np.asarray(data, dtype=np.float64)
+            # # NaN of a well are kept in mean, std and median like numpy functions
+            mean = np.add.reduceat(values, begin) / counts
+            std = np.sqrt(np.add.reduceat((values - np.repeat(mean, counts)) ** 2, begin) / counts)
+            svalues, n = wellidx.sort_values(values)
+            median = wellidx.sorted_median(svalues, n, skipna=False)
+            # # mad skip NaN
+            deviation = np.abs(values - np.repeat(wellidx.sorted_median(svalues, n), counts))
+            mad = 1.4826 * wellidx.sorted_median(*wellidx.sort_values(deviation))
+            for stat, value in (('Mean', mean), ('Std', std), ('Median', median), ('Mad', mad)):
+                res[stat][i, found] = value[position[found]]
+            if thresholds is not None:
+                above = np.add.reduceat(data > thresholds[i], begin, dtype=np.int64)
+                res['PosCells'][i, found] = (above / counts * 100)[position[found]]
+    return res
+
+
+def PlateWellSummary(plate, channels=None, stats=('count', 'mean', 'std', 'min', 'max')):
+    """
+    Per well statistics of all replica of plate, work also with replica in summary mode (no single cell data)
+    :param plate: plate object
+    :param channels: list of channels, all numeric channels if None
+    :param stats: statistics to compute for each channel (see WellSummary.get_stat)
+    :return: result into dataframe
+    """
+    assert isinstance(plate, TCA.Plate)
+
+    if not len(plate) > 0:
+        log.error('Empty Plate Object, add some replica to perform PlateWellSummary')
+        return
+
+    if channels is not None and not isinstance(channels, list):
+        channels = [channels]
+
+    __WellKey = plate.WellKey
+    SIZE = plate.get_platemap().shape(alt_frmt=True)
+
+    result = pd.DataFrame(plate.platemap.as_array())
+    result.loc[:, 'PlateName'] = np.repeat([plate.name], SIZE)
+
+    for replicaId, replica in plate:
+        df = replica.get_well_summary(channels).to_frame(stats=stats, channels=channels)
+        df.columns = [col if col == __WellKey else replicaId+" "+col for col in df.columns]
+        df.loc[:, __WellKey] = df.loc[:, __WellKey].astype(str)
+        result = pd.merge(result, df, how='left', on=__WellKey)
+
+    count = result.loc[:, [replicaId+" CellsCount" for replicaId, replica in plate]]
+    result.loc[:, "CellsCount Mean"] = count.mean(axis=1)
+    result.loc[:, "CellsCount Std"] = count.std(axis=1)
+    return result
@@ -5,10 +5,12 @@ from TransCellAssay.Stat.Score.KZscore import plate_kzscore
 from TransCellAssay.Stat.Score.TStat import plate_tstat
 from TransCellAssay.Stat.Score.TTest import plate_ttest
 from TransCellAssay.Stat.Score.ZScore import plate_zscore
-from TransCellAssay.Stat.Score.PlateAnalysis import PlateChannelsAnalysis, getEventsCounts, getThreshold
+from TransCellAssay.Stat.Score.PlateAnalysis import PlateChannelsAnalysis, PlateWellSummary, getEventsCounts, \
+    getThreshold, getThresholdSweep
 from TransCellAssay.Stat.Score.Rank import rank_product
 from TransCellAssay.Stat.Score.Utils import ScoringPlate
-from TransCellAssay.Stat.Score.Binning import Binning
+from TransCellAssay.Stat.Score.Binning import Binning, binning_counts, get_bin_edges, joint_binning_counts, \
+    joint_histogram
 from TransCellAssay.Stat.Score.SSMD_old import plate_ssmd_score_old
 from TransCellAssay.Stat.Score.TStat_old import plate_tstat_score_old
 from TransCellAssay.Stat.Score.TTest_old import plate_ttest_score_old
@@ -1,5 +1,6 @@
 # coding=utf-8
 __author__ = 'Arnaud KOPP'
 from TransCellAssay.Stat.Normalization import *
-from TransCellAssay.Stat.QC import plate_quality_control, plates_quality_control
+from TransCellAssay.Stat.QC import plate_quality_control, plates_quality_control, array_quality_control, \
+    quality_control_metrics, plate_normalization_sweep
 from TransCellAssay.Stat.Score import *
@@ -0,0 +1,334 @@
+# coding=utf-8
+"""
+Batch analysis of a screen without GUI, plates are analysed in parallel by a pool of workers, each worker write its
+plate results in csv files as soon as plate is done, results of all plates are then gathered in RESULT.xlsx.
+
+Input files are found in a directory with name pattern, like in batch mode of MainApp :
+    plate file : XXX{0}.{1}.csv  -> {0} plate number, {1} replica number
+    platemap : PP_{0}.csv or PP.csv
+"""
+
+import os
+import time
+import contextlib
+import threading
+import multiprocessing
+import concurrent.futures
+import pandas as pd
+import TransCellAssay as TCA
+import logging
+log = logging.getLogger(__name__)
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+# # result key -> sheet name in RESULT.xlsx
+RESULT_SHEETS = [('analysis', "Analyse without norm"),
+                 ('analysis_norm', "Analyse with norm"),
+                 ('qc', "QC without norm"),
+                 ('qc_norm', "QC with norm"),
+                 ('scoring', "Scoring Without Norm"),
+                 ('scoring_norm', "Scoring With Norm.")]
+
+
+# # limit heatmaps drawn at once in workers (see BatchAnalysis heatmap_jobs), set by _init_worker
+_HEATMAP_SLOTS = None
+
+
+def _init_worker(slots, process=False):
+    """
+    Initialize a worker of pool, heatmaps are drawn without GUI backend in processes
+    :param slots: semaphore limiting the number of heatmaps drawn at once
+    :param process: worker is a process
+    """
+    global _HEATMAP_SLOTS
+    _HEATMAP_SLOTS = slots
+    if process:
+        import matplotlib
+        matplotlib.use('Agg')
+
+
+def __heatmap(plate, fpath, **kwargs):
+    """
+    Write heatmap of plate, only heatmap_jobs heatmaps are drawn at once by workers (each one need a lot of memory)
+    """
+    with _HEATMAP_SLOTS if _HEATMAP_SLOTS is not None else contextlib.nullcontext():
+        TCA.HeatMapPlate(plate, fpath=fpath, **kwargs)
+
+
+def __threshold(value, threshold_type):
+    """
+    Threshold value and type for PlateChannelsAnalysis
+    """
+    if threshold_type == 'Percent':
+        if isinstance(value, dict):
+            return dict((k, 100 - v) for k, v in value.items()), True, False
+        return 100 - value, True, False
+    return value, False, True
+
+
+def _batch_plate(i, dirpath, input_plate_name, input_platemap, nrep, channels, neg=None, pos=None, threshold=50,
+                 threshold_type='Percent', data_norm="", sec="", qc=False, scoring=False, heatmap=False,
+                 summary=False, output=None):
+    """
+    Analyse one plate of batch and write its results in output directory, module function so that it can be run in
+    another process (see BatchAnalysis for parameters)
+    :param i: plate number
+    :return: dict with plate name, written files, log and threshold lines, number of cells and time, None if no data
+    """
+    start = time.time()
+    res = {'index': i, 'name': None, 'files': {}, 'log': [], 'threshold': [], 'cells': 0, 'time': 0.}
+
+    # ## create first a plate object with a platemap object
+    pm_filepath = os.path.join(dirpath, input_platemap.format(i))
+    if not os.path.isfile(pm_filepath):
+        log.warning("File doesn't exist : {}".format(pm_filepath))
+        return None
+    plaque = TCA.Plate(name="Plate nb{}".format(i), platemap=pm_filepath)
+    res['name'] = plaque.name
+    res['log'].append("Create plate : {}".format(plaque.name))
+
+    # create and add replica to main plate object
+    for j in range(1, nrep + 1, 1):
+        file = os.path.join(dirpath, input_plate_name.format(i, j))
+        if os.path.isfile(file):
+            rep = TCA.Core.Replica(name='Rep ' + str(j), fpath=file, summary=summary)
+            res['cells'] += int(rep.get_count().values.sum())
+            plaque + rep
+            res['log'].append("Add data : {}".format(file))
+        else:
+            log.warning("File doesn't exist : {}".format(file))
+
+    # ## if plate object has no replica (because no file found) then continue to next plaque id
+    if len(plaque) == 0:
+        log.error("Empty plate : {}".format(plaque.name))
+        return None
+
+    def __write(key, df):
+        fpath = os.path.join(output, 'plates', '{0}_{1}.csv'.format(plaque.name, key))
+        df.to_csv(fpath, index=False, header=True)
+        res['files'][key] = fpath
+
+    def __analysis(key, prefix):
+        threshold_value, percent_type, threshold_fixed = __threshold(threshold, threshold_type)
+        res['log'].append("Threshold Type : {0} with {1} value".format(threshold_type, threshold))
+        df, thres = TCA.PlateChannelsAnalysis(plaque, channels=channels, neg=neg, threshold=threshold_value,
+                                              percent=percent_type, fixed_threshold=threshold_fixed)
+        res['threshold'].append("{0}{1} @ {2}%: {3}".format(prefix, plaque.name, threshold, thres))
+        __write(key, df)
+
+    # #### CHANNEL ANALYSIS WITHOUT NORM
+    if summary:
+        __write('analysis', TCA.PlateWellSummary(plaque, channels=channels))
+        res['log'].append("* Do wells statistics on channels : {}".format(channels))
+    else:
+        __analysis('analysis', "")
+        res['log'].append("* Do analysis on channels : {}".format(channels))
+
+    # scoring results on non-normalized data
+    if scoring:
+        __write('scoring', TCA.ScoringPlate(plaque, neg=neg, channel=channels[0], data_c=False))
+        res['log'].append("* Do scoring on non-normalized data")
+
+    # # make QC if wanted
+    if qc:
+        __write('qc', TCA.plate_quality_control(plate=plaque, channel=channels[0], cneg=neg, cpos=pos,
+                                                sec_data=False))
+        res['log'].append("* Do QC on non-normalized data")
+
+    # # save heatmap if wanted
+    if heatmap:
+        for chan in channels:
+            plaque.agg_data_from_replica_channel(channel=chan, forced_update=True)
+            __heatmap(plaque, os.path.join(output, "HEATMAP_WithoutNorm_{0}_{1}.pdf".format(plaque.name, chan)),
+                      size=20.)
+
+    # ##### NORMALIZED PIPELINE BEGIN HERE
+    # Raw data normalization
+    if data_norm != "":
+        plaque.normalization_channels(channels=channels, method=data_norm, neg=neg, pos=pos, log_t=False)
+        res['log'].append("DO single cell data normalization : \n  -> Channels : {0}\n  -> Method : {1}\n"
+                          "  -> Neg : {2}\n  -> Pos : {3}".format(channels, data_norm, neg, pos))
+
+    # side effect normalization
+    if sec != "":
+        plaque.apply_systematic_error_correction(algorithm=sec, apply_down=True, max_iterations=10)
+        res['log'].append("DO side effect normalization : {0}".format(sec))
+
+    if data_norm != "":
+        # #### CHANNEL ANALYSIS WITH NORM
+        __analysis('analysis_norm', "Normalized ")
+        res['log'].append("* Do analysis on normalized channels : {}".format(channels))
+
+    if data_norm != "" or sec != "":
+        # scoring results on normalized data
+        if scoring:
+            if sec == "":
+                plaque.agg_data_from_replica_channel(channel=channels[0], forced_update=True)
+            __write('scoring_norm', TCA.ScoringPlate(plaque, neg=neg, channel=channels[0], data_c=sec != ""))
+            res['log'].append("* Do scoring on normalized data")
+
+        # ## QC after norm data
+        if qc:
+            __write('qc_norm', TCA.plate_quality_control(plate=plaque, channel=channels[0], cneg=neg, cpos=pos,
+                                                         sec_data=sec != ""))
+            res['log'].append("* Do QC on normalized data")
+
+        # ## plot heatmap after data norm
+        if heatmap:
+            for chan in channels:
+                plaque.agg_data_from_replica_channel(channel=chan, forced_update=True, use_sec_data=sec != "")
+                __heatmap(plaque, os.path.join(output, "HEATMAP_WithNorm_{0}_{1}.pdf".format(plaque.name, chan)),
+                          size=20.)
+
+    res['time'] = time.time() - start
+    return res
+
+
+def BatchAnalysis(dirpath, input_plate_name, input_platemap, nplate, nrep, channels, neg=None, pos=None,
+                  threshold=50, threshold_type='Percent', data_norm="", sec="", meansd_ref="", qc=False,
+                  scoring=False, heatmap=False, summary=False, output=None, n_jobs=None, executor='process',
+                  excel=True, heatmap_jobs=1):
+    """
+    Analyse all plates of a screen in parallel, same pipeline than batch mode of MainApp
+    :param dirpath: directory of input files
+    :param input_plate_name: name pattern of replica files, {0} is plate number and {1} replica number
+    :param input_platemap: name pattern of platemap files, {0} is plate number
+    :param nplate: number of plates
+    :param nrep: number of replica for each plate
+    :param channels: list of channels to analyse, first one is used for scoring and QC
+    :param neg: name of negative reference in platemap
+    :param pos: name of positive reference in platemap
+    :param threshold: threshold value, single value or dict channel -> value
+    :param threshold_type: 'Percent' (percent of positive cells in negative) or 'value'
+    :param data_norm: single cell data normalization method, "" for none (not available in summary mode)
+    :param sec: systematic error correction method, "" for none
+    :param meansd_ref: references (separate by space) for which mean and std are saved, "" for none
+    :param qc: do QC with neg and pos
+    :param scoring: do scoring
+    :param heatmap: plot heatmap of plates
+    :param summary: read files by chunk into per well statistics (see WellSummary), no single cell analysis
+    :param output: output directory, default to a timestamp directory in dirpath
+    :param n_jobs: number of workers, default to number of cpu
+    :param executor: 'process', 'thread' or None for serial, processes draw heatmaps with Agg backend, use 'thread'
+    from a GUI
+    :param excel: gather results of all plates in RESULT.xlsx
+    :param heatmap_jobs: max number of heatmaps drawn at once by workers, a heatmap (500 dpi) need more than 1 GB
+    :return: output directory
+    """
+    if summary and data_norm != "":
+        log.warning("Single cell data normalization is not available in summary mode")
+        data_norm = ""
+    if not isinstance(channels, list):
+        channels = [channels]
+
+    # create a directory where data is located with timestamp as dir name
+    if output is None:
+        output = os.path.join(dirpath, time.asctime())
+    if not os.path.isdir(os.path.join(output, 'plates')):
+        os.makedirs(os.path.join(output, 'plates'))
+
+    kwargs = dict(dirpath=dirpath, input_plate_name=input_plate_name, input_platemap=input_platemap, nrep=nrep,
+                  channels=channels, neg=neg, pos=pos, threshold=threshold, threshold_type=threshold_type,
+                  data_norm=data_norm, sec=sec, qc=qc, scoring=scoring, heatmap=heatmap, summary=summary,
+                  output=output)
+    plates = list(range(1, nplate + 1))
+    results = {}
+    start = time.time()
+    ncells = 0
+    ndone = 0
+
+    # ## File for saving log and threshold value
+    with open(os.path.join(output, "THRESHOLD_VALUE.txt"), 'w') as thrfile, \
+            open(os.path.join(output, "PROCESS_LOGFILE.txt"), 'w') as logfile:
+
+        def __done(res):
+            results[res['index']] = res
+            for line in res['log']:
+                logfile.write("{0} \n".format(line))
+            for line in res['threshold']:
+                thrfile.write("{0} \n".format(line))
+            logfile.flush()
+            thrfile.flush()
+
+        def __progress(i, res):
+            elapsed = time.time() - start
+            log.info("[{0}/{1}] Plate {2} {3} in {4:.1f}s -> {5:.2f} plates/min, {6:.0f} cells/s".format(
+                ndone, len(plates), i, "skipped" if res is None else "done",
+                0. if res is None else res['time'], 60. * len(results) / elapsed, ncells / elapsed))
+
+        if executor is None or len(plates) < 2:
+            for i in plates:
+                res = _batch_plate(i, **kwargs)
+                ndone += 1
+                if res is not None:
+                    ncells += res['cells']
+                    __done(res)
+                __progress(i, res)
+        else:
+            n_jobs = n_jobs if n_jobs is not None else os.cpu_count() or 1
+            if executor == 'process':
+                slots = multiprocessing.BoundedSemaphore(max(1, heatmap_jobs))
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                                              initargs=(slots, True))
+            else:
+                _init_worker(threading.BoundedSemaphore(max(1, heatmap_jobs)))
+                pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_jobs)
+            with pool as workers:
+                futures = dict((workers.submit(_batch_plate, i, **kwargs), i) for i in plates)
+                for future in concurrent.futures.as_completed(futures):
+                    res = future.result()
+                    ndone += 1
+                    if res is not None:
+                        ncells += res['cells']
+                        __done(res)
+                    __progress(futures[future], res)
+            _init_worker(None)
+
+    log.info("Batch of {0} plates done in {1:.1f}s".format(len(results), time.time() - start))
+
+    # #### WRITING RESULT PART
+    # # don't save anything if anything was compute
+    if excel and len(results) != 0:
+        __write_excel(results, output, meansd_ref, data_norm)
+    return output
+
+
+def __gather(results, key):
+    """
+    Concatenate result of all plates in plate order
+    """
+    files = [results[i]['files'][key] for i in sorted(results) if key in results[i]['files']]
+    if len(files) == 0:
+        return None
+    return pd.concat([pd.read_csv(fpath) for fpath in files])
+
+
+def __write_excel(results, output, meansd_ref="", data_norm=""):
+    """
+    Write results of all plates into RESULT.xlsx
+    """
+    workbook = pd.ExcelWriter(os.path.join(output, "RESULT.xlsx"))
+    for key, sheet in RESULT_SHEETS:
+        df = __gather(results, key)
+        if df is not None:
+            df.to_excel(excel_writer=workbook, sheet_name=sheet, index=False, header=True)
+
+    # # save mean and sd for given reference
+    if meansd_ref != "":
+        for key, suffix in [('analysis', ""), ('analysis_norm', " Norm")]:
+            df = __gather(results, key)
+            if df is None or (key == 'analysis_norm' and data_norm == ""):
+                continue
+            x = df[df.PlateMap.isin(meansd_ref.split())]
+            x.groupby(by=['PlateName', 'PlateMap']).mean().to_excel(excel_writer=workbook,
+                                                                    sheet_name="Reference Mean" + suffix,
+                                                                    index=True, header=True)
+            x.groupby(by=['PlateName', 'PlateMap']).std().to_excel(excel_writer=workbook,
+                                                                   sheet_name="Reference std" + suffix,
+                                                                   index=True, header=True)
+    workbook.close()
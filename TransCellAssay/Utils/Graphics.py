@@ -167,7 +167,8 @@ def HeatMap(obj, annot=True, size=(17, 12), fmt='d', sec_data=False, title=None,
 
 def HeatMapPlate(plate, sec_data=False, fpath=None, size=3., render="seaborn", cmap="YlGnBu"):
     """
-    Make heatmap of array from all replica of given plate object
+    Make heatmap of array from all replica of given plate object, when written in a file the figure is drawn on its
+    own canvas (not pyplot current figure) so that heatmaps can be made in several threads
     :param plate: plate
     :param sec_data: use norm data or not
     :param fpath: file path for writing graph
@@ -175,7 +176,6 @@ def HeatMapPlate(plate, sec_data=False, fpath=None, size=3., render="seaborn", c
     :param render: seaborn or matplotlib
     :param cmap: color map
     """
-    import matplotlib.pylab as plt
     import numpy as np
 
     assert isinstance(plate, TCA.Plate)
@@ -188,20 +188,27 @@ def HeatMapPlate(plate, sec_data=False, fpath=None, size=3., render="seaborn", c
         a = 2
     else:
         a = 1
-    fig = plt.figure(figsize=(size*b*1.5, size*a))
+    if fpath is not None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=(size*b*1.5, size*a))
+        FigureCanvasAgg(fig)
+    else:
+        import matplotlib.pylab as plt
+        fig = plt.figure(figsize=(size*b*1.5, size*a))
     i = 1
     for key, value in plate:
         if render == "matplotlib":
             ax = fig.add_subplot(a, b, i)
-            plt.pcolormesh(np.ma.masked_invalid(value.array), cmap=cmap, edgecolors='k')
-            plt.colorbar()
+            mesh = ax.pcolormesh(np.ma.masked_invalid(value.array), cmap=cmap, edgecolors='k')
+            fig.colorbar(mesh, ax=ax)
             ax.set_title(str(plate.name)+" "+str(value.name))
             # # tab like display
             ax.invert_yaxis()
             if sec_data:
                 ax = fig.add_subplot(a, b, i+b)
-                plt.pcolormesh(np.ma.masked_invalid(value.array_c), cmap=cmap, edgecolors='k')
-                plt.colorbar()
+                mesh = ax.pcolormesh(np.ma.masked_invalid(value.array_c), cmap=cmap, edgecolors='k')
+                fig.colorbar(mesh, ax=ax)
                 ax.set_title(str(plate.name)+" "+str(value.name)+"_SEC")
                 # # tab like display
                 ax.invert_yaxis()
@@ -211,17 +218,16 @@ def HeatMapPlate(plate, sec_data=False, fpath=None, size=3., render="seaborn", c
             ax = fig.add_subplot(a, b, i)
             ax.set_title(str(plate.name)+" "+str(value.name))
             sns.set()
-            sns.heatmap(value.array, cmap=cmap)
+            sns.heatmap(value.array, cmap=cmap, ax=ax)
             if sec_data:
                 ax = fig.add_subplot(a, b, i+b)
                 ax.set_title(str(plate.name)+" "+str(value.name)+"_SEC")
                 sns.set()
-                sns.heatmap(value.array_c, cmap=cmap)
+                sns.heatmap(value.array_c, cmap=cmap, ax=ax)
             i += 1
 
     if fpath is not None:
-        plt.savefig(fpath, dpi=500)
-        plt.close()
+        fig.savefig(fpath, dpi=500)
     else:
         plt.show(block=True)
 
@@ -372,6 +378,7 @@ def ReplicaBoxPlotWells(replica, channel, file_path=None):
         import pandas as pd
         import matplotlib.pyplot as plt
 
+        replica.load_channels(channel)
         bp = replica.df.boxplot(column=channel, by=replica.WellKey)
         if file_path is not None:
             plt.savefig(file_path)
@@ -660,7 +667,7 @@ def PlateWellsDistribution(plate, wells, channel, by_name=False, kind='kde', rep
         print(e)
 
 
-def Replica3ChannelsPlot(replica, x, y, z, single_cell=True, skip_wells=[], size=8):
+def Replica3ChannelsPlot(replica, x, y, z, single_cell=True, skip_wells=[], size=8, density=False, nbins=50):
     """
     Plot in 3d raw data with choosen channels and with different color by well
     :param size: size of output writing
@@ -670,8 +677,13 @@ def Replica3ChannelsPlot(replica, x, y, z, single_cell=True, skip_wells=[], size
     :param y: y channel
     :param z: z channel
     :param skip_wells: skip some wells if wanted
+    :param density: plot density of cells for the 3 pairs of channels (2-D histograms of all wells) instead of points
+    :param nbins: number of bins edges for density
     """
     assert isinstance(replica, TCA.Core.Replica)
+    if density:
+        return __replica_channels_density(replica, [(x, y), (x, z), (y, z)], skip_wells=skip_wells, size=size,
+                                          nbins=nbins)
     try:
         import pandas as pd
         import numpy as np
@@ -679,6 +691,7 @@ def Replica3ChannelsPlot(replica, x, y, z, single_cell=True, skip_wells=[], size
         from mpl_toolkits.mplot3d import Axes3D
         from mpl_toolkits.mplot3d import proj3d
 
+        replica.load_channels([x, y, z])
         wells = replica.get_unique_well()
         fig = plt.figure(figsize=(size, size))
         ax = fig.add_subplot(111, projection='3d')
@@ -706,9 +719,56 @@ def Replica3ChannelsPlot(replica, x, y, z, single_cell=True, skip_wells=[], size
         print(e)
 
 
-def D2Plot(x, y, label_x='x', label_y='y', y_lim=None, x_lim=None, marker='o', color='r', title=None, file_path=None):
+def __replica_channels_density(replica, pairs, skip_wells=[], size=8, nbins=50):
+    """
+    Plot density of cells for pairs of channels, 2-D histograms of all pairs are computed in one pass over cells
+    :param replica: replica object
+    :param pairs: list of pairs of channels (x, y)
+    :param skip_wells: skip some wells if wanted
+    :param size: size of each plot
+    :param nbins: number of bins edges
+    """
+    try:
+        import numpy as np
+        from matplotlib import pyplot as plt
+
+        counts, wells, edges = TCA.joint_binning_counts(replica, pairs, nbins=nbins)
+        keep = np.array([well not in skip_wells for well in wells], dtype=bool)
+        counts = counts[:, keep].sum(axis=1)
+
+        fig, axes = plt.subplots(1, len(pairs), figsize=(size * len(pairs), size), squeeze=False)
+        for i, (x, y) in enumerate(pairs):
+            ax = axes[0, i]
+            __plot_density(fig, ax, counts[i], edges[x], edges[y])
+            ax.set_xlabel(x)
+            ax.set_ylabel(y)
+        fig.suptitle('Raw Data density')
+        plt.show(block=True)
+    except Exception as e:
+        print(e)
+
+
+def __plot_density(fig, ax, counts, x_edges, y_edges):
+    """
+    Draw a 2-D histogram with log color scale, empty bins are not drawn
+    :param fig: figure
+    :param ax: axe to draw on
+    :param counts: numpy array of shape (bin x, bin y)
+    :param x_edges: x bins edges
+    :param y_edges: y bins edges
+    """
+    import numpy as np
+    from matplotlib.colors import LogNorm
+
+    mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), norm=LogNorm(), cmap='viridis')
+    fig.colorbar(mesh, ax=ax, label='Cells')
+
+
+def D2Plot(x, y, label_x='x', label_y='y', y_lim=None, x_lim=None, marker='o', color='r', title=None, file_path=None,
+           bins=None):
     """
     x and y array
+    :param bins: if provided, plot density of points (2-D histogram with this number of bins edges) instead of points
     :param label_x: label for x
     :param label_y: label for y
     :param y_lim: y axe lim
@@ -724,7 +784,11 @@ def D2Plot(x, y, label_x='x', label_y='y', y_lim=None, x_lim=None, marker='o', c
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
-    plt.scatter(y.flatten(), x.flatten(), c=color, marker=marker, label='Value')
+    if bins is not None:
+        counts, h_edges, v_edges = TCA.joint_histogram(y, x, bins=bins)
+        __plot_density(fig, ax, counts, h_edges, v_edges)
+    else:
+        plt.scatter(y.flatten(), x.flatten(), c=color, marker=marker, label='Value')
 
     ax.set_ylabel(label_y)
     ax.set_xlabel(label_x)
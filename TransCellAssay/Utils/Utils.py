@@ -58,6 +58,54 @@ def get_opposite_well_format(to_conv, bignum=False):
         print(e)
 
 
+def get_wells_coord(wells):
+    """
+    Vectorized version of get_opposite_well_format for a list of well, A1 to (0,0) ... AF48 to (31,47)
+    :param wells: list or array of well in str format
+    :return: tuple of numpy array (rows, cols), -1 for well that can't be converted
+    """
+    parts = pd.Series(np.asarray(wells, dtype=object)).astype(str).str.extract(r"^\s*([a-zA-Z]+)([0-9]+)\s*$")
+    rows = parts[0].str.upper().map(lettereq)
+    cols = pd.to_numeric(parts[1]) - 1
+    invalid = (rows.isnull() | cols.isnull()).values
+    rows = rows.fillna(-1).values.astype(np.int64)
+    cols = cols.fillna(-1).values.astype(np.int64)
+    rows[invalid] = -1
+    cols[invalid] = -1
+    return rows, cols
+
+
+def compact_dataframe(df, well_key='Well', exact=False):
+    """
+    Reduce memory of single cell data, float channels are stored in float32 (about 7 significant digits, relative
+    rounding error up to 6e-8), integer channels in smallest integer type and well as categorical
+    A float channel is kept in float64 if a finite value overflow float32, or with exact if a value change by the
+    conversion (only channels with values exactly representable in float32 are converted, like counts or areas)
+    :param df: pandas dataframe
+    :param well_key: well column name
+    :param exact: convert float channels only without any precision loss
+    :return: compacted dataframe
+    """
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if col == well_key:
+            if df[col].dtype.name != 'category':
+                df[col] = df[col].astype('category')
+        elif df[col].dtype == np.float64:
+            values = df[col].values
+            with np.errstate(over='ignore'):
+                compact = values.astype(np.float32)
+            # # finite values out of float32 range become inf
+            if np.any(np.isinf(compact) & np.isfinite(values)):
+                continue
+            if exact and not np.array_equal(compact.astype(np.float64), values, equal_nan=True):
+                continue
+            df[col] = compact
+        elif np.issubdtype(df[col].dtype, np.integer):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
 def get_masked_array(data_arr, plate_array, to_keep):
     """
     Return an array with data to keep and set to 0 other
@@ -4,3 +4,4 @@ from TransCellAssay.Utils.Graphics import *
 from TransCellAssay.Utils.Utils import *
 from TransCellAssay.Utils.Stat import *
 from TransCellAssay.Utils.ReferenceDataWriter import ReferenceDataWriter
+from TransCellAssay.Utils.Batch import BatchAnalysis
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Headless batch analysis of a screen, same inputs than batch mode of TransCellAssayMainApp, plates are analysed in
+parallel and results of each plate are written as soon as plate is done
+
+    python3 TransCellAssayBatch.py /path/to/screen "XXX{0}.{1}.csv" "PP_{0}.csv" 40 3 -c Ch1 Ch2 --neg Neg --pos Pos
+"""
+import argparse
+import ast
+import logging
+import matplotlib
+matplotlib.use('Agg')
+import TransCellAssay as TCA
+
+__author__ = "Arnaud KOPP"
+__copyright__ = "© 2014-2017 KOPP Arnaud All Rights Reserved"
+__credits__ = ["KOPP Arnaud"]
+__license__ = "GPLv3"
+__maintainer__ = "Arnaud KOPP"
+__email__ = "kopp.arnaud@gmail.com"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TCA batch analysis')
+    parser.add_argument('dirpath', help='Input directory')
+    parser.add_argument('plate_name', help='Input plate name : XXX{0}.{1}.csv ({0} plate, {1} replica)')
+    parser.add_argument('platemap', help='PlateMap name : PP_{0}.csv or PP.csv')
+    parser.add_argument('nplate', type=int, help='Number of source plate')
+    parser.add_argument('nrep', type=int, help='Number of replica for each source plate')
+    parser.add_argument('-c', '--channels', nargs='+', required=True, help='Which channels to analyse')
+    parser.add_argument('--neg', default=None, help='Name of neg reference in platemap')
+    parser.add_argument('--pos', default=None, help='Name of pos reference in platemap')
+    parser.add_argument('--threshold', default='50',
+                        help="Threshold value for positive cells, X for all chan or {'chan' : 10} for specified")
+    parser.add_argument('--threshold-type', default='Percent', choices=('Percent', 'value'))
+    parser.add_argument('--norm', default="", choices=("", "Zscore", "RobustZscore", "PercentOfSample",
+                                                       "RobustPercentOfSample", "PercentOfControl",
+                                                       "RobustPercentOfControl", "NormalizedPercentInhibition"),
+                        help='Data normalization')
+    parser.add_argument('--sec', default="", choices=("", "Bscore", "BZscore", "PMP", "MEA", "Lowess", "Polynomial"),
+                        help='Side Effect normalization')
+    parser.add_argument('--meansd', default="", help='Ref for having mean and SD (separate by space)')
+    parser.add_argument('--qc', action='store_true', help='Do QC with Neg and Pos reference')
+    parser.add_argument('--scoring', action='store_true', help='Do scoring')
+    parser.add_argument('--heatmap', action='store_true', help='Plot heatmap')
+    parser.add_argument('--summary', action='store_true',
+                        help='Read files by chunk into per well statistics (no single cell analysis)')
+    parser.add_argument('-o', '--output', default=None, help='Output directory (default : timestamp in dirpath)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of workers (default : number of cpu)')
+    parser.add_argument('--executor', default='process', choices=('process', 'thread', 'serial'))
+    parser.add_argument('--heatmap-jobs', type=int, default=1,
+                        help='Max number of heatmaps drawn at once (each one need more than 1 GB)')
+    parser.add_argument('--no-excel', action='store_true', help="Don't gather results in RESULT.xlsx")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S')
+
+    output = TCA.BatchAnalysis(dirpath=args.dirpath, input_plate_name=args.plate_name, input_platemap=args.platemap,
+                               nplate=args.nplate, nrep=args.nrep, channels=args.channels, neg=args.neg,
+                               pos=args.pos, threshold=ast.literal_eval(args.threshold),
+                               threshold_type=args.threshold_type, data_norm=args.norm, sec=args.sec,
+                               meansd_ref=args.meansd, qc=args.qc, scoring=args.scoring, heatmap=args.heatmap,
+                               summary=args.summary, output=args.output, n_jobs=args.jobs,
+                               executor=None if args.executor == 'serial' else args.executor,
+                               excel=not args.no_excel, heatmap_jobs=args.heatmap_jobs)
+    logging.info("Results in {}".format(output))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,6 @@ import os
 import os.path
 import logging
 import pandas as pd
-import time
 import string
 
 __author__ = "Arnaud KOPP"
@@ -235,7 +234,13 @@ class MainAppFrame(tkinter.Frame):
         self.BatchHeatMap.set(0)
         tkinter.Label(window, text="Plot or not heatmap").grid(row=15, column=2)
 
-        tkinter.Button(window, text="GO Batch Analysis", command=self._DoBatchAnalyse).grid(row=16, column=1)
+        self.BatchSummary = IntVar()
+        Checkbutton(window, text="Summary only", variable=self.BatchSummary).grid(row=16, column=0)
+        self.BatchSummary.set(0)
+        tkinter.Label(window, text="Read files by chunk into per well statistics (no single cell analysis)").grid(
+            row=16, column=2)
+
+        tkinter.Button(window, text="GO Batch Analysis", command=self._DoBatchAnalyse).grid(row=17, column=1)
 
     def AnalyseFrame(self):
         window = Toplevel(self)
@@ -885,270 +890,26 @@ class MainAppFrame(tkinter.Frame):
 
     def _DoBatchAnalyse(self):
 
-        # ## Get all value of arg
-        __BatchDirPath = self.DirPath
-        __BatchInputPlateName = self.BatchInPlateName.get()
-        __BatchInputPlamap = self.BatchPlateMapName.get()
-        __BatchNPlate = int(self.BatchNPlate.get())
-        __BatchNRep = int(self.BatchNRep.get())
-        __BatchNeg = self.BatchNegCtrl.get()
-        __BatchPos = self.BatchPosCtrl.get()
-        __BatchChan = self.BatchChan.get()
-        __BatchThresVal = eval(self.BatchThrsVal.get())
-        __BatchThresType = self.BatchThrsType.get()
-        __BatchDataNorm = self.BatchDataNorm.get()
-        __BatchSideEffect = self.BatchSideEffectNorm.get()
-        __BatchMeanSD_Ref = self.BatchMeanSD.get()
-        __BatchQC = bool(self.BatchQC.get())
-        __BatchScoring = bool(self.BatchScoring.get())
-        __BatchHeatmap = bool(self.BatchHeatMap.get())
-
-        # create a directory where data is located with timestamp as dir name
-        __outputDirPath = os.path.join(__BatchDirPath, time.asctime())
-        if not os.path.isdir(__outputDirPath):
-            os.makedirs(__outputDirPath)
-
-        # ## File for saving log and threshold value
-        THRVALUEFILE = LogFile(path=__outputDirPath, name="THRESHOLD_VALUE")
-        LOGFILE = LogFile(path=__outputDirPath, name="PROCESS_LOGFILE")
-
-        # ## lst for saving data
-        DF_result = []
-        DF_resultWithNorm = []
-        QC_BeforeNorm = []
-        QC_AfterNorm = []
-        Scoring_BeforeNorm = []
-        Scoring_AfterNorm = []
-
-        for i in range(1, __BatchNPlate + 1, 1):
-            # ## create first a plate object with a platemap object
-            pm_filepath = os.path.join(__BatchDirPath, __BatchInputPlamap.format(i))
-            if os.path.isfile(pm_filepath):
-                plaque = TCA.Plate(name="Plate nb{}".format(i), platemap=pm_filepath)
-                LOGFILE.add("Create plate : {}".format(plaque.name))
-            else:
-                logging.warning("File doesn't exist : {}".format(pm_filepath))
-                continue
-
-            # create and add replica to main plate object
-            for j in range(1, __BatchNRep + 1, 1):
-                file = os.path.join(__BatchDirPath, __BatchInputPlateName.format(i, j))
-                if os.path.isfile(file):
-                    plaque + TCA.Core.Replica(name='Rep ' + str(j), fpath=file)
-                    LOGFILE.add("Add data : {}".format(file))
-                else:
-                    logging.warning("File doesn't exist : {}".format(file))
-
-            # ## if plate object has no replica (because no file found) then continue to next plaque id
-            if len(plaque) == 0:
-                logging.error("Empty plate")
-                continue
-
-            # #### CHANNEL ANALYSIS WITHOUT NORM
-            if __BatchThresType == 'Percent':
-                if isinstance(__BatchThresVal, int):
-                    threshold_value = 100 - __BatchThresVal
-                elif isinstance(__BatchThresVal, dict):
-                    threshold_value = dict((k, 100 - v) for k, v in __BatchThresVal.items())
-                percent_type = True
-                threshold_fixed = False
-                LOGFILE.add("Threshold Type : {0} with {1} value".format(__BatchThresType, __BatchThresVal))
-            else:
-                threshold_value = __BatchThresVal
-                percent_type = False
-                threshold_fixed = True
-                LOGFILE.add("Threshold Type : {0} with {1} value".format(__BatchThresType, __BatchThresVal))
-
-            df, thres = TCA.PlateChannelsAnalysis(plaque,
-                                                  channels=__BatchChan.split(),
-                                                  neg=__BatchNeg,
-                                                  threshold=threshold_value,
-                                                  percent=percent_type,
-                                                  fixed_threshold=threshold_fixed)
-
-            if percent_type:
-                THRVALUEFILE.add("{0} @ {1}%: {2}".format(plaque.name, __BatchThresVal, thres))
-            else:
-                THRVALUEFILE.add("{0} @ {1}%: {2}".format(plaque.name, __BatchThresVal, thres))
-            LOGFILE.add("* Do analysis on channels : {}".format(__BatchChan))
-            DF_result.append(df)
-
-            # scoring results on non-normalized data
-            if __BatchScoring:
-                Scoring_BeforeNorm.append(TCA.ScoringPlate(plaque,
-                                                           neg=__BatchNeg,
-                                                           channel=__BatchChan.split()[0],
-                                                           data_c=False))
-                LOGFILE.add("* Do scoring on non-normalized data")
-
-            # # make QC if wanted
-            if __BatchQC:
-                qc = TCA.plate_quality_control(plate=plaque,
-                                               channel=__BatchChan.split()[0],
-                                               cneg=__BatchNeg,
-                                               cpos=__BatchPos,
-                                               sec_data=False)
-                QC_BeforeNorm.append(qc)
-                LOGFILE.add("* Do QC on non-normalized data")
-
-            # # save heatmap if wanted
-            if __BatchHeatmap:
-                for chan in __BatchChan.split():
-                    plaque.agg_data_from_replica_channel(channel=chan, forced_update=True)
-                    TCA.HeatMapPlate(plaque, fpath=os.path.join(__outputDirPath,
-                                                                "HEATMAP_WithoutNorm_{}.pdf".format(plaque.name)),
-                                     size=20.)
-
-            # ##### NORMALIZED PIPELINE BEGIN HERE
-            # Raw data normalization
-            if __BatchDataNorm != "":
-                plaque.normalization_channels(channels=__BatchChan.split(),
-                                              method=__BatchDataNorm,
-                                              neg=chk_empty(__BatchNeg),
-                                              pos=chk_empty(__BatchPos),
-                                              log_t=False)
-                LOGFILE.add(
-                    "DO single cell data normalization : \n  -> Channels : {0}\n  -> Method : {1}\n  -> Neg : {2}\n  -> Pos : {3}".format(
-                        __BatchChan, __BatchDataNorm, __BatchNeg, __BatchPos))
-
-            # side effect normalization
-            if __BatchSideEffect != "":
-                plaque.apply_systematic_error_correction(algorithm=__BatchSideEffect,
-                                                         apply_down=True,
-                                                         max_iterations=10)
-                LOGFILE.add("DO side effect normalization : {0}".format(__BatchSideEffect))
-
-            if __BatchDataNorm:
-                # #### CHANNEL ANALYSIS WITH NORM
-                if __BatchThresType == 'Percent':
-                    if isinstance(__BatchThresVal, int):
-                        threshold_value = 100 - __BatchThresVal
-                    elif isinstance(__BatchThresVal, dict):
-                        threshold_value = dict((k, 100 - v) for k, v in __BatchThresVal.items())
-                    percent_type = True
-                    threshold_fixed = False
-                    LOGFILE.add("Threshold Type : {0} with {1} value".format(__BatchThresType, __BatchThresVal))
-                else:
-                    threshold_value = __BatchThresVal
-                    percent_type = False
-                    threshold_fixed = True
-                    LOGFILE.add("Threshold Type : {0} with {1} value".format(__BatchThresType, __BatchThresVal))
-
-                df, thres = TCA.PlateChannelsAnalysis(plaque,
-                                                      channels=__BatchChan.split(),
-                                                      neg=__BatchNeg,
-                                                      threshold=threshold_value,
-                                                      percent=percent_type,
-                                                      fixed_threshold=threshold_fixed)
-
-                if percent_type:
-                    THRVALUEFILE.add(
-                        "Normalized {0} @ {1}%: {2}".format(plaque.name, __BatchThresVal, thres))
-                else:
-                    THRVALUEFILE.add("Normalized {0} @ {1}%: {2}".format(plaque.name, __BatchThresVal, thres))
-                LOGFILE.add("* Do analysis on normalized channels : {}".format(__BatchChan))
-                DF_resultWithNorm.append(df)
-
-            # #### CHANNEL ANALYSIS WITH NORM
-            if __BatchDataNorm or __BatchSideEffect != "":
-
-                # scoring results on normalized data
-                if __BatchScoring:
-                    if __BatchSideEffect == "":
-                        plaque.agg_data_from_replica_channel(channel=__BatchChan.split()[0],
-                                                             forced_update=True)
-                        Scoring_AfterNorm.append(TCA.ScoringPlate(plaque,
-                                                                  neg=__BatchNeg,
-                                                                  channel=__BatchChan.split()[0],
-                                                                  data_c=False))
-                    else:
-                        Scoring_AfterNorm.append(TCA.ScoringPlate(plaque,
-                                                                  neg=__BatchNeg,
-                                                                  channel=__BatchChan.split()[0],
-                                                                  data_c=True))
-                    LOGFILE.add("* Do scoring on normalized data")
-
-                # ## QC after norm data
-                if __BatchQC:
-                    if __BatchSideEffect != "":
-                        use_sec_data = True
-                    else:
-                        use_sec_data = False
-                    qc = TCA.plate_quality_control(plate=plaque,
-                                                   channel=__BatchChan.split()[0],
-                                                   cneg=__BatchNeg,
-                                                   cpos=__BatchPos,
-                                                   sec_data=use_sec_data)
-                    QC_AfterNorm.append(qc)
-                    LOGFILE.add("* Do QC on normalized data")
-
-                # ## plot heatmap after data norm
-                if __BatchHeatmap:
-                    for chan in __BatchChan.split():
-                        plaque.agg_data_from_replica_channel(channel=chan, forced_update=True,
-                                                             use_sec_data=__BatchSideEffect)
-                        TCA.HeatMapPlate(plaque, fpath=os.path.join(__outputDirPath,
-                                                                    "HEATMAP_WithNorm_{}.pdf".format(plaque.name)),
-                                         size=20.)
-
-        # #### WRITING RESULT PART
-
-        # # don't save anything if anything was compute
-        if len(DF_result) != 0:
-
-            workbook = pd.ExcelWriter(os.path.join(__outputDirPath, "RESULT.xlsx"))
-
-            # # save basic data before norm like value for each wells
-            beforenorm = pd.concat(DF_result)
-            beforenorm.to_excel(workbook, "Analyse without norm",
-                                index=False, header=True)
-
-            if __BatchDataNorm:
-                afternorm = pd.concat(DF_resultWithNorm)
-                afternorm.to_excel(excel_writer=workbook, sheet_name="Analyse with norm",
-                                   index=False, header=True)
-
-            # # save QC data
-            if __BatchQC:
-                pd.concat(QC_BeforeNorm).to_excel(excel_writer=workbook, sheet_name="QC without norm",
-                                                  index=False, header=True)
-
-                if __BatchDataNorm or __BatchSideEffect != "":
-                    pd.concat(QC_AfterNorm).to_excel(excel_writer=workbook, sheet_name="QC with norm",
-                                                     index=False, header=True)
-            # # save mean and sd for given reference
-            if __BatchMeanSD_Ref != "":
-                x = beforenorm[beforenorm.PlateMap.isin(__BatchMeanSD_Ref.split())]
-                x.groupby(by=['PlateName', 'PlateMap']).mean().to_excel(excel_writer=workbook,
-                                                                        sheet_name="Reference Mean",
-                                                                        index=True, header=True)
-                x.groupby(by=['PlateName', 'PlateMap']).std().to_excel(excel_writer=workbook,
-                                                                       sheet_name="Reference std",
-                                                                       index=True, header=True)
-
-                if __BatchDataNorm:
-                    afternorm = pd.concat(DF_resultWithNorm)
-                    x = afternorm[afternorm.PlateMap.isin(__BatchMeanSD_Ref.split())]
-                    x.groupby(by=['PlateName', 'PlateMap']).mean().to_excel(excel_writer=workbook,
-                                                                            sheet_name="Reference Mean Norm",
-                                                                            index=True, header=True)
-                    x.groupby(by=['PlateName', 'PlateMap']).std().to_excel(excel_writer=workbook,
-                                                                           sheet_name="Reference std Norm",
-                                                                           index=True, header=True)
-
-            # # save scoring & if norm where applied
-            if __BatchScoring:
-                pd.concat(Scoring_BeforeNorm).to_excel(excel_writer=workbook, sheet_name="Scoring Without Norm",
-                                                       index=False, header=True)
-                if __BatchDataNorm or __BatchSideEffect != "":
-                    pd.concat(Scoring_AfterNorm).to_excel(excel_writer=workbook, sheet_name="Scoring With Norm.",
-                                                          index=False, header=True)
-
-            workbook.close()
-        # close file
-        THRVALUEFILE.close()
-        LOGFILE.close()
-        logging.info("BATCH FINISH \./")
+        # ## Get all value of arg and run batch with a pool of threads, Tk GUI process must not be forked
+        TCA.BatchAnalysis(dirpath=self.DirPath,
+                          input_plate_name=self.BatchInPlateName.get(),
+                          input_platemap=self.BatchPlateMapName.get(),
+                          nplate=int(self.BatchNPlate.get()),
+                          nrep=int(self.BatchNRep.get()),
+                          channels=self.BatchChan.get().split(),
+                          neg=chk_empty(self.BatchNegCtrl.get()),
+                          pos=chk_empty(self.BatchPosCtrl.get()),
+                          threshold=eval(self.BatchThrsVal.get()),
+                          threshold_type=self.BatchThrsType.get(),
+                          data_norm=self.BatchDataNorm.get(),
+                          sec=self.BatchSideEffectNorm.get(),
+                          meansd_ref=self.BatchMeanSD.get(),
+                          qc=bool(self.BatchQC.get()),
+                          scoring=bool(self.BatchScoring.get()),
+                          heatmap=bool(self.BatchHeatMap.get()),
+                          summary=bool(self.BatchSummary.get()),
+                          executor='thread')
+        logging.info("BATCH FINISH \\./")
 
     # FUNCTION FOR GRAPHIC OUTPUT
 